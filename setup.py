@@ -8,6 +8,6 @@ setup(
     pbr=True,
     # extra metadata that PBR ignores
     long_description_content_type='text/markdown; charset=UTF-8',
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     tests_require=['pytest'],
 )
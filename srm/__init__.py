@@ -5,8 +5,22 @@ Simple ROM Manager - A basic command-line ROM set manager
 # These values are exported for case when user runs `pydoc srm` or `dir(srm)`.
 # It is generally not a good practice for setup.py to import this module directly.
 
-import pbr.version  # type: ignore
+from typing import Any, List
 
 __author__ = 'Patick C. McGinty'
 __email__ = 'casey.mcginty@gmail.com'
-__version__ = pbr.version.VersionInfo('simple_rom_manager').release_string()
+
+
+def __getattr__(name: str) -> Any:
+    # __version__ is resolved on first access (PEP 562), since importing pbr takes longer than the
+    # rest of the CLI startup.
+    if name == '__version__':
+        import pbr.version  # type: ignore
+        version = pbr.version.VersionInfo('simple_rom_manager').release_string()
+        globals()['__version__'] = version
+        return version
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | {'__version__'})
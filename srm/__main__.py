@@ -3,19 +3,36 @@ The default module run when imported from the command line and also the main ent
 setup.py.  Ex:
 
     python3 -m srm
+
+Only click and the command definitions are imported at startup. Each command imports the modules
+it needs when it runs, so simple commands like `status` start quickly.
 """
 
 import click
 
-from . import __version__, cli
+from . import cli
+
+
+def _print_version(ctx: click.Context, _param: click.Parameter, value: bool) -> None:
+    """Like click.version_option(), but the version is only resolved when it is printed."""
+    if not value or ctx.resilient_parsing:
+        return
+    import srm  # __version__ is only found through the module __getattr__()
+    click.echo(f"{ctx.info_name}, version {srm.__version__}")
+    ctx.exit()
 
 
 @click.group()
-@click.version_option(__version__)
+@click.option('--version', is_flag=True, expose_value=False, is_eager=True,
+              callback=_print_version, help='Show the version and exit.')
 def main() -> None:
     """Simple ROM Manager - A basic command-line ROM set manager."""
 
 
+main.add_command(cli.check)
+main.add_command(cli.dupes)
 main.add_command(cli.init)
+main.add_command(cli.repack)
 main.add_command(cli.status)
+main.add_command(cli.update)
 main(prog_name='srm')  # pylint: disable=unexpected-keyword-arg
@@ -0,0 +1,388 @@
+"""
+Manage data cached in the local `.srm` directory.
+
+Cached data can always be regenerated from its source, so any cache entry that is missing, stale
+or unreadable is silently rebuilt.
+"""
+
+import os
+import sqlite3
+import sys
+from typing import Dict  # pylint: disable=unused-import
+from typing import Any, Iterable, Iterator, List, Optional, Set, Tuple
+
+import attr  # type: ignore
+
+from . import dat, file, storage
+
+_CACHE_DIR = ".srm/cache"
+
+# Bump when the layout of a compiled DAT changes, to invalidate all existing caches.
+_DAT_FORMAT = 3
+
+_GAME_FIELDS = tuple(a.name for a in attr.fields(dat.Game) if a.name not in ('roms', 'merges'))
+_GAME_BOOL_FIELDS = tuple(a.name for a in attr.fields(dat.Game) if a.type is bool)
+_GAME_INTERN_FIELDS = tuple(a.name for a in attr.fields(dat.Game) if a.metadata.get('intern'))
+_ROM_FIELDS = tuple(a.name for a in attr.fields(dat.ROM))
+_HEADER_FIELDS = tuple(a.name for a in attr.fields(dat.Header))
+
+# Pending hash cache writes are committed in batches of this size.
+_HASH_BATCH_SIZE = 1000
+
+# Max number of SQL parameters used per bulk query (default SQLite limit is 999).
+_QUERY_CHUNK_SIZE = 500
+
+_HASH_KINDS = ('crc', 'md5', 'sha1')
+
+_HASH_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS hash (
+        dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, path TEXT,
+        crc TEXT, md5 TEXT, sha1 TEXT,
+        PRIMARY KEY (dev, ino));
+    CREATE INDEX IF NOT EXISTS hash_ino ON hash (ino);
+"""
+
+# Columns are declared without a type so values are returned exactly as they were stored.
+_DAT_SCHEMA = f"""
+    CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+    CREATE TABLE game (id INTEGER PRIMARY KEY, {', '.join(_GAME_FIELDS)});
+    CREATE TABLE rom (game_id INTEGER, merge, {', '.join(_ROM_FIELDS)});
+"""
+
+# Indexes are created after all rows are inserted, which is much faster than updating them per row.
+_DAT_INDEXES = """
+    CREATE INDEX rom_game ON rom (game_id);
+    CREATE INDEX rom_crc ON rom (lower(crc));
+    CREATE INDEX rom_md5 ON rom (lower(md5));
+    CREATE INDEX rom_sha1 ON rom (lower(sha1));
+"""
+
+
+def cache_dir(directory: str = '.') -> str:
+    """Return the path of the cache directory of a ROM directory."""
+    return os.path.join(directory, _CACHE_DIR)
+
+
+class DatCache:
+    """Store of compiled DAT files that open much faster than parsing the source XML."""
+
+    def __init__(self, path: str = _CACHE_DIR) -> None:
+        """
+        :param path: Relative or absolute path of the cache directory.
+        """
+        self._path = os.path.expanduser(path)
+
+    def load(self, dat_path: str) -> 'CompiledDat':
+        """
+        Return the DAT from the compiled cache. The DAT is compiled when it is not cached yet, or
+        when the size, mtime and content hash of the source no longer match the cached copy.
+
+        :param dat_path: Path of the DAT XML file.
+        """
+        cache_path = self.cache_path(dat_path)
+        stat = os.stat(dat_path)
+        meta = _read_meta(cache_path)
+        if meta.get('size') == stat.st_size:
+            if meta.get('mtime_ns') == stat.st_mtime_ns:
+                return CompiledDat(cache_path)
+            # file was touched or copied, but may still be the same DAT
+            if meta.get('sha1') == _sha1(dat_path):
+                compiled = CompiledDat(cache_path)
+                compiled.touch(stat.st_mtime_ns)
+                return compiled
+        _compile(dat_path, cache_path, stat)
+        return CompiledDat(cache_path)
+
+    def cache_path(self, dat_path: str) -> str:
+        """Return the path of the compiled copy of a DAT file."""
+        return os.path.join(self._path, os.path.basename(dat_path) + '.sqlite')
+
+
+class HashCache:
+    """
+    Store of file hashes, keyed by the (device, inode, size, mtime_ns) stat identity of each file.
+
+    A cached entry is only valid while the stat identity of the file is unchanged. Writes are
+    buffered and committed in batches; use as a context manager, or call flush(), to commit.
+    """
+
+    def __init__(self, path: str = _CACHE_DIR) -> None:
+        """
+        :param path: Relative or absolute path of the cache directory.
+        """
+        self._db_path = os.path.join(os.path.expanduser(path), 'hashes.sqlite')
+        self._conn = None  # type: Optional[sqlite3.Connection]
+        self._pending = {}  # type: Dict[Tuple[int, int], Tuple[Any, ...]]
+
+    def __enter__(self) -> 'HashCache':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def lookup(self, paths: Iterable[Tuple[str, os.stat_result]]) -> Dict[str, Dict[str, str]]:
+        """
+        Return the cached hashes of many files at once.
+
+        :param paths: (path, stat) of each file to find.
+        :return: Hex digests keyed by 'crc', 'md5' and 'sha1' (only the cached ones), for each
+                 path with a valid cache entry.
+        """
+        wanted = {(stat.st_dev, stat.st_ino): (p, stat) for p, stat in paths}
+        found = {}  # type: Dict[str, Dict[str, str]]
+        for row in self._rows(wanted):
+            path, stat = wanted[(row[0], row[1])]
+            if (row[2], row[3]) == (stat.st_size, stat.st_mtime_ns):
+                found[path] = _row_digests(row)
+        return found
+
+    def get(self, path: str, stat: Optional[os.stat_result] = None) -> Dict[str, str]:
+        """Return the cached hashes of one file, or an empty dict if not cached."""
+        stat = os.stat(path) if stat is None else stat
+        return self.lookup([(path, stat)]).get(path, {})
+
+    def put(self, path: str, stat: os.stat_result, digests: Dict[str, str]) -> None:
+        """
+        Buffer new hashes for a file, replacing any cached ones.
+
+        :param path: Path of the file.
+        :param stat: Stat result of the file taken before it was hashed.
+        :param digests: Hex digests keyed by 'crc', 'md5' and/or 'sha1'.
+        """
+        key = (stat.st_dev, stat.st_ino)
+        self._pending[key] = key + (stat.st_size, stat.st_mtime_ns, path) + tuple(
+            digests.get(k) for k in _HASH_KINDS)
+        if len(self._pending) >= _HASH_BATCH_SIZE:
+            self.flush()
+
+    def digests(self, path: file.Path, crc: bool = True, md5: bool = True,
+                sha1: bool = True) -> Dict[str, str]:
+        """Return the selected hashes of a file, from the cache if possible. See Path.digests()."""
+        stat = path.stat()
+        wanted = {k for k, v in zip(_HASH_KINDS, (crc, md5, sha1)) if v}
+        cached = self.get(str(path), stat)
+        missing = wanted - set(cached)
+        if missing:
+            cached.update(path.digests(**{k: k in missing for k in _HASH_KINDS}))
+            self.put(str(path), stat, cached)
+        return {k: cached[k] for k in wanted}
+
+    def flush(self) -> None:
+        """Commit all buffered writes."""
+        if not self._pending:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany(f"INSERT OR REPLACE INTO hash VALUES ({', '.join('?' * 8)})",
+                             self._pending.values())
+        self._pending.clear()
+
+    def evict(self) -> int:
+        """
+        Remove the cache entries of files that no longer exist or have changed.
+
+        :return: Number of removed entries.
+        """
+        self.flush()
+        conn = self._connect()
+        stale = []
+        for dev, ino, size, mtime_ns, path in conn.execute(
+                'SELECT dev, ino, size, mtime_ns, path FROM hash'):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stale.append((dev, ino))
+                continue
+            found = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if found != (dev, ino, size, mtime_ns):
+                stale.append((dev, ino))
+        with conn:
+            conn.executemany('DELETE FROM hash WHERE dev = ? AND ino = ?', stale)
+        return len(stale)
+
+    def close(self) -> None:
+        """Commit all buffered writes and close the cache file."""
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self._db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self._db_path)
+            self._conn.executescript(_HASH_SCHEMA)
+        return self._conn
+
+    def _rows(self, keys: Iterable[Tuple[int, int]]) -> Iterator[Tuple[Any, ...]]:
+        """Yield the cache rows, including pending writes, of all (dev, ino) keys."""
+        keys = list(keys)
+        pending = [self._pending[k] for k in keys if k in self._pending]
+        yield from pending
+        wanted = set(keys).difference(r[:2] for r in pending)
+        inodes = sorted({ino for _, ino in wanted})
+        conn = self._connect()
+        for i in range(0, len(inodes), _QUERY_CHUNK_SIZE):
+            chunk = inodes[i:i + _QUERY_CHUNK_SIZE]
+            query = f"SELECT * FROM hash WHERE ino IN ({', '.join('?' * len(chunk))})"
+            for row in conn.execute(query, chunk):
+                if (row[0], row[1]) in wanted:
+                    yield row
+
+
+class CompiledDat(dat.Datafile):
+    """
+    DAT backed by a compiled cache file.
+
+    Only the header is read on init. Games are created as they are iterated or matched, and hash
+    lookups use the indexes stored in the cache instead of building a HashIndex in memory.
+    """
+
+    def __init__(self, cache_path: str) -> None:
+        """
+        :param cache_path: Path of a compiled DAT, see DatCache.
+        """
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._pool = dat.RomPool()
+        meta = dict(self._conn.execute('SELECT key, value FROM meta'))
+        header = dat.Header(**{k: meta[k] for k in _HEADER_FIELDS})
+        super().__init__(header, ())
+
+    @property
+    def games(self) -> Iterable[dat.Game]:
+        """Iterable of <game> records from DAT."""
+        roms = self._conn.execute(f"SELECT game_id, merge, {', '.join(_ROM_FIELDS)} FROM rom "
+                                  "ORDER BY game_id")
+        rom_row = next(roms, None)
+        for game_id, *fields in self._conn.execute(
+                f"SELECT id, {', '.join(_GAME_FIELDS)} FROM game ORDER BY id"):
+            rom_rows = []
+            while rom_row is not None and rom_row[0] == game_id:
+                rom_rows.append(rom_row[1:])
+                rom_row = next(roms, None)
+            yield _make_game(fields, rom_rows, self._pool)
+
+    @property
+    def crcs(self) -> Set[str]:
+        """Set of all (lower-case) ROM CRC values in the DAT."""
+        return self._distinct('crc')
+
+    @property
+    def md5s(self) -> Set[str]:
+        """Set of all (lower-case) ROM MD5 values in the DAT."""
+        return self._distinct('md5')
+
+    @property
+    def sizes(self) -> Set[int]:
+        """Set of all ROM sizes in the DAT."""
+        return {row[0] for row in self._conn.execute("SELECT DISTINCT size FROM rom")}
+
+    def matching(self, crc: Optional[str] = None, md5: Optional[str] = None,
+                 sha1: Optional[str] = None, size: Optional[int] = None) -> List[dat.Match]:
+        """See HashIndex.matching()."""
+        if sha1:
+            rows = self._roms_by('sha1', sha1)
+        elif md5:
+            rows = self._roms_by('md5', md5)
+        elif crc:
+            rows = self._roms_by('crc', crc)
+            if size is not None:
+                rows = [r for r in rows if r[1].size == size]
+        else:
+            raise ValueError('Method called with no arguments')
+        return [(self._game(game_id), rom) for game_id, rom in rows]
+
+    def touch(self, mtime_ns: int) -> None:
+        """Update the source mtime recorded in the cache."""
+        with self._conn:
+            self._conn.execute("UPDATE meta SET value = ? WHERE key = 'mtime_ns'", (mtime_ns,))
+
+    def close(self) -> None:
+        """Close the cache file."""
+        self._conn.close()
+
+    def _distinct(self, column: str) -> Set[str]:
+        query = f"SELECT DISTINCT lower({column}) FROM rom WHERE {column} != ''"
+        return {row[0] for row in self._conn.execute(query)}
+
+    def _roms_by(self, column: str, value: str) -> List[Tuple[int, dat.ROM]]:
+        query = (f"SELECT game_id, {', '.join(_ROM_FIELDS)} FROM rom "
+                 f"WHERE lower({column}) = ?")
+        return [(r[0], self._pool.get(dat.ROM(*r[1:])))
+                for r in self._conn.execute(query, (value.lower(),))]
+
+    def _game(self, game_id: int) -> dat.Game:
+        fields = self._conn.execute(f"SELECT {', '.join(_GAME_FIELDS)} FROM game WHERE id = ?",
+                                    (game_id,)).fetchone()
+        roms = self._conn.execute(
+            f"SELECT merge, {', '.join(_ROM_FIELDS)} FROM rom WHERE game_id = ?", (game_id,))
+        return _make_game(fields, roms, self._pool)
+
+
+def _make_game(fields: Iterable[Any], rom_rows: Iterable[Tuple[Any, ...]],
+               pool: dat.RomPool) -> dat.Game:
+    """
+    Return a game from its row and the (merge, *ROM fields) rows of its ROMs. Like the XML parser,
+    identical ROMs are shared through the pool and repeated values are interned.
+    """
+    kwargs = dict(zip(_GAME_FIELDS, fields))
+    for name in _GAME_BOOL_FIELDS:
+        # SQLite stores bool values as int
+        kwargs[name] = bool(kwargs[name])
+    for name in _GAME_INTERN_FIELDS:
+        kwargs[name] = sys.intern(kwargs[name])
+    roms, merges = [], {}
+    for merge, *rom_fields in rom_rows:
+        rom = pool.get(dat.ROM(*rom_fields))
+        roms.append(rom)
+        if merge:
+            merges[rom.name] = sys.intern(merge)
+    game = dat.Game(roms=frozenset(roms), merges=merges, **kwargs)  # type: dat.Game
+    return game
+
+
+def _row_digests(row: Tuple[Any, ...]) -> Dict[str, str]:
+    return {k: v for k, v in zip(_HASH_KINDS, row[5:]) if v}
+
+
+def _sha1(path: str) -> str:
+    return file.Path(path).sha1()
+
+
+def _read_meta(cache_path: str) -> Dict[str, Any]:
+    """Return the meta table of a compiled DAT, or an empty dict if it is missing or outdated."""
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        conn = sqlite3.connect(cache_path)
+        try:
+            meta = dict(conn.execute('SELECT key, value FROM meta'))
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return {}
+    return meta if meta.get('format') == _DAT_FORMAT else {}
+
+
+def _compile(dat_path: str, cache_path: str, stat: os.stat_result) -> None:
+    """Parse a DAT XML file and write the compiled copy to cache_path."""
+    xml = dat.DatafileXml(dat_path, stream=True)
+    with storage.atomic_path(cache_path) as tmp_path:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            with conn:
+                conn.executescript(_DAT_SCHEMA)
+                meta = dict(attr.asdict(xml.header), format=_DAT_FORMAT, size=stat.st_size,
+                            mtime_ns=stat.st_mtime_ns, sha1=_sha1(dat_path))
+                conn.executemany('INSERT INTO meta VALUES (?, ?)', meta.items())
+                games = list(enumerate(xml.games))
+                conn.executemany(
+                    f"INSERT INTO game VALUES ({', '.join('?' * (len(_GAME_FIELDS) + 1))})",
+                    ((i,) + tuple(getattr(g, f) for f in _GAME_FIELDS) for i, g in games))
+                conn.executemany(
+                    f"INSERT INTO rom VALUES ({', '.join('?' * (len(_ROM_FIELDS) + 2))})",
+                    ((i, g.merges.get(r.name, '')) + attr.astuple(r)
+                     for i, g in games for r in g.roms))
+                conn.executescript(_DAT_INDEXES)
+        finally:
+            conn.close()
@@ -1,14 +1,23 @@
 """
 Entry points for all of the primary SRM commands.
+
+Commands import the modules they use when they run, so that the CLI starts quickly no matter how
+many commands are defined. Only click is imported at the top of this module.
 """
+import datetime
+import os
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional
+
 import click
 
-from . import config
+if TYPE_CHECKING:  # pragma: no cover
+    from . import config, summary, verify  # pylint: disable=unused-import
 
 
 @click.command()
 def init() -> None:
     """Initialize the current directory for SRM."""
+    from . import config
     conf = config.LocalConf()
     if not conf.exists():
         conf.load(create=True)
@@ -17,9 +26,186 @@ def init() -> None:
 
 
 @click.command()
-def status() -> None:
+@click.option('--recursive', '-r', is_flag=True, help='Include all managed sub-directories.')
+@click.argument('directory', default='.', type=click.Path(exists=True, file_okay=False))
+def status(recursive: bool, directory: str) -> None:
     """Show ROM state and info."""
-    conf = config.LocalConf()
-    if not conf.exists():
-        raise click.ClickException("Directory is not initialized! Try the 'init' command.")
-    click.echo("temp status")
+    from . import multidir, summary
+    for path, stats in multidir.map_dirs(summary.load, _local_dirs(directory, recursive)):
+        _echo_summary(path, stats)
+
+
+@click.command()
+@click.option('--recursive', '-r', is_flag=True, help='Include all managed sub-directories.')
+@click.argument('directory', default='.', type=click.Path(exists=True, file_okay=False))
+def update(recursive: bool, directory: str) -> None:
+    """Download new versions of the tracked ROM DATs."""
+    from . import multidir, update as updater
+    tracked = multidir.map_dirs(_tracked_dats, _local_dirs(directory, recursive))
+    for result in updater.Updater().update(tracked):
+        if result.error:
+            click.secho(f"{result.url}: {result.error}", fg='red')
+        else:
+            click.echo(f"{result.url}: {'updated' if result.changed else 'up to date'}")
+
+
+@click.command()
+@click.option('--dat', 'dat_file', type=click.Path(exists=True, dir_okay=False),
+              help='DAT file to check against, instead of the tracked DAT.')
+@click.option('--deep', is_flag=True,
+              help='Also verify MD5/SHA1 hashes, and decompress archives instead of trusting the '
+                   'CRCs stored in them.')
+@click.option('--all', 'show_all', is_flag=True, help='Also list good files.')
+@click.argument('directory', default='.', type=click.Path(exists=True, file_okay=False))
+def check(dat_file: Optional[str], deep: bool, show_all: bool, directory: str) -> None:
+    """Verify ROM files against the DAT, and save a summary."""
+    from . import cache, summary, verify
+    _local_dirs(directory, False)
+    datafile = cache.DatCache(cache.cache_dir(directory)).load(dat_file or _tracked_dat(directory))
+    try:
+        with cache.HashCache(cache.cache_dir(directory)) as hash_cache:
+            verdicts = verify.check(directory, datafile, _load_conf(directory).snapshot(),
+                                    hash_cache, deep)
+            stats = summary.tally(datafile, _echo_verdicts(verdicts, show_all))
+            hash_cache.evict()  # forget the files that were deleted or changed since
+    finally:
+        datafile.close()
+    summary.save(stats, directory)
+    _echo_summary(directory, stats)
+
+
+@click.command()
+@click.option('--link', 'link_mode', type=click.Choice(['hardlink', 'reflink']),
+              help='Replace duplicate loose files with hard links or reflinks of the first copy.')
+@click.argument('directory', default='.', type=click.Path(exists=True, file_okay=False))
+def dupes(link_mode: Optional[str], directory: str) -> None:
+    """List files with the same content, including files in archives."""
+    from . import dupes as finder, scan
+    count, wasted = 0, 0
+    for duplicates in finder.find(scan.walk(directory)):
+        count += duplicates.copies - 1
+        wasted += duplicates.size * (duplicates.copies - 1)
+        click.secho(f"{duplicates.sha1} ({_format_size(duplicates.size)}):", bold=True)
+        for path in duplicates.paths:
+            click.echo(f"  {path}")
+        if link_mode:
+            try:
+                replaced = finder.link(duplicates, link_mode)
+            except OSError as error:
+                click.secho(f"  Not linked: {error}", fg='red')
+            else:
+                click.echo(f"  Linked {len(replaced)} file(s).")
+    click.echo(f"{count} duplicate file(s), {_format_size(wasted)} in extra copies.")
+
+
+@click.command()
+@click.option('--dat', 'dat_file', type=click.Path(exists=True, dir_okay=False),
+              help='DAT file to rebuild the set of, instead of the tracked DAT.')
+@click.option('--set-type', type=click.Choice(['split', 'non-merged', 'merged']), default='split',
+              show_default=True, help='Layout of parent, clone and BIOS sets.')
+@click.option('--output', '-o', type=click.Path(file_okay=False),
+              help='Directory of the rebuilt archives, instead of DIRECTORY.')
+@click.argument('directory', default='.', type=click.Path(exists=True, file_okay=False))
+def repack(dat_file: Optional[str], set_type: str, output: Optional[str], directory: str) -> None:
+    """Rebuild the archives of the ROM set from the files found in a directory."""
+    from . import cache, repack as rebuilder, scan
+    _local_dirs(directory, False)
+    datafile = cache.DatCache(cache.cache_dir(directory)).load(dat_file or _tracked_dat(directory))
+    written, missing = 0, 0
+    try:
+        with cache.HashCache(cache.cache_dir(directory)) as hash_cache:
+            results = scan.scan(directory, _load_conf(directory).snapshot(), hash_cache,
+                                md5=False, sha1=False, sizes=datafile.sizes)
+            archives = rebuilder.plan(datafile, scan.match(results, datafile), set_type)
+            for result in rebuilder.repack(archives, output or directory):
+                missing += len(result.missing)
+                if result.error:
+                    click.secho(f"{result.path}: {result.error}", fg='red')
+                elif result.written:
+                    written += 1
+                    click.echo(f"{result.path}: {result.copied} copied, "
+                               f"{result.compressed} compressed, {len(result.missing)} missing")
+    finally:
+        datafile.close()
+    click.echo(f"{written} archive(s) rebuilt, {missing} ROM(s) missing.")
+
+
+def _local_dirs(directory: str, recursive: bool) -> Iterator[str]:
+    from . import config
+    if recursive:
+        return config.find_local_dirs(directory)
+    if config.is_local_dir(directory):
+        return iter([directory])
+    raise click.ClickException("Directory is not initialized! Try the 'init' command.")
+
+
+def _tracked_dats(directory: str) -> List[str]:
+    from . import config
+    conf = config.local_conf(directory)
+    conf.load()
+    return list(conf.get('dat.sources', []))
+
+
+def _tracked_dat(directory: str) -> str:
+    from . import update as updater
+    urls = _tracked_dats(directory)
+    if len(urls) != 1:
+        raise click.ClickException(
+            f"{len(urls)} DATs are tracked by {directory}, use --dat to select one.")
+    path = updater.dat_path(directory, urls[0])
+    if not os.path.exists(path):
+        raise click.ClickException("The tracked DAT was not downloaded yet. Try 'update' first.")
+    return path
+
+
+def _load_conf(directory: str) -> 'config.ChainConf':
+    from . import config
+    conf = config.LocalConf(directory)
+    for layer in conf.maps:
+        if isinstance(layer, config.Conf) and layer.exists():
+            layer.load(lazy=True)
+    return conf
+
+
+# Terminal color of each verdict status.
+_STATUS_COLORS = {'bad': 'red', 'unknown': 'yellow', 'missing': 'magenta'}
+
+
+def _echo_verdicts(verdicts: Iterable['verify.Verdict'],
+                   show_all: bool) -> Iterator['verify.Verdict']:
+    """Print each verdict as it passes through, see check()."""
+    for verdict in verdicts:
+        if verdict.result is not None:
+            name = str(verdict.result.path)
+        else:
+            game, rom = verdict.matches[0]
+            name = f"{game.name}/{rom.name}"
+        if show_all or verdict.status != 'good':
+            click.secho(f"{verdict.status:<10}{name}", fg=_STATUS_COLORS.get(verdict.status))
+        yield verdict
+
+
+def _echo_summary(directory: str, stats: Optional['summary.Summary']) -> None:
+    click.secho(f"{directory}:", bold=True)
+    if stats is None:
+        click.echo("  Not scanned yet.")
+        return
+    last_scan = datetime.datetime.fromtimestamp(stats.last_scan).strftime('%Y-%m-%d %H:%M:%S')
+    click.echo(f"  DAT:       {stats.dat_name} ({stats.dat_version})")
+    click.echo(f"  Last scan: {last_scan}")
+    click.echo(f"  DAT ROMs:  {stats.dat_roms} ({_format_size(stats.dat_size)})")
+    click.echo(f"  Files:     {stats.files} ({_format_size(stats.disk_size)} on disk)")
+    click.echo(f"  Valid:     {stats.valid}")
+    click.echo(f"  Invalid:   {stats.invalid}")
+    click.echo(f"  Duplicate: {stats.duplicate}")
+    click.echo(f"  Missing:   {stats.missing}")
+
+
+def _format_size(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'TiB'
+    return f"{size:.1f} {unit}" if unit != 'B' else f"{int(size)} B"
@@ -3,23 +3,56 @@ Manage global and local configuration data.
 """
 
 import collections
+import contextlib
+import errno
 import os
-from typing import Dict  # pylint: disable=unused-import
-from typing import Any, Iterator, List, Optional, Set, Tuple, cast
+from typing import Dict, List  # pylint: disable=unused-import
+from typing import Any, Iterator, Optional, Set, Tuple, cast
 
-import toml  # type: ignore
-from boltons import funcutils, iterutils  # type: ignore
+from . import storage
 
-# pylint: disable=notimplemented-raised, raising-bad-type
+# toml is only imported when a config file is read or written, since commands like `status` only
+# need the directory helpers of this module.
 
 _LOCAL_PATH = ".srm/config"
 
 _GLOBAL_PATH = "~/.srmconfig"
-_GLOBAL_KEYS = {'my.temp.key'}
+_GLOBAL_KEYS = {'my.temp.key', 'scan.executor', 'scan.workers', 'scan.queue_depth'}
+
+
+def is_local_dir(directory: str) -> bool:
+    """Return True if directory contains a local config."""
+    return os.path.isfile(os.path.join(directory, _LOCAL_PATH))
+
+
+def local_conf(directory: str = '.') -> 'Conf':
+    """Return the local config of a directory, without the global config (see LocalConf)."""
+    return Conf(os.path.join(directory, _LOCAL_PATH))
+
+
+def find_local_dirs(root: str) -> Iterator[str]:
+    """Yield root and every sub-directory of root that contains a local config."""
+    dirs = [root]
+    while dirs:
+        path = dirs.pop()
+        if is_local_dir(path):
+            yield path
+        try:
+            with os.scandir(path) as entries:
+                dirs.extend(sorted((e.path for e in entries
+                                    if e.is_dir(follow_symlinks=False) and e.name != '.srm'),
+                                   reverse=True))
+        except PermissionError:
+            continue
 
 
 class Conf(collections.abc.MutableMapping):
-    """Config store, backed by a TOML formatted file."""
+    """
+    Config store, backed by a TOML formatted file.
+
+    Values are held in a flat dict keyed by dotted names (e.g. 'scan.workers'), so that a lookup is
+    a single dict access. Iterating a config yields the dotted names of all values.
+    """
 
     def __init__(self, path: str, valid_keys: Optional[Set[str]] = None) -> None:
         """
@@ -29,62 +62,114 @@ class Conf(collections.abc.MutableMapping):
         """
         self._path = os.path.expanduser(path)
         self._valid_keys = valid_keys
-        self._toml_dict = {}  # type: Dict[str,Any]
+        self._values = {}  # type: Dict[str, Any]
+        self._deferred = False  # True when the file must be read on the next access
+        self._journal = None  # type: Optional[List[Tuple[str, Any]]]
 
     def exists(self) -> bool:
         """Return True if config exists."""
         return os.path.exists(self._path) and os.path.isfile(self._path)
 
-    def load(self, create: bool = False) -> None:
+    def load(self, create: bool = False, lazy: bool = False) -> None:
         """
         Load all data from the config file.
         :param create: When True, the path and config will be created instead of raising an
                        exception.
+        :param lazy: When True, the file is only parsed when a value is first accessed.
         """
-        try:
-            with open(self._path) as f:
-                self._toml_dict = toml.load(f)
-        except FileNotFoundError:
-            if create:
-                basedir = os.path.dirname(self._path)
-                os.makedirs(basedir)
-                open(self._path, 'w').close()
-            else:
-                raise
+        if not self.exists():
+            if not create:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), self._path)
+            basedir = os.path.dirname(self._path)
+            os.makedirs(basedir)
+            open(self._path, 'w').close()
+        self._deferred = lazy
+        if not lazy:
+            self._values = dict(_read_file(self._path))
 
     def dump(self) -> None:
-        """Dump all values to the config file."""
-        with open(self._path, "w+") as f:
-            toml.dump(self._toml_dict, f)
+        """Dump all values to the config file, replacing the old file atomically."""
+        import toml  # type: ignore
+        with storage.atomic_write(self._path) as f:
+            toml.dump(_unflatten(self._data()), f)
+        _FILE_CACHE.pop(os.path.abspath(self._path), None)
+
+    @contextlib.contextmanager
+    def batch(self) -> Iterator['Conf']:
+        """
+        Save all changes made within the block with a single dump when it exits, unless it raises.
+
+        The file is read again and the changes are applied to it while holding a lock, so parallel
+        runs that change different keys do not overwrite each other. The lock is only held for the
+        final write.
+        """
+        if self._journal is not None:  # nested batch, saved by the outer one
+            yield self
+            return
+        self._journal = []
+        try:
+            yield self
+            journal = self._journal
+        finally:
+            self._journal = None
+        with storage.lock(self._path + '.lock'):
+            if self.exists():
+                # another writer may have changed the file without changing its mtime and size
+                self._deferred = False
+                self._values = dict(_read_file(self._path, use_cache=False))
+            for k, value in journal:
+                if value is _DELETED:
+                    with contextlib.suppress(KeyError):
+                        del self[k]
+                else:
+                    self[k] = value
+            self.dump()
 
     def __getitem__(self, k: str) -> Any:
-        return iterutils.get_path(self._toml_dict, k)
+        values = self._data()
+        if k in values:
+            return values[k]
+        return self._table(k)
 
     def __setitem__(self, k: str, v: Any) -> None:
         if self._valid_keys and k not in self._valid_keys:
             raise KeyError(f"Key {k} is not allowed")
-
-        nested_tables, k = Conf._extract_table_list(k)
-        table = self._toml_dict
-        for i in nested_tables:
-            table = table.setdefault(i, dict())
-        table[k] = v
+        values = self._data()
+        if self._journal is not None:
+            self._journal.append((k, v))
+        # the new value replaces the old one, including all values of an old table
+        _remove(values, k)
+        if isinstance(v, dict):
+            values.update(_flatten(v, k + '.'))
+        else:
+            values[k] = v
 
     def __delitem__(self, k: str) -> None:
-        nested_tables, k = Conf._extract_table_list(k)
-        table = iterutils.get_path(self._toml_dict, nested_tables)
-        del table[k]
+        values = self._data()
+        if self._journal is not None:
+            self._journal.append((k, _DELETED))
+        if not _remove(values, k):
+            raise KeyError(k)
 
-    def __iter__(self) -> Iterator:
-        raise NotImplemented
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data())
 
     def __len__(self) -> int:
-        raise NotImplemented
+        return len(self._data())
 
-    @staticmethod
-    def _extract_table_list(k: str) -> Tuple[List[str], str]:
-        tables = k.split('.')
-        return tables, tables.pop(-1)
+    def _data(self) -> Dict[str, Any]:
+        if self._deferred:
+            self._deferred = False
+            self._values = dict(_read_file(self._path))
+        return self._values
+
+    def _table(self, k: str) -> Dict[str, Any]:
+        """Return the nested table of values below a dotted name."""
+        prefix = k + '.'
+        table = {key[len(prefix):]: v for key, v in self._data().items() if key.startswith(prefix)}
+        if not table:
+            raise KeyError(k)
+        return _unflatten(table)
 
 
 class ChainConf(collections.ChainMap):
@@ -92,23 +177,93 @@ class ChainConf(collections.ChainMap):
 
     def exists(self) -> bool:
         """Return result of c.exists() where c is the first Conf instance in the chain."""
-        conf = iterutils.first(self.maps, key=lambda x: isinstance(x, Conf))
+        conf = next((m for m in self.maps if isinstance(m, Conf)), None)
         return cast(Conf, conf).exists() if conf is not None else False
 
     def load(self, create: bool = False) -> None:
-        """See Conf.load()."""
+        """
+        See Conf.load(). Each config file is only parsed when it is first needed, e.g. the global
+        config is not read when every key is found in the local config.
+        """
         for conf in filter(lambda x: isinstance(x, Conf), self.maps):
-            cast(Conf, conf).load(create)
+            cast(Conf, conf).load(create, lazy=True)
 
     def dump(self) -> None:
         """See Dump.load()."""
         for conf in filter(lambda x: isinstance(x, Conf), self.maps):
             cast(Conf, conf).dump()
 
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Return all values of the chain in a plain dict keyed by dotted names, e.g. to pass the
+        config to worker processes.
+        """
+        return dict(self.items())
+
+
+def GlobalConf() -> Conf:  # pylint: disable=invalid-name
+    """Return the global config."""
+    return Conf(_GLOBAL_PATH, _GLOBAL_KEYS)
+
+
+def LocalConf(directory: str = '.') -> ChainConf:  # pylint: disable=invalid-name
+    """Return the local config of a directory, chained with its own global config instance."""
+    return ChainConf(local_conf(directory), GlobalConf())
+
+
+# Journal value of a deleted key, see Conf.batch().
+_DELETED = object()
+
+# Parsed config files keyed by absolute path, with the (mtime_ns, size) of the parsed file.
+_FILE_CACHE = {}  # type: Dict[str, Tuple[int, int, Dict[str, Any]]]
+
+
+def _read_file(path: str, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    Return the flattened values of a config file. Each file is only parsed again when its mtime or
+    size changes. The returned dict is shared and must not be modified.
+
+    :param use_cache: When False, the file is always parsed again. A change that keeps the size
+                      of the file within one mtime tick cannot be detected otherwise.
+    """
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    cached = _FILE_CACHE.get(abs_path)
+    if use_cache and cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    import toml  # type: ignore
+    with open(abs_path) as f:
+        values = _flatten(toml.load(f))
+    _FILE_CACHE[abs_path] = (stat.st_mtime_ns, stat.st_size, values)
+    return values
+
+
+def _remove(values: Dict[str, Any], k: str) -> bool:
+    """Remove a value, or all values of a table, by dotted name. Return False if none was found."""
+    keys = [key for key in values if key == k or key.startswith(k + '.')]
+    for key in keys:
+        del values[key]
+    return bool(keys)
+
+
+def _flatten(table: Dict[str, Any], prefix: str = '') -> Dict[str, Any]:
+    """Return the values of nested tables keyed by dotted names."""
+    values = {}  # type: Dict[str, Any]
+    for k, value in table.items():
+        if isinstance(value, dict) and value:
+            values.update(_flatten(value, prefix + k + '.'))
+        else:
+            values[prefix + k] = value
+    return values
 
-# Callable that will always return the global config.
-GlobalConf = funcutils.partial(Conf, _GLOBAL_PATH, _GLOBAL_KEYS)  # pylint: disable=invalid-name
 
-# Callable that will always return the default local config.
-LocalConf = (  # pylint: disable=invalid-name
-    funcutils.partial(ChainConf, Conf(_LOCAL_PATH), GlobalConf()))
+def _unflatten(values: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the nested tables of values keyed by dotted names, see _flatten()."""
+    tables = {}  # type: Dict[str, Any]
+    for k, value in values.items():
+        *names, key = k.split('.')
+        table = tables
+        for name in names:
+            table = table.setdefault(name, {})
+        table[key] = value
+    return tables
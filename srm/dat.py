@@ -2,24 +2,41 @@
 Load and query XML data that describes ROM game collections.
 """
 
-from typing import Any, Iterable, Set
+import sys
+from types import MappingProxyType
+from typing import Dict  # pylint: disable=unused-import
+from typing import (Any, Callable, FrozenSet, Generic, Iterable, Iterator, List, Mapping,
+                    Optional, Set, Tuple, TypeVar)
 from xml.etree import ElementTree
 
 import attr  # type: ignore
+from boltons import cacheutils  # type: ignore
 
-# import boltons.cacheutils  # type: ignore
+# A (game, rom) pair, where 'rom' is one of the entries in 'game.roms'.
+Match = Tuple['Game', 'ROM']
 
+# A (datafile, game, rom) entry of a UnionIndex.
+SetMatch = Tuple['Datafile', 'Game', 'ROM']
 
-class DatafileXml:
-    """Parse a DAT XML file (datafile DTD)."""
+# Entry type of a _HashTables sub-class.
+_Entry = TypeVar('_Entry')
 
-    def __init__(self, file_path: str) -> None:
-        tree = ElementTree.parse(file_path,)
-        self._root = tree.getroot()
-        header = self._root.find('header')
-        if header is None:
-            raise ElementTree.ParseError('DAT file does not contain a valid "header"')
-        self._header = Header.from_xml(header)
+
+class Datafile:
+    """DAT header and games held in memory."""
+
+    def __init__(self, header: 'Header', games: Iterable['Game']) -> None:
+        """
+        :param header: DAT header info.
+        :param games: All games defined by the DAT.
+        """
+        self._header = header
+        self._games = tuple(games)
+
+    @property
+    def header(self) -> 'Header':
+        """DAT <header> info."""
+        return self._header
 
     @property
     def name(self) -> str:
@@ -58,26 +75,338 @@ class DatafileXml:
 
     @property
     def games(self) -> Iterable['Game']:
-        """Iterable of <game> tag elements from DAT."""
-        for game in self._root.iter('game'):
-            roms = frozenset({ROM.from_xml(r) for r in game.iter('rom')})
-            yield Game.from_xml(game, roms=roms)
-
-    # @boltons.cacheutils.cachedproperty
-    # def crcs(self) -> Set[str]:
-    #     return set(r.crc for r in self.roms)
-    #
-    # @boltons.cacheutils.cachedproperty
-    # def md5s(self) -> Set[str]:
-    #     return set(r.md5 for r in self.roms)
-
-    # def matching(self, crc=None, md5=None):
-    #     if crc:
-    #         return self._crc_index[crc]
-    #     elif md5:
-    #         return self._md5_index[md5]
-    #     else:
-    #         raise ValueError('Method called with no arguments')
+        """Iterable of <game> records from DAT."""
+        return self._games
+
+    @cacheutils.cachedproperty
+    def index(self) -> 'HashIndex':
+        """Hash lookup tables for all ROMs, built on first access."""
+        return HashIndex(self.games)
+
+    @property
+    def crcs(self) -> Set[str]:
+        """Set of all (lower-case) ROM CRC values in the DAT."""
+        return set(self.index.crc)
+
+    @property
+    def md5s(self) -> Set[str]:
+        """Set of all (lower-case) ROM MD5 values in the DAT."""
+        return set(self.index.md5)
+
+    @property
+    def sizes(self) -> Set[int]:
+        """Set of all ROM sizes in the DAT. Files of any other size can never match."""
+        return set(self.index.sizes)
+
+    @cacheutils.cachedproperty
+    def sets(self) -> 'SetResolver':
+        """Parent/clone/BIOS graph of all games, built on first access."""
+        return SetResolver(self.games)
+
+    def matching(self, crc: Optional[str] = None, md5: Optional[str] = None,
+                 sha1: Optional[str] = None, size: Optional[int] = None) -> List[Match]:
+        """See HashIndex.matching()."""
+        matches = self.index.matching(crc=crc, md5=md5, sha1=sha1, size=size)  # type: List[Match]
+        return matches
+
+
+class DatafileXml(Datafile):
+    """Parse a DAT XML file (datafile DTD)."""
+
+    def __init__(self, file_path: str, stream: bool = False,
+                 pool: Optional['RomPool'] = None) -> None:
+        """
+        :param file_path: Path of the DAT XML file.
+        :param stream: When True, games are not kept in memory. Only the <header> is read on
+                       init, and each iteration of `games` incrementally re-parses the file.
+                       Otherwise all games are converted on init. In both cases each <game>
+                       element is discarded once it has been converted, the XML tree is never
+                       held in memory.
+        :param pool: Pool used to share identical ROM instances, which can also be shared with
+                     other DATs. By default, a new pool is used unless `stream` is True (a pool
+                     holds every ROM, so streamed DATs would no longer use constant memory).
+        """
+        self._file_path = file_path
+        self._stream = stream
+        self._pool = pool if pool is not None or stream else RomPool()
+        if stream:
+            header = _find_header(file_path)
+            games = []  # type: List[Game]
+        else:
+            # games are converted while the file is parsed, the XML tree is never held in memory
+            header, games = _parse(file_path, self._pool)
+        if header is None:
+            raise ElementTree.ParseError('DAT file does not contain a valid "header"')
+        super().__init__(Header.from_xml(header), games)
+
+    @property
+    def games(self) -> Iterable['Game']:
+        """Iterable of <game> records from DAT, re-parsed on each iteration when streamed."""
+        if self._stream:
+            return _iter_games(self._file_path, self._pool)
+        return super().games
+
+
+class RomPool:
+    """
+    Canonical instances of ROM records, so that identical ROMs share a single instance. ROMs only
+    hold the fields that identify a file (the 'merge' name of a ROM belongs to its game, see
+    Game.merges), so the copy of a parent ROM listed by each clone is shared as well.
+    """
+
+    def __init__(self) -> None:
+        self._roms = {}  # type: Dict[ROM, ROM]
+
+    def __len__(self) -> int:
+        return len(self._roms)
+
+    def get(self, rom: 'ROM') -> 'ROM':
+        """Return the shared instance equal to rom, adding rom to the pool if it is new."""
+        return self._roms.setdefault(rom, rom)
+
+
+class _HashTables(Generic[_Entry]):  # pylint: disable=too-few-public-methods
+    """
+    Lookup tables from ROM hash values to the index entries that contain them, shared by HashIndex
+    and UnionIndex.
+
+    All tables are one-to-many, since the same ROM is commonly shared between a parent and its
+    clones. Hash keys are normalized to lower-case hex strings.
+    """
+
+    def __init__(self) -> None:
+        self.crc = {}  # type: Dict[str, List[_Entry]]
+        self.md5 = {}  # type: Dict[str, List[_Entry]]
+        self.sha1 = {}  # type: Dict[str, List[_Entry]]
+        self.size_crc = {}  # type: Dict[Tuple[int, str], List[_Entry]]
+
+    def _add_entry(self, rom: 'ROM', entry: _Entry) -> None:
+        """Add an entry under each hash of its ROM."""
+        if rom.crc:
+            crc = rom.crc.lower()
+            self.crc.setdefault(crc, []).append(entry)
+            self.size_crc.setdefault((rom.size, crc), []).append(entry)
+        if rom.md5:
+            self.md5.setdefault(rom.md5.lower(), []).append(entry)
+        if rom.sha1:
+            self.sha1.setdefault(rom.sha1.lower(), []).append(entry)
+
+    def _lookup(self, crc: Optional[str], md5: Optional[str], sha1: Optional[str],
+                size: Optional[int]) -> List[_Entry]:
+        """Return the entries of the strongest hash given."""
+        if sha1:
+            return self.sha1.get(sha1.lower(), [])
+        if md5:
+            return self.md5.get(md5.lower(), [])
+        if crc and size is not None:
+            return self.size_crc.get((size, crc.lower()), [])
+        if crc:
+            return self.crc.get(crc.lower(), [])
+        raise ValueError('Method called with no arguments')
+
+
+class HashIndex(_HashTables[Match]):
+    """Lookup tables from ROM hash values to the (Game, ROM) entries that contain them."""
+
+    def __init__(self, games: Iterable['Game'] = ()) -> None:
+        """
+        :param games: Initial games to add to the index.
+        """
+        super().__init__()
+        self.sizes = set()  # type: Set[int]
+        for game in games:
+            self.add(game)
+
+    def add(self, game: 'Game') -> None:
+        """Add all ROMs of a game to the index."""
+        for rom in game.roms:
+            self.sizes.add(rom.size)
+            self._add_entry(rom, (game, rom))
+
+    def matching(self, crc: Optional[str] = None, md5: Optional[str] = None,
+                 sha1: Optional[str] = None, size: Optional[int] = None) -> List[Match]:
+        """
+        Return all (Game, ROM) entries matching a hash. When more than one hash is given, only the
+        strongest one is used (sha1, then md5, then size and crc, then crc).
+
+        :param size: When given with 'crc', only entries of the same size are matched.
+        """
+        return self._lookup(crc, md5, sha1, size)
+
+
+class UnionIndex(_HashTables[SetMatch]):
+    """
+    Combined hash lookup tables for several DATs, e.g. all sets tracked by one directory.
+
+    Every hash is looked up once in a single table, no matter how many DATs were added. ROMs are
+    stored through a RomPool, so a ROM listed by several DATs is only held once.
+    """
+
+    def __init__(self, datafiles: Iterable[Datafile] = (), pool: Optional[RomPool] = None) -> None:
+        """
+        :param datafiles: Initial DATs (or compiled DAT caches) to add to the index.
+        :param pool: Pool of shared ROM instances, e.g. the pool the DATs were loaded with.
+        """
+        super().__init__()
+        self.datafiles = []  # type: List[Datafile]
+        self._pool = pool if pool is not None else RomPool()
+        for datafile in datafiles:
+            self.add(datafile)
+
+    def add(self, datafile: Datafile) -> None:
+        """Add all ROMs of a DAT to the index."""
+        self.datafiles.append(datafile)
+        for game in datafile.games:
+            for rom in game.roms:
+                rom = self._pool.get(rom)
+                self._add_entry(rom, (datafile, game, rom))
+
+    def matching(self, crc: Optional[str] = None, md5: Optional[str] = None,
+                 sha1: Optional[str] = None, size: Optional[int] = None) -> List[SetMatch]:
+        """Return all (Datafile, Game, ROM) entries matching a hash, see HashIndex.matching()."""
+        return self._lookup(crc, md5, sha1, size)
+
+    def sets(self, **kwargs: Any) -> List[Datafile]:
+        """Return the DATs that contain a hash, in the order they were added."""
+        found = {id(d): d for d, _, _ in self.matching(**kwargs)}
+        return [d for d in self.datafiles if id(d) in found]
+
+
+# ROM set layouts supported by SetResolver.
+NON_MERGED = 'non-merged'  # every set holds all of its ROMs, including the ones shared with others
+SPLIT = 'split'  # ROMs merged from a parent or BIOS set are only stored in that set
+MERGED = 'merged'  # clones are stored in the archive of their parent, and shared ROMs only once
+SET_TYPES = (NON_MERGED, SPLIT, MERGED)
+
+
+class SetResolver:
+    """
+    Parent/clone/BIOS graph of the games in a DAT, used to find the ROMs each archive requires.
+
+    The DAT is expected to list every ROM a game needs (like a MAME -listxml DAT), where the ROMs
+    shared with the parent or BIOS set have a 'merge' name. All indexes are built in a single pass,
+    so resolving every set is linear in the number of ROMs.
+    """
+
+    def __init__(self, games: Iterable['Game'] = ()) -> None:
+        """
+        :param games: All games of the DAT.
+        """
+        self.games = {}  # type: Dict[str, Game]
+        self.clones = {}  # type: Dict[str, List[Game]]
+        for game in games:
+            self.games[game.name] = game
+            if game.cloneof:
+                self.clones.setdefault(game.cloneof, []).append(game)
+        # names of the ROMs of each game, only built for games that other games merge from
+        self._rom_names = {}  # type: Dict[str, Set[str]]
+
+    def parent(self, game: 'Game') -> Optional['Game']:
+        """Return the parent of a clone, or None if the game is not a clone of a known game."""
+        return self.games.get(game.cloneof) if game.cloneof else None
+
+    def bios(self, game: 'Game') -> Optional['Game']:
+        """Return the BIOS set a game depends on (following its parent), or None."""
+        parent = self.parent(game) or game
+        bios = self.games.get(parent.romof) if parent.romof else None
+        return bios if bios is not None and bios.isbios else None
+
+    def required(self, game: 'Game', set_type: str = SPLIT) -> List['ROM']:
+        """
+        Return the ROMs that must be stored in the archive of a game.
+
+        :param set_type: One of NON_MERGED, SPLIT or MERGED. In a merged layout clones of known
+                         parents have no archive of their own, so an empty list is returned.
+        """
+        if set_type == NON_MERGED:
+            return list(game.roms)
+        if set_type == SPLIT:
+            return self._split(game)
+        if set_type == MERGED:
+            if self.parent(game) is not None:
+                return []
+            roms = self._split(game)
+            seen = {(r.name, r.crc) for r in roms}
+            for clone in self.clones.get(game.name, ()):
+                for rom in self._split(clone):
+                    if (rom.name, rom.crc) not in seen:
+                        seen.add((rom.name, rom.crc))
+                        roms.append(rom)
+            return roms
+        raise ValueError(f'Unknown set type {set_type!r}')
+
+    def archives(self, set_type: str = SPLIT) -> Iterator[Tuple[str, List['ROM']]]:
+        """Yield the name and required ROMs of every archive of a layout, see required()."""
+        for name, game in self.games.items():
+            if set_type == MERGED and self.parent(game) is not None:
+                continue
+            yield name, self.required(game, set_type)
+
+    def _split(self, game: 'Game') -> List['ROM']:
+        """Return the ROMs of a game that are not provided by its parent or BIOS set."""
+        source = self.games.get(game.romof or game.cloneof)
+        if source is None:
+            return list(game.roms)
+        names = self._rom_names.get(source.name)
+        if names is None:
+            names = self._rom_names[source.name] = {r.name for r in source.roms}
+        return [r for r in game.roms if game.merges.get(r.name, '') not in names]
+
+
+def _find_header(file_path: str) -> Optional[ElementTree.Element]:
+    """Incrementally parse a DAT file and return the <header> element, or None if missing."""
+    with open(file_path, 'rb') as f:
+        for _, elem in ElementTree.iterparse(f):
+            if elem.tag == 'header':
+                return elem
+            if elem.tag == 'game':
+                break
+    return None
+
+
+def _parse(file_path: str,
+           pool: Optional[RomPool] = None) -> Tuple[Optional[ElementTree.Element], List['Game']]:
+    """Incrementally parse a DAT file, and return the <header> element and all games."""
+    header = None
+    games = []
+    context = ElementTree.iterparse(file_path, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event != 'end':
+            continue
+        if elem.tag == 'header':
+            header = elem
+        elif elem.tag == 'game':
+            games.append(_game_from_xml(elem, pool))
+            # drop the finished <game> (and anything before it) from the partial tree
+            root.clear()
+    return header, games
+
+
+def _iter_games(file_path: str, pool: Optional[RomPool] = None) -> Iterator['Game']:
+    """Incrementally parse a DAT file and yield each <game>, keeping memory use flat."""
+    with open(file_path, 'rb') as f:
+        context = ElementTree.iterparse(f, events=('start', 'end'))
+        first = next(context, None)
+        if first is None:
+            return
+        _, root = first
+        for event, elem in context:
+            if event == 'end' and elem.tag == 'game':
+                yield _game_from_xml(elem, pool)
+                # drop the finished <game> (and anything before it) from the partial tree
+                root.clear()
+
+
+def _game_from_xml(game: ElementTree.Element, pool: Optional[RomPool] = None) -> 'Game':
+    elements = game.findall('rom')
+    roms = (ROM.from_xml(r) for r in elements)  # type: Iterable[ROM]
+    if pool is not None:
+        roms = (pool.get(r) for r in roms)
+    merges = {r.get('name', ''): sys.intern(r.get('merge', '')) for r in elements
+              if r.get('merge')}
+    result = Game.from_xml(game, roms=frozenset(roms), merges=merges)  # type: Game
+    return result
 
 
 class XmlToAttrs:  # pylint: disable=too-few-public-methods
@@ -86,18 +415,65 @@ class XmlToAttrs:  # pylint: disable=too-few-public-methods
     @classmethod
     def from_xml(cls, root: ElementTree.Element, **cls_kwargs: Any) -> Any:
         """
-        Dynamically extract attrs fields from XML root element attributes and sub-tags to initialize
-        a new cls() instance.
+        Extract attrs fields from XML root element attributes and direct sub-tags to initialize a
+        new cls() instance. Values are converted to the field type when it is int or bool, and
+        values of fields marked with `_INTERN` metadata are interned.
 
         :param root: XML element to extract class fields from.
         :param cls_kwargs: Additional kwargs passed into the class constructor.
         """
-        # Create a combined dict of root attributes and sub-tags.
-        cls_kwargs.update(root.attrib)
-        cls_kwargs.update({i.tag: i.text or '' for i in root.iter() if i is not root})
-        # Init the class using only the expected fields defined by attrs declarations.
-        init_kwds = list(i.name for i in iter(attr.fields(cls)))
-        return cls(**{k: v for k, v in cls_kwargs.items() if k in init_kwds})  # type: ignore
+        extractor = _EXTRACTORS.get(cls)
+        if extractor is None:
+            extractor = _EXTRACTORS[cls] = _Extractor(cls)
+        return cls(**extractor.extract(root, cls_kwargs))
+
+
+class _Extractor:  # pylint: disable=too-few-public-methods
+    """Field names and value converters of an attrs class, computed once per class."""
+
+    def __init__(self, cls: type) -> None:
+        fields = attr.fields(cls)
+        self._names = frozenset(a.name for a in fields)
+        self._converters = [(a.name, _CONVERTERS[a.type]) for a in fields
+                            if a.type in _CONVERTERS]
+        self._converters += [(a.name, sys.intern) for a in fields if a.metadata.get('intern')]
+
+    def extract(self, root: ElementTree.Element, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Return kwargs updated with the fields found in the root attributes and sub-tags."""
+        names = self._names
+        attrib = root.attrib
+        for key in names.intersection(attrib):
+            kwargs[key] = attrib[key]
+        if len(root):
+            for child in root:
+                if child.tag in names:
+                    kwargs[child.tag] = child.text or ''
+        for name, converter in self._converters:
+            value = kwargs.get(name)
+            if isinstance(value, str):
+                kwargs[name] = converter(value)
+        return kwargs
+
+
+def _to_bool(value: str) -> bool:
+    return value.lower() in ('yes', 'true', '1')
+
+
+def _to_merges(merges: Mapping[str, str]) -> Mapping[str, str]:
+    """Return a read-only copy of the merge names of a game, shared by all games without any."""
+    return MappingProxyType(dict(merges)) if merges else _NO_MERGES
+
+
+_CONVERTERS = {int: int, bool: _to_bool}  # type: Dict[type, Callable[[str], Any]]
+
+# Merge names of the games that do not merge any ROM, which is most of them.
+_NO_MERGES = MappingProxyType({})  # type: Mapping[str, str]
+
+# Field metadata of commonly repeated str values, which are interned by XmlToAttrs.from_xml().
+_INTERN = {'intern': True}
+
+# _Extractor instances keyed by XmlToAttrs sub-class.
+_EXTRACTORS = {}  # type: Dict[type, _Extractor]
 
 
 @attr.s(frozen=True, slots=True, auto_attribs=True)  # pylint: disable=too-few-public-methods
@@ -117,7 +493,6 @@ class ROM(XmlToAttrs):
     """ROM object defined for one or more Games."""
     name: str  # file name
     size: int  # bytes
-    merge: str = ''  # merge file name, indicates file was merged from "cloneof"
     crc: str = ''
     md5: str = ''
     sha1: str = ''
@@ -128,10 +503,12 @@ class Game(XmlToAttrs):
     """Game record with one or more ROMs."""
     name: str  # file name
     description: str  # common name (can be same as 'name')
-    roms: Set[ROM]  # collection of ROMs required by the game
+    roms: FrozenSet[ROM]  # collection of ROMs required by the game
+    # 'merge' name of each ROM (by ROM name) provided by the parent or BIOS set, see SetResolver
+    merges: Mapping[str, str] = attr.ib(default=_NO_MERGES, converter=_to_merges, hash=False)
 
-    cloneof: str = ''
+    cloneof: str = attr.ib(default='', metadata=_INTERN)
     isbios: bool = False
-    manufacturer: str = ''
-    romof: str = ''
-    year: str = ''
+    manufacturer: str = attr.ib(default='', metadata=_INTERN)
+    romof: str = attr.ib(default='', metadata=_INTERN)
+    year: str = attr.ib(default='', metadata=_INTERN)
@@ -0,0 +1,190 @@
+"""
+Find files with the same content anywhere in a ROM collection, including files stored in archives.
+
+Comparing every pair of files does not scale, so candidates are narrowed down in stages that each
+read more data than the previous one: files are grouped by size (from the stat result or the
+archive index, without reading any data), then by a hash of their first bytes, and only the files
+that still collide are hashed completely. Most sizes in a collection are unique, so only a small
+fraction of the bytes is ever read. Hard links of the same file are only read once, and count as a
+single copy.
+
+Identical loose files can then be replaced by links to a single copy, see link().
+"""
+
+import concurrent.futures as futures
+import errno
+import os
+import shutil
+import zipfile
+from typing import Dict  # pylint: disable=unused-import
+from typing import Callable, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import attr  # type: ignore
+
+from . import file, storage
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore  # pylint: disable=invalid-name
+
+# Link modes, see link().
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'  # copy-on-write clone, supported by e.g. Btrfs and XFS
+
+# Bytes hashed at the start of each candidate, before it is hashed completely.
+_HEAD_SIZE = 1024 * 16
+
+# Hashing mostly waits on disk I/O, and hashlib releases the GIL for large buffers.
+_DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Linux ioctl that clones the data of a file into another one, see ioctl_ficlone(2).
+_FICLONE = 0x40049409
+
+# A candidate file, its size, and the identity of its data: (st_dev, st_ino) for loose files, so
+# hard links are only read once, or (archive, member) for archive members.
+_Candidate = Tuple[file.AnyPath, int, Hashable]
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)  # pylint: disable=too-few-public-methods
+class Duplicates:
+    """Files with the same content."""
+    size: int  # bytes
+    sha1: str
+    paths: List[file.AnyPath]  # loose files first, then archive members, each sorted by path
+    copies: int  # distinct copies of the data, hard links of the same file count as one copy
+
+
+def find(files: Iterable[Tuple[file.Path, os.stat_result]],
+         workers: int = _DEFAULT_WORKERS) -> Iterator[Duplicates]:
+    """
+    Return every group of files with the same content, largest files first. Archives are searched
+    by member, and are not compared with each other as a whole. Groups that only hold hard links of
+    a single file are not returned.
+
+    Files and archives that cannot be read are skipped.
+
+    :param files: (path, stat) of each file, e.g. from scan.walk().
+    :param workers: Max number of files read at the same time.
+    """
+    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        by_size = {}  # type: Dict[int, List[_Candidate]]
+        archives = []
+        for path, stat in files:
+            if path.is_archive():
+                archives.append(path)
+            else:
+                by_size.setdefault(stat.st_size, []).append(
+                    (path, stat.st_size, (stat.st_dev, stat.st_ino)))
+        for members in pool.map(_members, archives):
+            for member in members:
+                by_size.setdefault(member.size, []).append(
+                    (member, member.size, (str(member.archive), member.member)))
+
+        heads = _split(pool, [g for g in by_size.values() if len(g) > 1], _head_sha1)
+        # the head of a small file is the whole file, so its hash is already the full hash
+        found = [(sha1, g) for sha1, g in heads if g[0][1] <= _HEAD_SIZE]
+        found.extend(_split(pool, [g for _, g in heads if g[0][1] > _HEAD_SIZE], _sha1))
+
+    duplicates = []
+    for sha1, group in found:
+        copies = len({c[2] for c in group})
+        if copies > 1:
+            paths = sorted((c[0] for c in group), key=_sort_key)
+            duplicates.append(Duplicates(group[0][1], sha1, paths, copies))
+    duplicates.sort(key=lambda d: (-d.size, _sort_key(d.paths[0])))
+    return iter(duplicates)
+
+
+def link(duplicates: Duplicates, mode: str = HARDLINK) -> List[file.Path]:
+    """
+    Replace each loose file of a group by a link to the first one. Each file is replaced
+    atomically, and files that already are hard links of the first one are left as they are.
+    Archive members are never changed.
+
+    :param mode: HARDLINK, or REFLINK to make copy-on-write clones (the files stay independent).
+    :return: The files that were replaced.
+    :raises OSError: When a link cannot be made, e.g. across file systems, or when the file system
+                     does not support reflinks.
+    """
+    linker = _LINKERS[mode]
+    loose = [p for p in duplicates.paths if not isinstance(p, file.ZipPath)]
+    if len(loose) < 2:
+        return []
+    source, targets = loose[0], loose[1:]
+    source_st = source.stat()
+    replaced = []
+    for target in targets:
+        stat = target.stat()
+        if (stat.st_dev, stat.st_ino) == (source_st.st_dev, source_st.st_ino):
+            continue
+        with storage.atomic_path(str(target)) as tmp_path:
+            linker(str(source), tmp_path)
+            if mode == REFLINK:
+                shutil.copymode(str(target), tmp_path)
+        replaced.append(target)
+    return replaced
+
+
+def _split(pool: futures.Executor, groups: List[List[_Candidate]],
+           key: Callable[[file.AnyPath], Optional[str]]) -> List[Tuple[str, List[_Candidate]]]:
+    """
+    Split each group by the key of its files, and return each new group of at least 2 files with
+    its key. Keys are computed on the pool, once per identity. Files with a None key are dropped.
+    """
+    paths = {}  # type: Dict[Hashable, file.AnyPath]
+    for group in groups:
+        for path, _, identity in group:
+            paths.setdefault(identity, path)
+    keys = dict(zip(paths, pool.map(key, paths.values())))
+    result = []  # type: List[Tuple[str, List[_Candidate]]]
+    for group in groups:
+        split = {}  # type: Dict[str, List[_Candidate]]
+        for candidate in group:
+            value = keys[candidate[2]]
+            if value is not None:
+                split.setdefault(value, []).append(candidate)
+        result.extend((v, g) for v, g in split.items() if len(g) > 1)
+    return result
+
+
+def _members(archive: file.Path) -> List[file.ArchiveMember]:
+    try:
+        return list(archive.members())
+    except (OSError, zipfile.BadZipFile):
+        return []
+
+
+def _head_sha1(path: file.AnyPath) -> Optional[str]:
+    try:
+        return path.digests(crc=False, md5=False, sha1=True, limit=_HEAD_SIZE)['sha1']
+    except (OSError, zipfile.BadZipFile):
+        return None
+
+
+def _sha1(path: file.AnyPath) -> Optional[str]:
+    try:
+        return path.digests(crc=False, md5=False, sha1=True)['sha1']
+    except (OSError, zipfile.BadZipFile):
+        return None
+
+
+def _sort_key(path: file.AnyPath) -> Tuple[bool, str]:
+    return isinstance(path, file.ZipPath), str(path)
+
+
+def _hardlink(source: str, target: str) -> None:
+    os.link(source, target)
+
+
+def _reflink(source: str, target: str) -> None:
+    if fcntl is None or not hasattr(fcntl, 'ioctl'):  # pragma: no cover
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported', target)
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+_LINKERS = {
+    HARDLINK: _hardlink,
+    REFLINK: _reflink,
+}  # type: Dict[str, Callable[[str, str], None]]
@@ -5,11 +5,16 @@ The goal of this module is to abstract the tedious logic required read and modif
 directories within archives, as well as nested archives.
 """
 
+import contextlib
 import hashlib
+import mmap
 import os
 import pathlib
+import zipfile
 import zlib
-from typing import Callable
+from typing import Dict, Type  # pylint: disable=unused-import
+from typing import (Any, BinaryIO, ContextManager, Generator, Iterable, Iterator, List, Optional,
+                    Union, cast)
 
 # Path() -> PosixPath or WindowsPath
 # where:
@@ -45,51 +50,133 @@ from typing import Callable
 # need to be made aware of custom path-like objects.
 
 # Step 2:
-#   * Create a basic ZipPath object that can be returned by Path()
-#   * Update Path.glob() so it can detect and return a ZipPath() object by matching the extension.
-#   * Investigate context manager support?
+#   Rather than patching the Accessor and Selector internals, archive members are represented by a
+#   separate ZipPath class that shares the hashing code with Path (see HashMixin). Path.glob(),
+#   Path.rglob() and Path.iterdir() yield the members of any archive they encounter, so callers
+#   can treat archives like directories. Archive types are looked up by file extension, and more
+#   types (e.g. ".7z") can be added with register_archive().
 
 
-class Path(pathlib.Path):
-    """Extend the built-in pathlib.Path class to support additional methods."""
+class HashMixin:
+    """Hash functions for any file-like object that can be opened for binary reading."""
+    __slots__ = ()
 
     _READ_SIZE = 1024 * 32
 
-    def __new__(cls, *args: os.PathLike, **kwargs: os.PathLike) -> 'Path':
-        if cls is Path:
-            cls = WindowsPath if os.name == 'nt' else PosixPath
-        return super().__new__(cls, *args, **kwargs)
-
     def crc(self) -> str:
         """Return CRC hash of file."""
-        if self.is_dir():
-            raise IsADirectoryError
-        crc = 0
-        with self.open('rb') as f:
-            buf = f.read(self._READ_SIZE)
-            while buf:
-                crc = zlib.crc32(buf, crc)
-                buf = f.read(self._READ_SIZE)
-        return '{:08x}'.format(crc & 0xFFFF_FFFF)
+        return self.digests(crc=True, md5=False, sha1=False)['crc']
 
     def md5(self) -> str:
         """Return MD5 hash of file."""
-        return self._hashlib(hashlib.md5)
+        return self.digests(crc=False, md5=True, sha1=False)['md5']
 
     def sha1(self) -> str:
         """Return SHA1 hash of file."""
-        return self._hashlib(hashlib.sha1)
+        return self.digests(crc=False, md5=False, sha1=True)['sha1']
+
+    def digests(self, crc: bool = True, md5: bool = True, sha1: bool = True,
+                limit: Optional[int] = None) -> Dict[str, str]:
+        """
+        Return the selected hashes of file, reading the file data only once.
+
+        :param limit: When given, only the first limit bytes of the file are read and hashed.
+        :return: Hex digest strings keyed by 'crc', 'md5' and 'sha1' (only the selected ones).
+        """
+        crc_value = 0
+        hashers = {}  # type: Dict[str, Any]
+        if md5:
+            hashers['md5'] = hashlib.md5()
+        if sha1:
+            hashers['sha1'] = hashlib.sha1()
+        updates = [h.update for h in hashers.values()]
+        with contextlib.closing(self._chunks(limit)) as chunks:
+            for chunk in chunks:
+                if crc:
+                    crc_value = zlib.crc32(chunk, crc_value)
+                for update in updates:
+                    update(chunk)
+        result = {k: str(h.hexdigest()) for k, h in hashers.items()}
+        if crc:
+            result['crc'] = '{:08x}'.format(crc_value & 0xFFFF_FFFF)
+        return result
+
+    def _chunks(self, limit: Optional[int]) -> Generator[memoryview, None, None]:
+        """
+        Yield the data of file (up to limit bytes) in chunks. A chunk is only valid until the next
+        one is requested.
+        """
+        with self._open_binary() as f:
+            yield from _read_chunks(f, self._READ_SIZE, limit)
+
+    def _open_binary(self) -> ContextManager[BinaryIO]:
+        """Return an open (unbuffered if possible) binary file object for reading."""
+        raise NotImplementedError
+
+
+class Path(pathlib.Path, HashMixin):
+    """Extend the built-in pathlib.Path class to support additional methods."""
 
-    def _hashlib(self, hash_fn: Callable) -> str:
+    def __new__(cls, *args: os.PathLike, **kwargs: os.PathLike) -> 'Path':
+        if cls is Path:
+            cls = WindowsPath if os.name == 'nt' else PosixPath
+        return super().__new__(cls, *args, **kwargs)
+
+    def is_archive(self) -> bool:
+        """Return True if file is an archive that can contain ROMs."""
+        return self.suffix.lower() in _ARCHIVE_TYPES and self.is_file()
+
+    def members(self) -> Iterator['ArchiveMember']:
+        """
+        Yield each file stored in the archive. Only the archive index (e.g. the ZIP central
+        directory) is read, none of the member data is decompressed.
+        """
+        return _ARCHIVE_TYPES[self.suffix.lower()].list(self)
+
+    def open_members(self) -> ContextManager[List['ArchiveMember']]:
+        """
+        Open the archive once, and yield a list of all of its files that are read through the open
+        archive until the block exits. Use this to read many members of the same archive.
+        """
+        return _ARCHIVE_TYPES[self.suffix.lower()].opened(self)
+
+    def iterdir(self) -> Iterator['AnyPath']:  # type: ignore
+        """Like pathlib.Path.iterdir(), but archives are iterated like directories."""
+        if self.is_archive():
+            return self.members()
+        return super().iterdir()
+
+    def glob(self, pattern: str) -> Iterator['AnyPath']:  # type: ignore
+        """Like pathlib.Path.glob(), but also yields the members of every matching archive."""
+        return _with_members(super().glob(pattern))
+
+    def rglob(self, pattern: str) -> Iterator['AnyPath']:  # type: ignore
+        """Like pathlib.Path.rglob(), but also yields the members of every matching archive."""
+        return _with_members(super().rglob(pattern))
+
+    def digests(self, crc: bool = True, md5: bool = True, sha1: bool = True,
+                limit: Optional[int] = None) -> Dict[str, str]:
+        """See HashMixin.digests()."""
         if self.is_dir():
             raise IsADirectoryError
-        hasher = hash_fn()
-        with self.open('rb') as f:
-            buf = f.read(self._READ_SIZE)
-            while buf:
-                hasher.update(buf)
-                buf = f.read(self._READ_SIZE)
-        return str(hasher.hexdigest())
+        return super().digests(crc, md5, sha1, limit)
+
+    def _chunks(self, limit: Optional[int]) -> Generator[memoryview, None, None]:
+        """
+        See HashMixin._chunks(). Large files are memory-mapped, so their data is passed to the
+        hash functions without being copied into Python buffers first.
+        """
+        with self._open_binary() as f:
+            size = os.fstat(f.fileno()).st_size
+            if limit is not None:
+                size = min(size, limit)
+            if size < _MMAP_MIN_SIZE:
+                yield from _read_chunks(f, self._READ_SIZE, limit)
+            else:
+                yield from _mapped_chunks(f.fileno(), size)
+
+    def _open_binary(self) -> ContextManager[BinaryIO]:
+        return cast(ContextManager[BinaryIO], self.open('rb', buffering=0))
 
 
 class PosixPath(Path, pathlib.PosixPath):
@@ -100,3 +187,169 @@ class PosixPath(Path, pathlib.PosixPath):
 class WindowsPath(Path, pathlib.WindowsPath):  # pylint: disable=abstract-method
     """Concrete Windows Path."""
     __slots__ = ()
+
+
+class ZipPath(HashMixin):
+    """
+    A file stored in a ZIP archive.
+
+    Hashing a member stream-decompresses it in small chunks, so the member is never extracted to
+    disk or fully loaded into memory.
+    """
+
+    def __init__(self, archive: Path, member: str, size: int, stored_crc: str,
+                 zip_file: Optional[zipfile.ZipFile] = None) -> None:
+        """
+        :param archive: Path of the ZIP file.
+        :param member: Full name of the file within the archive.
+        :param size: Uncompressed size in bytes, as stored in the archive index.
+        :param stored_crc: CRC hash of file, as stored in the archive index.
+        :param zip_file: Open archive the member is read from while it stays open, see opened().
+        """
+        self.archive = archive
+        self.member = member
+        self.size = size
+        self.stored_crc = stored_crc
+        self._zip_file = zip_file
+
+    @classmethod
+    def list(cls, archive: Path) -> Iterator['ZipPath']:
+        """Yield each file stored in a ZIP archive, reading only the central directory."""
+        with zipfile.ZipFile(str(archive)) as zip_file:
+            infos = zip_file.infolist()
+        return (cls(archive, i.filename, i.file_size, '{:08x}'.format(i.CRC & 0xFFFF_FFFF))
+                for i in infos if not i.is_dir())
+
+    @classmethod
+    @contextlib.contextmanager
+    def opened(cls, archive: Path) -> Iterator[List['ZipPath']]:
+        """
+        Open a ZIP archive once, and yield all of its files. Until the block exits, the files are
+        read through the open archive instead of opening it (and parsing its central directory)
+        again for each file.
+        """
+        with zipfile.ZipFile(str(archive)) as zip_file:
+            yield [cls(archive, i.filename, i.file_size, '{:08x}'.format(i.CRC & 0xFFFF_FFFF),
+                       zip_file) for i in zip_file.infolist() if not i.is_dir()]
+
+    @property
+    def name(self) -> str:
+        """Final component of the member name."""
+        return self.member.rsplit('/', 1)[-1]
+
+    @property
+    def suffix(self) -> str:
+        """File extension of the member name."""
+        return os.path.splitext(self.name)[1]
+
+    def is_dir(self) -> bool:  # pylint: disable=no-self-use
+        """Members are never directories, see Path.members()."""
+        return False
+
+    def is_file(self) -> bool:  # pylint: disable=no-self-use
+        """Members are always files, see Path.members()."""
+        return True
+
+    def is_archive(self) -> bool:  # pylint: disable=no-self-use
+        """Nested archives are not supported."""
+        return False
+
+    @contextlib.contextmanager
+    def open(self, mode: str = 'rb') -> Iterator[BinaryIO]:
+        """Open the member for streaming reads; the data is decompressed while it is read."""
+        if mode != 'rb':
+            raise ValueError(f'Unsupported mode {mode!r}')
+        if self._zip_file is not None and self._zip_file.fp is not None:  # still open
+            with self._zip_file.open(self.member) as f:
+                yield cast(BinaryIO, f)
+            return
+        with zipfile.ZipFile(str(self.archive)) as zip_file:
+            with zip_file.open(self.member) as f:
+                yield cast(BinaryIO, f)
+
+    def _open_binary(self) -> ContextManager[BinaryIO]:
+        return self.open('rb')
+
+    def __str__(self) -> str:
+        return os.path.join(str(self.archive), self.member)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({str(self.archive)!r}, {self.member!r})'
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, ZipPath):
+            return NotImplemented
+        return (self.archive, self.member) == (other.archive, other.member)
+
+    def __hash__(self) -> int:
+        return hash((self.archive, self.member))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # an open archive cannot be sent to another process, the copy opens the archive itself
+        state = self.__dict__.copy()
+        state['_zip_file'] = None
+        return state
+
+
+# Any file stored in an archive. Each archive type must provide list(), opened(), open(), size,
+# stored_crc and the HashMixin methods, see ZipPath.
+ArchiveMember = ZipPath
+
+# Any path that can be hashed or matched against a DAT.
+AnyPath = Union[Path, ArchiveMember]
+
+# Loose files of at least this size are hashed through a memory map instead of read() calls. Below
+# it, setting up the map costs more than the copies it saves.
+_MMAP_MIN_SIZE = 1024 * 1024
+
+# Bytes of a memory map hashed at a time. Small enough that a chunk stays in the CPU cache while it
+# is passed to each hash function, large enough that the Python overhead per chunk is negligible.
+_MMAP_CHUNK_SIZE = 1024 * 256
+
+# Archive member classes keyed by (lower-case) archive file extension.
+_ARCHIVE_TYPES = {
+    '.zip': ZipPath,
+}  # type: Dict[str, Type[ArchiveMember]]
+
+
+def register_archive(suffix: str, member_cls: Type[ArchiveMember]) -> None:
+    """
+    Add support for a new type of archive.
+
+    :param suffix: File extension of the archive, e.g. ".7z".
+    :param member_cls: Class of archive members. It must implement the same API as ZipPath.
+    """
+    _ARCHIVE_TYPES[suffix.lower()] = member_cls
+
+
+def _read_chunks(f: BinaryIO, read_size: int, limit: Optional[int]) -> Iterator[memoryview]:
+    """Read chunks into a single buffer, re-used for every chunk to avoid an allocation per read."""
+    buf = bytearray(read_size)
+    view = memoryview(buf)
+    remaining = -1 if limit is None else limit  # negative for no limit
+    size = f.readinto(view[:remaining] if 0 <= remaining < len(buf) else buf)  # type: ignore
+    while size:
+        yield view[:size]
+        if remaining >= 0:
+            remaining -= size
+        size = f.readinto(view[:remaining] if 0 <= remaining < len(buf) else buf)  # type: ignore
+
+
+def _mapped_chunks(fileno: int, size: int) -> Iterator[memoryview]:
+    """Yield the first size bytes of an open file as slices of a read-only memory map."""
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, 'madvise'):  # Python 3.8+, not on Windows
+            # read-ahead aggressively, and drop pages soon after they are hashed
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(mapped) as view:
+            for offset in range(0, size, _MMAP_CHUNK_SIZE):
+                # released before the next chunk, the map cannot be closed while slices exist
+                with view[offset:min(offset + _MMAP_CHUNK_SIZE, size)] as chunk:
+                    yield chunk
+
+
+def _with_members(paths: Iterable[Path]) -> Iterator[AnyPath]:
+    for path in paths:
+        yield path
+        if path.is_archive():
+            yield from path.members()
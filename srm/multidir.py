@@ -0,0 +1,46 @@
+"""
+Run the same operation on many ROM directories at once, e.g. for the '--recursive' commands.
+
+Directories are processed on one shared, bounded pool while they are still being discovered, and
+results are yielded as soon as each directory is finished, so a large library keeps every disk busy
+instead of handling one directory after another.
+"""
+
+import concurrent.futures as futures
+import os
+from typing import Dict  # pylint: disable=unused-import
+from typing import Callable, Iterable, Iterator, Tuple, TypeVar
+
+# Directory operations mostly wait on disk or network I/O, so more threads than CPUs are used.
+_DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+_DEFAULT_QUEUE_FACTOR = 4  # max queued directories = workers * factor
+
+T = TypeVar('T')  # pylint: disable=invalid-name
+
+
+def map_dirs(func: Callable[[str], T], directories: Iterable[str],
+             workers: int = _DEFAULT_WORKERS) -> Iterator[Tuple[str, T]]:
+    """
+    Call func for each directory on a shared thread pool, and yield (directory, result) pairs in
+    completion order.
+
+    :param directories: Directories to process, e.g. from config.find_local_dirs(). They are read
+                        lazily, so work starts before the discovery of all directories has finished.
+    :param workers: Max number of directories processed at the same time.
+    :raises: Any exception raised by func, when the result of its directory is yielded.
+    """
+    depth = workers * _DEFAULT_QUEUE_FACTOR
+    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}  # type: Dict[futures.Future[T], str]
+        for directory in directories:
+            pending[pool.submit(func, directory)] = directory
+            if len(pending) >= depth:
+                done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                yield from _finished(done, pending)
+        yield from _finished(futures.as_completed(list(pending)), pending)
+
+
+def _finished(done: Iterable['futures.Future[T]'],
+              pending: Dict['futures.Future[T]', str]) -> Iterator[Tuple[str, T]]:
+    for future in done:
+        yield pending.pop(future), future.result()
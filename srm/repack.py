@@ -0,0 +1,259 @@
+"""
+Rebuild the ZIP archives of a ROM set from the files found in a collection.
+
+The archives and the ROMs each one holds are taken from the DAT, in the split, non-merged or merged
+layout (see dat.SetResolver), so repacking also renames archives and ROMs to their canonical names,
+and moves clones into or out of the archive of their parent.
+
+When a ROM is already stored deflated in a ZIP, its compressed data is copied into the new archive
+as it is, without decompressing and compressing it again; only loose files and members stored with
+other methods are compressed. Archives are built in parallel on a bounded thread pool (zlib releases
+the GIL while it compresses), each one into a temp file that atomically replaces the old archive
+when it is complete, so a set is rebuilt at the speed of the disks rather than of a single deflate
+stream, and an interrupted rebuild never leaves a partial archive behind.
+"""
+
+import concurrent.futures as futures
+import lzma
+import os
+import shutil
+import struct
+import time
+import zipfile
+import zlib
+from typing import Dict  # pylint: disable=unused-import
+from typing import BinaryIO, Iterable, Iterator, List, Set, Tuple, cast
+
+import attr  # type: ignore
+
+from . import dat, file, scan, storage
+
+_DEFAULT_WORKERS = os.cpu_count() or 1
+_DEFAULT_QUEUE_FACTOR = 4  # max archives in flight = workers * factor
+
+_READ_SIZE = 1024 * 64
+
+# Flag bit of encrypted ZIP members, which cannot be copied to another archive.
+_ENCRYPTED = 0x01
+
+# Flag bit of ZIP members with a UTF-8 name (otherwise cp437).
+_UTF8_NAME = 0x800
+
+# Flag bits that record the deflate compression level, kept when compressed data is copied.
+_DEFLATE_OPTIONS = 0x06
+
+# Earliest date a ZIP member can have.
+_MIN_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Field indexes of zipfile.structFileHeader (the local header of a ZIP member).
+_FH_FILENAME_LENGTH = 10
+_FH_EXTRA_FIELD_LENGTH = 11
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)  # pylint: disable=too-few-public-methods
+class Member:
+    """A ROM of a rebuilt archive, and the file its data is read from."""
+    rom: dat.ROM
+    source: file.AnyPath
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)  # pylint: disable=too-few-public-methods
+class Archive:
+    """An archive to rebuild, see plan()."""
+    name: str  # archive name, without the '.zip' extension
+    members: List[Member]
+    missing: List[dat.ROM]  # required ROMs without a source file
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)  # pylint: disable=too-few-public-methods
+class RepackResult:
+    """Outcome of the rebuild of one archive."""
+    name: str
+    path: str  # rebuilt archive
+    written: bool = False  # False when the archive was up to date, empty, or could not be built
+    copied: int = 0  # members copied without recompressing them
+    compressed: int = 0  # members that were compressed
+    missing: List[dat.ROM] = attr.Factory(list)
+    error: str = ''
+
+
+def plan(datafile: dat.Datafile, matched: Iterable[Tuple[scan.ScanResult, List[dat.Match]]],
+         set_type: str = dat.SPLIT) -> Iterator[Archive]:
+    """
+    Yield every archive of a set layout, with the source of each of its ROMs.
+
+    :param matched: Each scan result with the DAT entries it matches, see scan.match(). The first
+                    file found for a ROM is used as its source.
+    :param set_type: One of dat.NON_MERGED, dat.SPLIT or dat.MERGED.
+    """
+    sources = {}  # type: Dict[dat.ROM, file.AnyPath]
+    for result, matches in matched:
+        for _, rom in matches:
+            sources.setdefault(rom, result.path)
+    for name, roms in datafile.sets.archives(set_type):
+        members, missing = [], []
+        names = set()  # type: Set[str]
+        for rom in sorted(roms, key=lambda r: r.name):
+            if rom.name in names:
+                continue  # an archive holds a single file of each name
+            names.add(rom.name)
+            source = sources.get(rom)
+            if source is None:
+                missing.append(rom)
+            else:
+                members.append(Member(rom, source))
+        yield Archive(name, members, missing)
+
+
+def repack(archives: Iterable[Archive], directory: str,
+           workers: int = _DEFAULT_WORKERS) -> Iterator[RepackResult]:
+    """
+    Build each archive as `<directory>/<name>.zip` on a thread pool, and yield the results in
+    completion order. Archives that already hold exactly the planned ROMs are left as they are, and
+    archives without any source file are not created.
+
+    Source files are only read, never moved or removed. An existing archive that holds files the
+    new archive would not keep (by size and CRC), e.g. a ROM that is not in the DAT, is never
+    replaced, and its result has an error instead. Sources that are archives of the same set
+    should not be rebuilt in place at the same time, since the old archive is replaced as soon as
+    the new one is complete.
+
+    :param archives: Archives to build, see plan(). They are read lazily.
+    :param workers: Max number of archives built at the same time.
+    """
+    depth = workers * _DEFAULT_QUEUE_FACTOR
+    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()  # type: Set[futures.Future[RepackResult]]
+        for archive in archives:
+            path = os.path.join(directory, archive.name + '.zip')
+            pending.add(pool.submit(_build, archive, path))
+            if len(pending) >= depth:
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                yield from (f.result() for f in done)
+        yield from (f.result() for f in futures.as_completed(pending))
+
+
+def _build(archive: Archive, path: str) -> RepackResult:
+    """Worker function, builds one archive."""
+    result = RepackResult(archive.name, path, missing=archive.missing)
+    if not archive.members:
+        return result
+    infos = _infos(path)
+    if _is_current(archive, infos):
+        return result
+    dropped = _dropped(archive, infos)
+    if dropped:
+        return attr.evolve(result, error=f"Not replaced, the new archive would not hold "
+                                         f"{', '.join(dropped)}")
+    copied = 0
+    try:
+        with storage.atomic_path(path) as tmp_path:
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                for member in archive.members:
+                    if _copy_compressed(zip_file, member):
+                        copied += 1
+                    else:
+                        _compress(zip_file, member)
+    except (OSError, EOFError, KeyError, RuntimeError, zipfile.BadZipFile, zlib.error,
+            lzma.LZMAError) as error:
+        return attr.evolve(result, error=str(error))
+    return attr.evolve(result, written=True, copied=copied,
+                       compressed=len(archive.members) - copied)
+
+
+def _infos(path: str) -> List[zipfile.ZipInfo]:
+    """Return the members of an existing archive, or an empty list if it cannot be read."""
+    try:
+        with zipfile.ZipFile(path) as zip_file:
+            return zip_file.infolist()
+    except (OSError, zipfile.BadZipFile):
+        return []
+
+
+def _is_current(archive: Archive, infos: List[zipfile.ZipInfo]) -> bool:
+    """Return True if the archive members are exactly the planned ROMs, by name, size and CRC."""
+    found = {(i.filename, i.file_size, i.CRC) for i in infos}
+    wanted = {(m.rom.name, m.rom.size, int(m.rom.crc or '0', 16)) for m in archive.members}
+    return len(infos) == len(found) and found == wanted
+
+
+def _dropped(archive: Archive, infos: List[zipfile.ZipInfo]) -> List[str]:
+    """Return the names of the members of an archive with data that no planned ROM has."""
+    wanted = {(m.rom.size, int(m.rom.crc or '0', 16)) for m in archive.members}
+    return [i.filename for i in infos if not i.is_dir() and (i.file_size, i.CRC) not in wanted]
+
+
+def _copy_compressed(zip_file: zipfile.ZipFile, member: Member) -> bool:
+    """
+    Copy the compressed data of a deflated ZIP member, without decompressing it.
+
+    :return: False if the source cannot be copied this way and must be compressed instead.
+    """
+    source = member.source
+    if not isinstance(source, file.ZipPath):
+        return False
+    with zipfile.ZipFile(str(source.archive)) as source_zip:
+        info = source_zip.getinfo(source.member)
+        if info.compress_type != zipfile.ZIP_DEFLATED or info.flag_bits & _ENCRYPTED:
+            return False
+        # read through the handle the index was read from, the path may already name a new file
+        stream = cast(BinaryIO, source_zip.fp)
+        stream.seek(info.header_offset)
+        header = struct.unpack(zipfile.structFileHeader,  # type: ignore
+                               stream.read(zipfile.sizeFileHeader))  # type: ignore
+        if header[0] != zipfile.stringFileHeader:  # type: ignore
+            raise zipfile.BadZipFile(f'Bad local header of {source}')
+        name = stream.read(header[_FH_FILENAME_LENGTH])
+        encoding = 'utf-8' if info.flag_bits & _UTF8_NAME else 'cp437'
+        if name.decode(encoding, 'replace') != info.orig_filename:
+            raise zipfile.BadZipFile(f'Local header of {source} has another name')
+        stream.seek(header[_FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+        _write_compressed(zip_file, member.rom.name, info, stream)
+    return True
+
+
+def _write_compressed(zip_file: zipfile.ZipFile, name: str, source_info: zipfile.ZipInfo,
+                      stream: BinaryIO) -> None:
+    """
+    Append a member with already compressed data. zipfile has no API for this, so the local header
+    is written here and the member is registered in the central directory the way ZipFile.writestr()
+    does it.
+    """
+    info = zipfile.ZipInfo(name, source_info.date_time)
+    info.compress_type = source_info.compress_type
+    info.flag_bits = source_info.flag_bits & _DEFLATE_OPTIONS
+    info.CRC = source_info.CRC
+    info.compress_size = source_info.compress_size
+    info.file_size = source_info.file_size
+    info.external_attr = 0o644 << 16
+    out = zip_file.fp
+    info.header_offset = out.tell()  # type: ignore
+    out.write(info.FileHeader())  # type: ignore
+    remaining = info.compress_size
+    while remaining:
+        chunk = stream.read(min(remaining, _READ_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile(f'Truncated data of {name}')
+        out.write(chunk)  # type: ignore
+        remaining -= len(chunk)
+    zip_file.filelist.append(info)
+    zip_file.NameToInfo[name] = info
+    end = out.tell()  # type: ignore
+    zip_file.start_dir = end  # pylint: disable=attribute-defined-outside-init
+    zip_file._didModify = True  # type: ignore  # pylint: disable=protected-access
+
+
+def _compress(zip_file: zipfile.ZipFile, member: Member) -> None:
+    """Stream the data of a loose file or archive member into a new deflated member."""
+    source = member.source
+    if isinstance(source, file.ZipPath):
+        with zipfile.ZipFile(str(source.archive)) as source_zip:
+            date_time = source_zip.getinfo(source.member).date_time
+    else:
+        date_time = max(time.localtime(source.stat().st_mtime)[:6], _MIN_DATE_TIME)
+    info = zipfile.ZipInfo(member.rom.name, date_time)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.file_size = member.rom.size  # selects ZIP64 headers for large members up front
+    info.external_attr = 0o644 << 16
+    with source.open('rb') as src, zip_file.open(info, 'w') as dst:
+        shutil.copyfileobj(src, dst, _READ_SIZE)
@@ -0,0 +1,358 @@
+"""
+Scan directories of ROM files and calculate their hashes.
+"""
+
+import concurrent.futures as futures
+import marshal
+import os
+import zipfile
+import zlib
+from typing import Dict  # pylint: disable=unused-import
+from typing import AbstractSet, Any, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+
+import attr  # type: ignore
+
+from . import cache, dat, file, storage
+
+# Default values of the 'scan.*' config keys.
+_DEFAULT_EXECUTOR = 'thread'
+_DEFAULT_WORKERS = os.cpu_count() or 1
+_DEFAULT_QUEUE_FACTOR = 4  # scan.queue_depth = scan.workers * factor
+
+_EXECUTORS = {
+    'thread': futures.ThreadPoolExecutor,
+    'process': futures.ProcessPoolExecutor,
+}
+
+# Directory names that are never scanned.
+_SKIP_DIRS = {'.srm'}
+
+_HASH_KINDS = ('crc', 'md5', 'sha1')
+
+# Number of files looked up at once in the hash cache.
+_LOOKUP_BATCH_SIZE = 500
+
+# Location of the scan snapshot, relative to the scanned root.
+_SNAPSHOT_PATH = ".srm/cache/snapshot"
+
+# Bump when the layout of the snapshot changes, to invalidate all existing snapshots.
+_SNAPSHOT_FORMAT = 1
+
+# Value of a scan job: (result, stat) for a file, or (member results, stat) for an archive.
+_JobResult = Tuple[Any, os.stat_result]
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)  # pylint: disable=too-few-public-methods
+class ScanResult:
+    """Hashes of one scanned file."""
+    path: file.AnyPath
+    size: int  # bytes
+    digests: Dict[str, str]  # hex digests keyed by 'crc', 'md5' and 'sha1'
+    error: str = ''  # reason the file could not be read
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)  # pylint: disable=too-few-public-methods
+class Changes:
+    """Files that changed since a snapshot was saved, as relative paths."""
+    added: List[str]
+    modified: List[str]
+    deleted: List[str]
+    unchanged: List[str]
+
+
+class Snapshot:
+    """
+    Stat identity (size, mtime_ns, inode) and scan results of every file below a root directory,
+    saved between scans so that a later scan only needs to hash new and modified files.
+    """
+
+    def __init__(self, root: str, path: Optional[str] = None) -> None:
+        """
+        :param root: Scanned directory.
+        :param path: Path of the snapshot file. Defaults to a file in the `.srm` dir of root.
+        """
+        self._root = root
+        self._path = path or os.path.join(root, _SNAPSHOT_PATH)
+        # relpath -> (size, mtime_ns, ino, results), see _encode_results()
+        self._entries = {}  # type: Dict[str, Tuple[int, int, int, List[Tuple[Any, ...]]]]
+
+    def load(self) -> None:
+        """Load the saved snapshot. A missing or unreadable snapshot is treated as empty."""
+        try:
+            with open(self._path, 'rb') as f:
+                data = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            data = None
+        if isinstance(data, dict) and data.get('format') == _SNAPSHOT_FORMAT:
+            self._entries = data['entries']
+        else:
+            self._entries = {}
+
+    def save(self) -> None:
+        """Save the snapshot, replacing the old file atomically."""
+        with storage.atomic_write(self._path, 'wb') as f:
+            f.write(marshal.dumps({'format': _SNAPSHOT_FORMAT, 'entries': self._entries}))
+
+    def diff(self, files: Iterable[Tuple[file.Path, os.stat_result]],
+             wanted: Iterable[str] = _HASH_KINDS,
+             sizes: Optional[AbstractSet[int]] = None) -> Changes:
+        """
+        Compare current files to the snapshot.
+
+        :param files: (path, stat) of every file currently found below root, see walk().
+        :param wanted: Hash kinds that must be saved for a file to be unchanged.
+        :param sizes: When given, results with a size that is not in this set need no hashes, see
+                      scan().
+        """
+        wanted = set(wanted)
+        added, modified, unchanged = [], [], []
+        seen = set()
+        for path, stat in files:
+            rel = os.path.relpath(str(path), self._root)
+            seen.add(rel)
+            entry = self._entries.get(rel)
+            if entry is None:
+                added.append(rel)
+            elif entry[:3] != (stat.st_size, stat.st_mtime_ns, stat.st_ino) or not all(
+                    not r[4] and (wanted.issubset(r[3]) or sizes is not None and r[1] not in sizes)
+                    for r in entry[3]):
+                modified.append(rel)
+            else:
+                unchanged.append(rel)
+        deleted = [rel for rel in self._entries if rel not in seen]
+        return Changes(added, modified, deleted, unchanged)
+
+    def results(self, rel: str) -> List[ScanResult]:
+        """Return the saved scan results of a file."""
+        path = file.Path(os.path.join(self._root, rel))
+        return [_decode_result(path, r) for r in self._entries[rel][3]]
+
+    def update(self, rel: str, stat: os.stat_result, results: Iterable[ScanResult]) -> None:
+        """Replace the saved stat identity and scan results of a file."""
+        self._entries[rel] = (stat.st_size, stat.st_mtime_ns, stat.st_ino,
+                              [_encode_result(r) for r in results])
+
+    def remove(self, rel: str) -> None:
+        """Forget a file."""
+        self._entries.pop(rel, None)
+
+
+def walk(root: str) -> Iterator[Tuple[file.Path, os.stat_result]]:
+    """
+    Yield the path and stat result of every regular file found below root, using a single
+    os.scandir() pass per directory.
+    """
+    dirs = [root]
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in _SKIP_DIRS:
+                        dirs.append(entry.path)
+                elif entry.is_file():
+                    yield file.Path(entry.path), entry.stat()
+
+
+def scan(root: str, conf: Optional[Mapping[str, Any]] = None,
+         hash_cache: Optional[cache.HashCache] = None, crc: bool = True, md5: bool = True,
+         sha1: bool = True, deep: bool = False,
+         sizes: Optional[AbstractSet[int]] = None) -> Iterator[ScanResult]:
+    """
+    Hash all files found below root and yield the results in completion order.
+
+    One result is returned for each archive member. When only 'crc' is selected, archives are
+    quick checked using the size and CRC stored in the archive index instead of decompressing it.
+
+    :param root: Directory to scan.
+    :param conf: Config used to select the 'scan.executor' ("thread" or "process"), the pool size
+                 'scan.workers' and the max number of files in flight 'scan.queue_depth'.
+    :param hash_cache: When given, cached hashes are used instead of reading unchanged files, and
+                       new hashes are added to the cache.
+    :param deep: When True, archives are never quick checked.
+    :param sizes: When given, files (and archive members) with a size that is not in this set are
+                  never read, and their results have no digests. Use the sizes of all ROMs in a
+                  DAT (see Datafile.sizes) to skip the files that cannot match it.
+    """
+    return scan_files(walk(root), conf, hash_cache, crc=crc, md5=md5, sha1=sha1, deep=deep,
+                      sizes=sizes)
+
+
+def rescan(root: str, conf: Optional[Mapping[str, Any]] = None,
+           hash_cache: Optional[cache.HashCache] = None, snapshot: Optional[Snapshot] = None,
+           crc: bool = True, md5: bool = True, sha1: bool = True, deep: bool = False,
+           sizes: Optional[AbstractSet[int]] = None) -> Iterator[ScanResult]:
+    """
+    Incrementally scan root. Saved results are returned for unchanged files, only new and modified
+    files are hashed, and deleted files are dropped. The snapshot is saved when the scan completes.
+
+    :param snapshot: Snapshot of the previous scan. Defaults to the one stored in root.
+    See scan() for the other parameters.
+    """
+    if snapshot is None:
+        snapshot = Snapshot(root)
+        snapshot.load()
+    kinds = dict(zip(_HASH_KINDS, (crc, md5, sha1)))
+    stats = {os.path.relpath(str(p), root): (p, stat) for p, stat in walk(root)}
+    changes = snapshot.diff(stats.values(), {k for k, v in kinds.items() if v}, sizes)
+    for rel in changes.deleted:
+        snapshot.remove(rel)
+    for rel in changes.unchanged:
+        yield from snapshot.results(rel)
+
+    # group results by the scanned file, since an archive returns one result per member
+    scanned = {}  # type: Dict[str, List[ScanResult]]
+    for result in scan_files((stats[rel] for rel in changes.added + changes.modified), conf,
+                             hash_cache, deep=deep, sizes=sizes, **kinds):
+        path = result.path.archive if isinstance(result.path, file.ZipPath) else result.path
+        scanned.setdefault(os.path.relpath(str(path), root), []).append(result)
+        yield result
+    for rel, results in scanned.items():
+        snapshot.update(rel, stats[rel][1], results)
+    snapshot.save()
+
+
+def scan_files(files: Iterable[Tuple[file.Path, os.stat_result]],
+               conf: Optional[Mapping[str, Any]] = None,
+               hash_cache: Optional[cache.HashCache] = None, crc: bool = True, md5: bool = True,
+               sha1: bool = True, deep: bool = False,
+               sizes: Optional[AbstractSet[int]] = None) -> Iterator[ScanResult]:
+    """
+    Hash (path, stat) pairs on a bounded worker pool and yield the results in completion order.
+
+    See scan() for details.
+    """
+    conf = conf or {}
+    kinds = dict(zip(_HASH_KINDS, (crc, md5, sha1)))
+    wanted = {k for k, v in kinds.items() if v}
+    workers = int(conf.get('scan.workers', _DEFAULT_WORKERS))
+    depth = int(conf.get('scan.queue_depth', workers * _DEFAULT_QUEUE_FACTOR))
+    executor = _EXECUTORS[conf.get('scan.executor', _DEFAULT_EXECUTOR)]
+    quick = wanted == {'crc'} and not deep
+
+    with executor(max_workers=workers) as pool:
+        # maps in-flight jobs to any digests already found in the cache (None for archives)
+        pending = {}  # type: Dict[futures.Future[_JobResult], Optional[Dict[str, str]]]
+        for batch in _batches(files, _LOOKUP_BATCH_SIZE):
+            if sizes is not None:
+                # files that cannot match any ROM are never read, archives are filtered by member
+                for path, stat in batch:
+                    if stat.st_size not in sizes and not path.is_archive():
+                        yield ScanResult(path, stat.st_size, {})
+                batch = [(p, stat) for p, stat in batch if stat.st_size in sizes or p.is_archive()]
+            cached = hash_cache.lookup((str(p), stat) for p, stat in batch) if hash_cache else {}
+            for path, stat in batch:
+                digests = cached.get(str(path), {})
+                if path.is_archive():
+                    job = pool.submit(_scan_archive, path, stat, kinds, quick, sizes)
+                    pending[job] = None
+                elif wanted.issubset(digests):
+                    yield ScanResult(path, stat.st_size, {k: digests[k] for k in wanted})
+                    continue
+                else:
+                    missing = {k: k in wanted and k not in digests for k in _HASH_KINDS}
+                    pending[pool.submit(_hash_file, path, stat, missing)] = digests
+                if len(pending) >= depth:
+                    done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                    yield from _results(done, pending, wanted, hash_cache)
+        yield from _results(futures.as_completed(list(pending)), pending, wanted, hash_cache)
+
+
+def _batches(files: Iterable[Tuple[file.Path, os.stat_result]],
+             size: int) -> Iterator[List[Tuple[file.Path, os.stat_result]]]:
+    batch = []  # type: List[Tuple[file.Path, os.stat_result]]
+    for item in files:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def match(results: Iterable[ScanResult],
+          datafile: dat.Datafile) -> Iterator[Tuple[ScanResult, List[dat.Match]]]:
+    """
+    Yield each scan result with the DAT entries matching its strongest hash. CRC only results
+    (e.g. from a quick check) are also matched by size.
+    """
+    for result in results:
+        if result.error or not result.digests:
+            yield result, []
+        elif set(result.digests) == {'crc'}:
+            yield result, datafile.matching(crc=result.digests['crc'], size=result.size)
+        else:
+            digests = result.digests
+            yield result, datafile.matching(crc=digests.get('crc'), md5=digests.get('md5'),
+                                            sha1=digests.get('sha1'))
+
+
+def _results(done: Iterable['futures.Future[_JobResult]'],
+             pending: Dict['futures.Future[_JobResult]', Optional[Dict[str, str]]],
+             wanted: Set[str],
+             hash_cache: Optional[cache.HashCache]) -> Iterator[ScanResult]:
+    """Yield the results of finished jobs, merged with the cached digests of each file."""
+    for future in done:
+        result, stat = future.result()
+        digests = pending.pop(future)
+        if digests is None:
+            yield from result
+            continue
+        if result.error:
+            yield result
+            continue
+        digests.update(result.digests)
+        if hash_cache is not None:
+            hash_cache.put(str(result.path), stat, digests)
+        yield attr.evolve(result, digests={k: digests[k] for k in wanted})
+
+
+def _hash_file(path: file.Path, stat: os.stat_result,
+               kinds: Dict[str, bool]) -> Tuple[ScanResult, os.stat_result]:
+    """Worker function, must be module level so it can be used by a process pool."""
+    try:
+        return ScanResult(path, stat.st_size, path.digests(**kinds)), stat
+    except OSError as ex:
+        return ScanResult(path, stat.st_size, {}, error=str(ex)), stat
+
+
+def _scan_archive(path: file.Path, stat: os.stat_result, kinds: Dict[str, bool], quick: bool,
+                  sizes: Optional[AbstractSet[int]]) -> Tuple[List[ScanResult], os.stat_result]:
+    """
+    Worker function, returns the results of each archive member. Quick checks use the size and CRC
+    stored in the archive index, otherwise each member is hashed while it is decompressed, reading
+    every member through a single open archive. Members with a size that is not in sizes are
+    skipped, see scan(). A member that cannot be read (e.g. with a bad CRC) only fails its own
+    result.
+    """
+    results = []
+    try:
+        with path.open_members() as members:
+            for member in members:
+                error = ''
+                if sizes is not None and member.size not in sizes:
+                    digests = {}  # type: Dict[str, str]
+                elif quick:
+                    digests = {'crc': member.stored_crc}
+                else:
+                    try:
+                        digests = member.digests(**kinds)
+                    except (OSError, EOFError, zipfile.BadZipFile, zlib.error) as ex:
+                        digests, error = {}, str(ex)
+                results.append(ScanResult(member, member.size, digests, error))
+    except (OSError, zipfile.BadZipFile) as ex:
+        return [ScanResult(path, stat.st_size, {}, error=str(ex))], stat
+    return results, stat
+
+
+def _encode_result(result: ScanResult) -> Tuple[Any, ...]:
+    """Return a result as (member, size, stored_crc, digests, error) for a snapshot."""
+    if isinstance(result.path, file.ZipPath):
+        return (result.path.member, result.size, result.path.stored_crc, result.digests,
+                result.error)
+    return ('', result.size, '', result.digests, result.error)
+
+
+def _decode_result(path: file.Path, encoded: Tuple[Any, ...]) -> ScanResult:
+    member, size, stored_crc, digests, error = encoded
+    result_path = file.ZipPath(path, member, size, stored_crc) if member else path
+    return ScanResult(result_path, size, digests, error)
@@ -0,0 +1,94 @@
+"""
+Safe writes of the files SRM keeps in ROM directories (config, caches and scan state).
+
+Files are never modified in place. New data is written to a temp file in the same directory, synced
+to disk and renamed over the old file, so readers and crashes only ever see the old or the new
+file. Read-modify-write updates that may race with another `srm` process use lock().
+"""
+
+import contextlib
+import itertools
+import os
+from typing import IO, Any, Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore  # pylint: disable=invalid-name
+
+# Lock file of a ROM directory, see dir_lock().
+_LOCK_PATH = ".srm/lock"
+
+# Makes temp file names unique within the process (the pid makes them unique between processes).
+_TEMP_IDS = itertools.count()
+
+
+@contextlib.contextmanager
+def atomic_path(path: str) -> Iterator[str]:
+    """
+    Yield the path of a new temp file, which replaces path when the block exits without error.
+    Otherwise the temp file is removed, and path is left unchanged.
+
+    Use this when the file is written by a library that opens it by name (e.g. sqlite3), otherwise
+    see atomic_write().
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}-{next(_TEMP_IDS)}.tmp'
+    try:
+        yield tmp_path
+        _fsync(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = 'w') -> Iterator[IO[Any]]:
+    """
+    Open a temp file for writing, which replaces path when the block exits without error.
+
+    :param mode: Open mode, 'w' or 'wb'.
+    """
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode) as f:
+            yield f
+
+
+@contextlib.contextmanager
+def lock(path: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock on a lock file while the block runs, waiting for other processes to
+    release it first. Locks are advisory, and are not supported on Windows (where this does
+    nothing).
+
+    :param path: Path of the lock file, created if it does not exist.
+    """
+    if fcntl is None:  # pragma: no cover
+        yield
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fileno = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fileno, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fileno)  # also releases the lock
+
+
+def dir_lock(directory: str) -> 'contextlib.AbstractContextManager[None]':
+    """Return the lock() of a ROM directory. Each directory has its own lock."""
+    return lock(os.path.join(directory, _LOCK_PATH))
+
+
+def _fsync(path: str) -> None:
+    fileno = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fileno)
+    finally:
+        os.close(fileno)
@@ -0,0 +1,98 @@
+"""
+Statistics of the last scan of a ROM directory.
+
+The summary is computed by `srm check` at the end of each verification, see tally(), and saved in
+the local `.srm` directory, so that commands like `status` never need to scan files or parse DAT
+files.
+"""
+
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Iterable, Optional, Set
+
+import attr  # type: ignore
+
+from . import storage
+
+if TYPE_CHECKING:  # pragma: no cover
+    from . import dat, verify  # pylint: disable=unused-import
+
+_SUMMARY_PATH = ".srm/summary"
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)  # pylint: disable=too-few-public-methods
+class Summary:
+    """Statistics of the last scan."""
+    last_scan: float = 0.0  # time of scan, in seconds since the epoch
+    dat_name: str = ''
+    dat_version: str = ''
+    dat_roms: int = 0  # total ROMs in DAT
+    dat_size: int = 0  # total bytes of ROMs in DAT
+    files: int = 0  # total files scanned (archive members are counted individually)
+    disk_size: int = 0  # total bytes on disk
+    valid: int = 0
+    invalid: int = 0
+    duplicate: int = 0
+    missing: int = 0
+
+
+def tally(datafile: 'dat.Datafile', verdicts: Iterable['verify.Verdict']) -> Summary:
+    """
+    Return the summary of a verification.
+
+    :param datafile: DAT the files were verified against.
+    :param verdicts: Verdicts of all files and missing ROMs, see verify.classify().
+    """
+    from . import file, verify
+    archives = set()  # type: Set[str]
+    counts = dict.fromkeys((verify.GOOD, verify.BAD, verify.DUPLICATE, verify.UNKNOWN,
+                            verify.MISSING), 0)
+    files = disk_size = 0
+    for verdict in verdicts:
+        counts[verdict.status] += 1
+        result = verdict.result
+        if result is None:
+            continue
+        files += 1
+        if isinstance(result.path, file.ZipPath):
+            if str(result.path.archive) not in archives:
+                archives.add(str(result.path.archive))
+                disk_size += result.path.archive.stat().st_size
+        else:
+            disk_size += result.size
+    dat_roms = dat_size = 0
+    for game in datafile.games:
+        dat_roms += len(game.roms)
+        dat_size += sum(r.size for r in game.roms)
+    return Summary(
+        last_scan=time.time(),
+        dat_name=datafile.name,
+        dat_version=datafile.version,
+        dat_roms=dat_roms,
+        dat_size=dat_size,
+        files=files,
+        disk_size=disk_size,
+        valid=counts[verify.GOOD],
+        invalid=counts[verify.BAD] + counts[verify.UNKNOWN],
+        duplicate=counts[verify.DUPLICATE],
+        missing=counts[verify.MISSING],
+    )
+
+
+def load(directory: str = '.') -> Optional[Summary]:
+    """Return the saved summary of a directory, or None if it was never scanned."""
+    try:
+        with open(os.path.join(directory, _SUMMARY_PATH)) as f:
+            fields = json.load(f)
+    except (OSError, ValueError):
+        return None
+    names = {a.name for a in attr.fields(Summary)}
+    summary = Summary(**{k: v for k, v in fields.items() if k in names})  # type: Summary
+    return summary
+
+
+def save(summary: Summary, directory: str = '.') -> None:
+    """Save the summary of a directory, replacing the old one atomically."""
+    with storage.atomic_write(os.path.join(directory, _SUMMARY_PATH)) as f:
+        json.dump(attr.asdict(summary), f, indent=2, sort_keys=True)
@@ -0,0 +1,130 @@
+"""
+Columnar, array backed view of the ROMs in a DAT, used to match whole collections at once.
+
+Match results are plain row numbers, and Game/ROM objects are only created for the rows that are
+actually requested. When NumPy is installed, joins are vectorized, otherwise a binary search is
+done for each value.
+"""
+
+import bisect
+from array import array
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from . import dat
+
+try:
+    import numpy  # type: ignore
+except ImportError:  # pragma: no cover
+    numpy = None  # type: ignore  # pylint: disable=invalid-name
+
+_MD5_SIZE = 16
+_SHA1_SIZE = 20
+
+
+class RomTable:
+    """
+    ROMs of a DAT stored in parallel arrays sorted by CRC.
+
+    Each row holds the CRC, size, MD5 and SHA1 of one ROM and the offset of its game in the DAT.
+    Missing MD5 and SHA1 hashes are stored as zero bytes. ROMs without a CRC cannot be joined, so
+    they have no row (a zero CRC would match every empty file).
+    """
+
+    def __init__(self, datafile: dat.Datafile) -> None:
+        """
+        :param datafile: DAT to read all ROMs from. Games are only read again when a row is
+                         converted back into a (Game, ROM) pair.
+        """
+        self._datafile = datafile
+        self._games = None  # type: Optional[Sequence[dat.Game]]
+        rows = []  # type: List[Tuple[int, int, bytes, bytes, int]]
+        for game_id, game in enumerate(datafile.games):
+            for rom in game.roms:
+                if not rom.crc:
+                    continue
+                rows.append((int(rom.crc, 16), rom.size, _unhex(rom.md5, _MD5_SIZE),
+                             _unhex(rom.sha1, _SHA1_SIZE), game_id))
+        rows.sort(key=lambda r: (r[0], r[1]))
+        self.crc = array('I', (r[0] for r in rows))
+        self.size = array('Q', (r[1] for r in rows))
+        self.md5 = b''.join(r[2] for r in rows)
+        self.sha1 = b''.join(r[3] for r in rows)
+        self.game_id = array('I', (r[4] for r in rows))
+
+    def __len__(self) -> int:
+        return len(self.crc)
+
+    def join(self, crcs: Sequence[int],
+             sizes: Optional[Sequence[int]] = None) -> Iterator[Tuple[int, int]]:
+        """
+        Match many files at once by CRC, and optionally by size.
+
+        :param crcs: CRC of each file, as int.
+        :param sizes: Size of each file, in the same order as crcs.
+        :return: (file index, row) for every matching pair.
+        """
+        if numpy is not None:
+            return self._join_numpy(crcs, sizes)
+        return self._join_bisect(crcs, sizes)
+
+    def match(self, row: int) -> dat.Match:
+        """Return the (Game, ROM) of a row."""
+        if self._games is None:
+            self._games = tuple(self._datafile.games)
+        game = self._games[self.game_id[row]]
+        digests = self.digests(row)
+        rom = next(r for r in game.roms
+                   if r.size == self.size[row] and _rom_digests(r) == digests)
+        return game, rom
+
+    def digests(self, row: int) -> Dict[str, str]:
+        """Return the hex digests stored in a row, keyed by 'crc', 'md5' and 'sha1'."""
+        digests = {'crc': '{:08x}'.format(self.crc[row])}
+        md5 = self.md5[row * _MD5_SIZE:(row + 1) * _MD5_SIZE]
+        sha1 = self.sha1[row * _SHA1_SIZE:(row + 1) * _SHA1_SIZE]
+        if any(md5):
+            digests['md5'] = md5.hex()
+        if any(sha1):
+            digests['sha1'] = sha1.hex()
+        return digests
+
+    def _join_bisect(self, crcs: Sequence[int],
+                     sizes: Optional[Sequence[int]]) -> Iterator[Tuple[int, int]]:
+        for i, crc in enumerate(crcs):
+            row = bisect.bisect_left(self.crc, crc)
+            while row < len(self.crc) and self.crc[row] == crc:
+                if sizes is None or self.size[row] == sizes[i]:
+                    yield i, row
+                row += 1
+
+    def _join_numpy(self, crcs: Sequence[int],
+                    sizes: Optional[Sequence[int]]) -> Iterator[Tuple[int, int]]:
+        column = numpy.frombuffer(self.crc, dtype=numpy.uint32)
+        values = numpy.asarray(crcs, dtype=numpy.uint32)
+        left = numpy.searchsorted(column, values, side='left')
+        counts = numpy.searchsorted(column, values, side='right') - left
+        # expand each file index into one entry per matching row
+        files = numpy.repeat(numpy.arange(len(values)), counts)
+        offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        rows = numpy.repeat(left, counts) + offsets
+        if sizes is not None:
+            keep = (numpy.frombuffer(self.size, dtype=numpy.uint64)[rows]
+                    == numpy.asarray(sizes, dtype=numpy.uint64)[files])
+            files, rows = files[keep], rows[keep]
+        return zip(files.tolist(), rows.tolist())
+
+
+def _rom_digests(rom: dat.ROM) -> Dict[str, str]:
+    """Return the digests of a ROM in the same format as RomTable.digests()."""
+    digests = {}  # type: Dict[str, str]
+    if rom.crc:
+        digests['crc'] = '{:08x}'.format(int(rom.crc, 16))
+    if rom.md5:
+        digests['md5'] = rom.md5.lower()
+    if rom.sha1:
+        digests['sha1'] = rom.sha1.lower()
+    return digests
+
+
+def _unhex(value: str, size: int) -> bytes:
+    return bytes.fromhex(value) if value else bytes(size)
@@ -0,0 +1,253 @@
+"""
+Refresh the DAT files tracked by ROM directories.
+
+Every tracked DAT is checked concurrently. A source only returns a DAT when it changed since the
+last update (e.g. using the HTTP ETag and Last-Modified validators), and new DATs are streamed to
+disk while they are hashed. Only the DATs that actually changed are compiled into the local cache
+again.
+
+DATs are tracked by listing their URLs under the 'dat.sources' key of the local config, and are
+stored in the local `.srm/dats` directory.
+"""
+
+import asyncio
+import hashlib
+import http.client
+import json
+import os
+import posixpath
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent import futures
+from typing import Dict  # pylint: disable=unused-import
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, cast
+from xml.etree import ElementTree
+
+import attr  # type: ignore
+
+from . import cache, storage
+
+_DAT_DIR = ".srm/dats"
+_STATE_PATH = ".srm/dats/state"
+
+# Max number of DATs fetched at the same time.
+_DEFAULT_CONNECTIONS = 8
+
+_READ_SIZE = 1024 * 64
+_TIMEOUT = 60
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)  # pylint: disable=too-few-public-methods
+class FetchState:
+    """Validators of the last fetched copy of a DAT."""
+    etag: str = ''
+    last_modified: str = ''
+    sha1: str = ''  # hash of the DAT data
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)  # pylint: disable=too-few-public-methods
+class UpdateResult:
+    """Outcome of the update of one DAT."""
+    url: str
+    path: str  # local copy of the DAT
+    changed: bool = False
+    error: str = ''
+
+
+class Source:
+    """Location DAT files are fetched from. Sources are selected by URL scheme, see Updater."""
+
+    def open(self, url: str, state: FetchState) -> Optional[Tuple[BinaryIO, FetchState]]:
+        """
+        Open a DAT for streaming reads.
+
+        :param state: Validators of the local copy, or empty if there is no local copy.
+        :return: The open stream and the validators of the new copy, or None if the DAT did not
+                 change.
+        """
+        raise NotImplementedError
+
+
+class HttpSource(Source):
+    """DATs downloaded with conditional HTTP requests."""
+
+    def __init__(self, timeout: float = _TIMEOUT) -> None:
+        """
+        :param timeout: Seconds to wait for the server, per request.
+        """
+        self._timeout = timeout
+
+    def open(self, url: str, state: FetchState) -> Optional[Tuple[BinaryIO, FetchState]]:
+        """See Source.open()."""
+        request = urllib.request.Request(url)
+        if state.etag:
+            request.add_header('If-None-Match', state.etag)
+        if state.last_modified:
+            request.add_header('If-Modified-Since', state.last_modified)
+        try:
+            response = urllib.request.urlopen(request, timeout=self._timeout)
+        except urllib.error.HTTPError as error:
+            if error.code == 304:  # not modified
+                return None
+            raise
+        new_state = FetchState(etag=response.headers.get('ETag', ''),
+                               last_modified=response.headers.get('Last-Modified', ''))
+        return cast(BinaryIO, response), new_state
+
+
+class FileSource(Source):
+    """DATs read from 'file://' URLs. The file size and mtime are used as the ETag."""
+
+    def open(self, url: str, state: FetchState) -> Optional[Tuple[BinaryIO, FetchState]]:
+        """See Source.open()."""
+        path = self._path(url)
+        stat = os.stat(path)
+        etag = f'{stat.st_size}-{stat.st_mtime_ns}'
+        if etag == state.etag:
+            return None
+        return open(path, 'rb'), FetchState(etag=etag)
+
+    def _path(self, url: str) -> str:  # pylint: disable=no-self-use
+        return urllib.request.url2pathname(urllib.parse.urlparse(url).path)
+
+
+class MirrorSource(FileSource):
+    """
+    DATs read from a local directory holding a copy of each file by name, e.g. a stand-in for
+    Dat-O-Matic. Any URL is mapped to the file with the same base name.
+    """
+
+    def __init__(self, directory: str) -> None:
+        """
+        :param directory: Directory of the mirrored DAT files.
+        """
+        self._directory = directory
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self._directory, _dat_name(url))
+
+
+class Updater:
+    """Update the DATs tracked by any number of directories at the same time."""
+
+    def __init__(self, sources: Optional[Dict[str, Source]] = None,
+                 connections: int = _DEFAULT_CONNECTIONS) -> None:
+        """
+        :param sources: Sources keyed by URL scheme, in addition to (or replacing) the default
+                        'http', 'https' and 'file' sources.
+        :param connections: Max number of DATs fetched at the same time.
+        """
+        http = HttpSource()
+        self._sources = {'http': http, 'https': http,
+                         'file': FileSource()}  # type: Dict[str, Source]
+        self._sources.update(sources or {})
+        self._connections = connections
+
+    def update(self, tracked: Iterable[Tuple[str, List[str]]]) -> Iterator[UpdateResult]:
+        """
+        Fetch every changed DAT and compile it into the cache of its directory.
+
+        :param tracked: Each directory with the URLs of the DATs it tracks. Fetches are started as
+                        soon as each directory is read.
+        :return: The result of each DAT, in completion order.
+        """
+        loop = asyncio.new_event_loop()
+        executor = futures.ThreadPoolExecutor(self._connections)
+        jobs = {}  # type: Dict[asyncio.Future[Tuple[UpdateResult, FetchState]], str]
+        try:
+            states = {}  # type: Dict[str, Dict[str, FetchState]]
+            remaining = {}  # type: Dict[str, int]
+            for directory, urls in tracked:
+                saved = _load_state(directory)
+                states[directory] = {}
+                remaining[directory] = len(urls)
+                for url in urls:
+                    state = saved.get(url, FetchState())
+                    job = loop.run_in_executor(executor, self._update_one, directory, url, state)
+                    jobs[job] = directory
+            while jobs:
+                done, _ = loop.run_until_complete(
+                    asyncio.wait(jobs, return_when=asyncio.FIRST_COMPLETED))
+                for job in done:
+                    directory = jobs.pop(job)
+                    result, state = job.result()
+                    states[directory][result.url] = state
+                    remaining[directory] -= 1
+                    if not remaining[directory]:
+                        _save_state(directory, states[directory])
+                    yield result
+        finally:
+            for job in jobs:
+                job.cancel()
+            executor.shutdown()
+            loop.close()
+
+    def _update_one(self, directory: str, url: str,
+                    state: FetchState) -> Tuple[UpdateResult, FetchState]:
+        """Fetch one DAT, and compile it when it changed. Runs in a worker thread."""
+        try:
+            path = dat_path(directory, url)
+        except ValueError as error:
+            return UpdateResult(url, '', error=str(error)), state
+        try:
+            source = self._sources.get(urllib.parse.urlparse(url).scheme)
+            if source is None:
+                raise ValueError(f'Unsupported URL {url!r}')
+            opened = source.open(url, state if os.path.exists(path) else FetchState())
+            if opened is None:
+                return UpdateResult(url, path), state
+            stream, new_state = opened
+            existed = os.path.exists(path)
+            sha1 = hashlib.sha1()
+            try:
+                with stream, storage.atomic_write(path, 'wb') as f:
+                    for chunk in iter(lambda: stream.read(_READ_SIZE), b''):
+                        sha1.update(chunk)
+                        f.write(chunk)
+                    new_state = attr.evolve(new_state, sha1=sha1.hexdigest())
+                    if new_state.sha1 == state.sha1 and existed:
+                        raise _Unchanged()
+            except _Unchanged:
+                # the source did not support conditional requests, but the data is the same, so
+                # the local copy is kept as it is (rewriting it would make DatCache check it again)
+                return UpdateResult(url, path), new_state
+            cache.DatCache(cache.cache_dir(directory)).load(path).close()
+            return UpdateResult(url, path, changed=True), new_state
+        except (OSError, ValueError, ElementTree.ParseError, http.client.HTTPException) as error:
+            # HTTPException includes IncompleteRead, raised by truncated downloads
+            return UpdateResult(url, path, error=str(error)), state
+
+
+class _Unchanged(Exception):
+    """Raised to discard the new copy of a DAT when it has the same data as the local copy."""
+
+
+def dat_path(directory: str, url: str) -> str:
+    """Return the path of the local copy of a tracked DAT."""
+    return os.path.join(directory, _DAT_DIR, _dat_name(url))
+
+
+def _dat_name(url: str) -> str:
+    name = posixpath.basename(urllib.parse.unquote(urllib.parse.urlparse(url).path))
+    if not name:
+        raise ValueError(f'URL {url!r} has no file name')
+    return name
+
+
+def _load_state(directory: str) -> Dict[str, FetchState]:
+    try:
+        with open(os.path.join(directory, _STATE_PATH)) as f:
+            return {url: FetchState(**fields) for url, fields in json.load(f).items()}
+    except (OSError, ValueError, TypeError):
+        return {}
+
+
+def _save_state(directory: str, states: Dict[str, FetchState]) -> None:
+    """Merge the new states into the saved ones, so parallel runs do not drop each other's."""
+    with storage.dir_lock(directory):
+        merged = _load_state(directory)
+        merged.update(states)
+        with storage.atomic_write(os.path.join(directory, _STATE_PATH)) as f:
+            json.dump({url: attr.asdict(s) for url, s in merged.items()}, f, indent=2,
+                      sort_keys=True)
@@ -0,0 +1,75 @@
+"""
+Verify a directory of ROM files against a DAT.
+
+Verification is a chain of generators: rescan() discovers files and only hashes the ones that
+changed since the last verification (or reads their hashes from the cache), match() looks them up
+in the DAT indexes, and classify() sorts them into good, bad, duplicate and unknown files. Each
+stage pulls from the previous one, so a result is available as soon as its file is hashed. The
+saved results of unchanged files are yielded first, and the missing ROMs are yielded last.
+
+Files with a size that no DAT ROM has can never match, so they are classified from their stat
+result alone, without reading any data.
+"""
+
+from typing import Dict  # pylint: disable=unused-import
+from typing import Any, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+
+import attr  # type: ignore
+
+from . import cache, dat, scan
+
+# Status of a verified file, or of a DAT ROM that was not found.
+GOOD = 'good'  # matches a DAT ROM that was not found before
+DUPLICATE = 'duplicate'  # matches only DAT ROMs that were already found
+BAD = 'bad'  # has the name of a DAT ROM, but not its hashes (e.g. a corrupt or modified dump)
+UNKNOWN = 'unknown'  # does not match any DAT ROM, or could not be read
+MISSING = 'missing'  # DAT ROM without any matching file
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)  # pylint: disable=too-few-public-methods
+class Verdict:
+    """Outcome of the verification of one file, or of one missing ROM."""
+    status: str
+    result: Optional[scan.ScanResult] = None  # None for missing ROMs
+    matches: List[dat.Match] = attr.Factory(list)  # matching (or missing) DAT entries
+
+
+def check(root: str, datafile: dat.Datafile, conf: Optional[Mapping[str, Any]] = None,
+          hash_cache: Optional[cache.HashCache] = None, deep: bool = False) -> Iterator[Verdict]:
+    """
+    Scan every file below root and yield the verdict of each file in completion order, followed by
+    the verdicts of all missing ROMs.
+
+    Only CRCs are computed unless deep is True, see scan.scan(). Files with a size that no DAT ROM
+    has are never read. The scan is incremental, see scan.rescan(): only the files that changed
+    since the last check are scanned again.
+    """
+    results = scan.rescan(root, conf, hash_cache, md5=deep, sha1=deep, deep=deep,
+                          sizes=datafile.sizes)
+    return classify(scan.match(results, datafile), datafile)
+
+
+def classify(matched: Iterable[Tuple[scan.ScanResult, List[dat.Match]]],
+             datafile: dat.Datafile) -> Iterator[Verdict]:
+    """
+    Yield the verdict of each scan result with its DAT matches (see scan.match()), then one
+    MISSING verdict for each DAT ROM that no file matched.
+    """
+    found = set()  # type: Set[Tuple[str, str]]
+    names = None  # type: Optional[Set[str]]
+    for result, matches in matched:
+        roms = {(g.name, r.name) for g, r in matches}
+        if not roms:
+            if names is None:
+                names = {r.name for g in datafile.games for r in g.roms}
+            bad = not result.error and result.path.name in names
+            yield Verdict(BAD if bad else UNKNOWN, result)
+        elif roms.issubset(found):
+            yield Verdict(DUPLICATE, result, matches)
+        else:
+            found.update(roms)
+            yield Verdict(GOOD, result, matches)
+    for game in datafile.games:
+        for rom in game.roms:
+            if (game.name, rom.name) not in found:
+                yield Verdict(MISSING, matches=[(game, rom)])
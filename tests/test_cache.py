@@ -0,0 +1,118 @@
+"""
+Test cases for data cached in the local config directory.
+"""
+
+import os
+from unittest.mock import patch
+
+from srm.cache import DatCache, HashCache
+from srm.dat import DatafileXml
+from srm.file import Path
+
+from .test_dat import DAT_02, DAT_03
+
+
+def test_compiled_dat_matches_xml(tmp_path):
+    dat_path = tmp_path / 'test.dat'
+    dat_path.write_text(DAT_02['xml'])
+    xml = DatafileXml(str(dat_path))
+    compiled = DatCache(str(tmp_path / 'cache')).load(str(dat_path))
+    assert compiled.header == xml.header
+    assert sorted(compiled.games, key=lambda g: g.name) == sorted(xml.games, key=lambda g: g.name)
+    assert compiled.crcs == xml.crcs
+    assert compiled.sizes == xml.sizes
+    assert sorted(compiled.matching(crc='3D7CB329')) == sorted(xml.matching(crc='3d7cb329'))
+    assert compiled.matching(crc='c0ab3efc', size=1) == []
+
+
+def test_compiled_dat_is_reused_when_source_is_touched(tmp_path):
+    dat_path = tmp_path / 'test.dat'
+    dat_path.write_text(DAT_02['xml'])
+    cache = DatCache(str(tmp_path / 'cache'))
+    cache.load(str(dat_path))
+    compiled_ino = os.stat(cache.cache_path(str(dat_path))).st_ino
+    os.utime(str(dat_path), ns=(1, 1))
+    cache.load(str(dat_path))
+    assert os.stat(cache.cache_path(str(dat_path))).st_ino == compiled_ino
+
+
+def test_compiled_dat_is_rebuilt_when_source_changes(tmp_path):
+    dat_path = tmp_path / 'test.dat'
+    dat_path.write_text(DAT_02['xml'])
+    cache = DatCache(str(tmp_path / 'cache'))
+    cache.load(str(dat_path))
+    dat_path.write_text(DAT_03['xml'])
+    compiled = cache.load(str(dat_path))
+    assert compiled.name == DAT_03['header']['name']
+    assert [g.name for g in compiled.games] == ['Battletoads (Japan)']
+
+
+def test_hash_cache_returns_stored_digests(tmp_path):
+    rom = tmp_path / 'rom.bin'
+    rom.write_bytes(b'data')
+    with HashCache(str(tmp_path / 'cache')) as cache:
+        cache.put(str(rom), os.stat(str(rom)), {'crc': 'adf3f363'})
+    with HashCache(str(tmp_path / 'cache')) as cache:
+        assert cache.lookup([(str(rom), os.stat(str(rom)))]) == {str(rom): {'crc': 'adf3f363'}}
+
+
+def test_hash_cache_ignores_modified_file(tmp_path):
+    rom = tmp_path / 'rom.bin'
+    rom.write_bytes(b'data')
+    with HashCache(str(tmp_path / 'cache')) as cache:
+        cache.put(str(rom), os.stat(str(rom)), {'crc': 'adf3f363'})
+        rom.write_bytes(b'new data')
+        assert cache.get(str(rom)) == {}
+
+
+def test_hash_cache_only_hashes_missing_digests(tmp_path):
+    rom = Path(str(tmp_path / 'rom.bin'))
+    rom.write_bytes(b'data')
+    with HashCache(str(tmp_path / 'cache')) as cache:
+        cache.put(str(rom), rom.stat(), {'crc': 'cached'})
+        with patch.object(Path, 'digests', autospec=True, return_value={'md5': 'md5'}) as digests:
+            assert cache.digests(rom, sha1=False) == {'crc': 'cached', 'md5': 'md5'}
+            assert cache.digests(rom, sha1=False) == {'crc': 'cached', 'md5': 'md5'}
+        digests.assert_called_once_with(rom, crc=False, md5=True, sha1=False)
+
+
+def test_hash_cache_evicts_deleted_file(tmp_path):
+    roms = [tmp_path / 'a.bin', tmp_path / 'b.bin']
+    with HashCache(str(tmp_path / 'cache')) as cache:
+        for rom in roms:
+            rom.write_bytes(rom.name.encode())
+            cache.put(str(rom), os.stat(str(rom)), {'crc': rom.name})
+        roms[0].unlink()
+        assert cache.evict() == 1
+        assert cache.get(str(roms[1])) == {'crc': 'b.bin'}
+
+
+def test_hash_cache_lookup_uses_index(tmp_path):
+    with HashCache(str(tmp_path / 'cache')) as cache:
+        conn = cache._connect()  # pylint: disable=protected-access
+        plan = conn.execute('EXPLAIN QUERY PLAN SELECT * FROM hash WHERE ino IN (1, 2)').fetchall()
+    assert 'USING INDEX' in plan[0][-1]
+
+
+def test_compiled_dat_keeps_field_types(tmp_path):
+    dat_path = tmp_path / 'test.dat'
+    xml = DAT_02['xml'].replace('<game name="gtmr">', '<game name="gtmr" isbios="yes">')
+    dat_path.write_text(xml)
+    compiled = DatCache(str(tmp_path / 'cache')).load(str(dat_path))
+    games = {g.name: g for g in compiled.games}
+    assert games['gtmr'].isbios is True
+    assert games['gtmrb'].isbios is False
+    assert all(isinstance(r.size, int) for r in games['gtmr'].roms)
+
+
+def test_compiled_dat_shares_roms_and_keeps_merge_names(tmp_path):
+    dat_path = tmp_path / 'test.dat'
+    dat_path.write_text(DAT_02['xml'])
+    compiled = DatCache(str(tmp_path / 'cache')).load(str(dat_path))
+    games = {g.name: g for g in compiled.games}
+    clone_rom, = [r for r in games['gtmrb'].roms if r.name == 'mm-200-402-s0.bin']
+    parent_rom, = [r for r in games['gtmr'].roms if r.name == 'mm-200-402-s0.bin']
+    assert clone_rom is parent_rom
+    assert games['gtmrb'].merges['mm-200-402-s0.bin'] == 'mm-200-402-s0.bin'
+    assert games['gtmrb'].manufacturer is games['gtmr'].manufacturer  # interned
+    assert 'mm-200-402-s0.bin' not in {r.name for r in compiled.sets.required(games['gtmrb'])}
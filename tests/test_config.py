@@ -128,3 +128,189 @@ def test_chain_config_exists():
     with tempfile.NamedTemporaryFile() as t:
         c = ChainConf(Conf(t.name))
         assert c.exists()
+
+
+def test_get_nested_table():
+    c = Conf('config')
+    c['s1.s2.key'] = V
+    c['s1.key'] = 1
+    assert c['s1'] == {'s2': {'key': V}, 'key': 1}
+    with pytest.raises(KeyError):
+        c['s1.s3']
+
+
+def test_set_table_replaces_old_table():
+    c = Conf('config')
+    c['s1'] = {'a': 1, 'b': 2}
+    c['s1'] = {'a': 3}
+    assert c['s1'] == {'a': 3}
+    assert list(c) == ['s1.a']
+
+
+def test_set_replaces_value_with_table_and_back():
+    with tempfile.TemporaryDirectory() as d:
+        c = Conf(os.path.join(d, 'config'))
+        c['key'] = 1
+        c['key'] = {'a': 2}
+        assert list(c) == ['key.a']
+        c.dump()
+        c['key'] = 3
+        assert list(c) == ['key']
+        c.dump()
+        with open(c._path) as f:  # pylint: disable=protected-access
+            assert f.read() == 'key = 3\n'
+
+
+def test_iter_and_len():
+    c = Conf('config')
+    c['s1.s2.key'] = V
+    c['key'] = 1
+    assert sorted(c) == ['key', 's1.s2.key']
+    assert len(c) == 2
+    del c['s1']
+    assert list(c) == ['key']
+
+
+def test_load_parses_file_once():
+    with tempfile.NamedTemporaryFile() as t:
+        with open(t.name, 'w+') as f:
+            toml.dump({'s1': {'key': 1}}, f)
+        with patch('toml.load', wraps=toml.load) as load:
+            for _ in range(3):
+                c = Conf(t.name)
+                c.load()
+                assert c['s1.key'] == 1
+            assert load.call_count == 1
+            # file changed
+            with open(t.name, 'w+') as f:
+                toml.dump({'s1': {'key': 22}}, f)
+            c.load()
+            assert c['s1.key'] == 22
+            assert load.call_count == 2
+
+
+def test_loaded_values_are_not_shared():
+    with tempfile.NamedTemporaryFile() as t:
+        with open(t.name, 'w+') as f:
+            toml.dump({'key': 1}, f)
+        c1, c2 = Conf(t.name), Conf(t.name)
+        c1.load()
+        c2.load()
+        c1['key'] = 2
+        assert c2['key'] == 1
+
+
+def test_load_missing_file_raises_exception():
+    with tempfile.TemporaryDirectory() as d:
+        with pytest.raises(FileNotFoundError):
+            Conf(os.path.join(d, 'missing')).load()
+        with pytest.raises(FileNotFoundError):
+            ChainConf(Conf(os.path.join(d, 'missing'))).load()
+
+
+def test_chain_config_loads_lazily():
+    with tempfile.NamedTemporaryFile() as global_path, \
+            tempfile.NamedTemporaryFile() as local_path:
+        with open(global_path.name, 'w+') as f:
+            toml.dump({'key': 1, 'other': 2}, f)
+        with open(local_path.name, 'w+') as f:
+            toml.dump({'key': 3}, f)
+        c = ChainConf(Conf(local_path.name), Conf(global_path.name))
+        with patch('toml.load', wraps=toml.load) as load:
+            c.load()
+            assert load.call_count == 0
+            assert c['key'] == 3
+            assert load.call_count == 1
+            assert c['other'] == 2
+            assert load.call_count == 2
+
+
+def test_chain_config_snapshot():
+    c = ChainConf(Conf('local'), Conf('global'))
+    c.maps[1]['s1.key'] = 1
+    c.maps[1]['key'] = 2
+    c['key'] = 3
+    assert c.snapshot() == {'s1.key': 1, 'key': 3}
+
+
+def test_local_configs_do_not_share_global_config():
+    c1, c2 = LocalConf(), LocalConf()
+    assert c1.maps[1] is not c2.maps[1]
+    assert isinstance(GlobalConf(), Conf)
+
+
+def test_batch_dumps_once():
+    with tempfile.TemporaryDirectory() as d:
+        c = Conf(os.path.join(d, 'config'))
+        with patch.object(Conf, 'dump', autospec=True, side_effect=Conf.dump) as dump:
+            with c.batch():
+                for i in range(10):
+                    c[f'key{i}'] = i
+                with c.batch():
+                    c['s1.key'] = 1
+                assert dump.call_count == 0
+            assert dump.call_count == 1
+        c2 = Conf(c._path)  # pylint: disable=protected-access
+        c2.load()
+        assert len(c2) == 11
+
+
+def test_batch_merges_changes_from_other_writers():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'config')
+        c1, c2 = Conf(path), Conf(path)
+        with c1.batch():
+            c1['key0'] = 0
+            c1['key1'] = 1
+        c2.load()
+        with c1.batch():
+            c1['key3'] = 3
+        with c2.batch():
+            c2['key2'] = 2
+            del c2['key0']
+        c3 = Conf(path)
+        c3.load()
+        assert dict(c3) == {'key1': 1, 'key2': 2, 'key3': 3}
+
+
+def test_batch_sees_writes_with_same_mtime_and_size():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'config')
+        c1 = Conf(path)
+        with c1.batch():
+            c1['key0'] = 0
+        Conf(path).load()  # the parsed file is cached
+        stat = os.stat(path)
+        # another writer replaces the file within the same mtime tick, without changing its size
+        with open(path, 'w') as f:
+            f.write('key0 = 1\n')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        with c1.batch():
+            c1['key1'] = 1
+        c2 = Conf(path)
+        c2.load()
+        assert dict(c2) == {'key0': 1, 'key1': 1}
+
+
+def test_batch_not_saved_on_error():
+    with tempfile.TemporaryDirectory() as d:
+        c = Conf(os.path.join(d, 'config'))
+        with pytest.raises(ValueError):
+            with c.batch():
+                c['key'] = 1
+                raise ValueError
+        assert not c.exists()
+
+
+def test_dump_is_atomic():
+    with tempfile.TemporaryDirectory() as d:
+        c = Conf(os.path.join(d, 'config'))
+        c['key'] = 1
+        c.dump()
+        with patch('toml.dump', side_effect=OSError):
+            c['key'] = 2
+            with pytest.raises(OSError):
+                c.dump()
+        assert os.listdir(d) == ['config']
+        with open(c._path) as f:  # pylint: disable=protected-access
+            assert f.read() == 'key = 1\n'
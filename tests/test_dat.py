@@ -4,10 +4,12 @@ Test cases for DAT XML import and processing.
 
 from itertools import zip_longest
 from unittest.mock import ANY, mock_open, patch, sentinel
+from xml.etree import ElementTree
 
 import pytest
 
-from srm.dat import ROM, DatafileXml, Game
+from srm import dat
+from srm.dat import ROM, DatafileXml, Game, RomPool
 
 PATH = sentinel.PATH
 
@@ -66,8 +68,8 @@ DAT_01 = dict(
         ),
     ],
     roms=[
-        ROM(name="1941 - counter attack (japan).pce", size="1048576", crc="8c4588e2"),
-        ROM(name="aldynes (japan).pce", size="1048576", crc="4c2126b0"),
+        ROM(name="1941 - counter attack (japan).pce", size=1048576, crc="8c4588e2"),
+        ROM(name="aldynes (japan).pce", size=1048576, crc="4c2126b0"),
     ],
 )
 
@@ -138,6 +140,9 @@ DAT_02 = dict(
             cloneof="gtmr",
             romof="gtmr",
             roms=ANY,
+            merges={name: name for name in [
+                "mm-200-402-s0.bin", "mm-201-403-s1.bin", "mm-202-404-s2.bin", "mm-203-405-s3.bin",
+                "mm-300-406-a0.bin", "mm-100-401-e0.bin"]},
         ),
         Game(
             name="gtmr",
@@ -150,28 +155,22 @@ DAT_02 = dict(
         ),
     ],
     roms=[
-        ROM(name="mm-100-401-e0.bin", merge="mm-100-401-e0.bin", size="1048576", crc="b9cbfbee"),
-        ROM(name="mm-100-401-e0.bin", size="1048576", crc="b9cbfbee"),
-        ROM(name="mm-200-402-s0.bin", merge="mm-200-402-s0.bin", size="2097152", crc="c0ab3efc"),
-        ROM(name="mm-200-402-s0.bin", size="2097152", crc="c0ab3efc"),
-        ROM(name="mm-201-403-s1.bin", merge="mm-201-403-s1.bin", size="2097152", crc="cf6b23dc"),
-        ROM(name="mm-201-403-s1.bin", size="2097152", crc="cf6b23dc"),
-        ROM(name="mm-202-404-s2.bin", merge="mm-202-404-s2.bin", size="2097152", crc="8f27f5d3"),
-        ROM(name="mm-202-404-s2.bin", size="2097152", crc="8f27f5d3"),
-        ROM(name="mm-203-405-s3.bin", merge="mm-203-405-s3.bin", size="524288", crc="e9747c8c"),
-        ROM(name="mm-203-405-s3.bin", size="524288", crc="e9747c8c"),
-        ROM(name="mm-300-406-a0.bin", merge="mm-300-406-a0.bin", size="2097152", crc="b15f6b7f"),
-        ROM(name="mm-300-406-a0.bin", size="2097152", crc="b15f6b7f"),
-        ROM(name="mmd0x1.u124", size="131072", crc="3d7cb329"),
-        ROM(name="mmd0x2.u124.bin", size="131072", crc="3d7cb329"),
-        ROM(name="mmp0x1.u514", size="524288", crc="6c163f12"),
-        ROM(name="mmp1x1.u513", size="524288", crc="424dc7e1"),
-        ROM(name="mms0x1.u29", size="131072", crc="bd22b7d2"),
-        ROM(name="mms0x2.u29.bin", size="131072", crc="bd22b7d2"),
-        ROM(name="mms1x1.u30", size="131072", crc="9463825c"),
-        ROM(name="mms1x2.u30.bin", size="131072", crc="b42b426f"),
-        ROM(name="u1.bin", size="524288", crc="6238790a"),
-        ROM(name="u2.bin", size="524288", crc="031799f7"),
+        ROM(name="mm-100-401-e0.bin", size=1048576, crc="b9cbfbee"),
+        ROM(name="mm-200-402-s0.bin", size=2097152, crc="c0ab3efc"),
+        ROM(name="mm-201-403-s1.bin", size=2097152, crc="cf6b23dc"),
+        ROM(name="mm-202-404-s2.bin", size=2097152, crc="8f27f5d3"),
+        ROM(name="mm-203-405-s3.bin", size=524288, crc="e9747c8c"),
+        ROM(name="mm-300-406-a0.bin", size=2097152, crc="b15f6b7f"),
+        ROM(name="mmd0x1.u124", size=131072, crc="3d7cb329"),
+        ROM(name="mmd0x2.u124.bin", size=131072, crc="3d7cb329"),
+        ROM(name="mmp0x1.u514", size=524288, crc="6c163f12"),
+        ROM(name="mmp1x1.u513", size=524288, crc="424dc7e1"),
+        ROM(name="mms0x1.u29", size=131072, crc="bd22b7d2"),
+        ROM(name="mms0x2.u29.bin", size=131072, crc="bd22b7d2"),
+        ROM(name="mms1x1.u30", size=131072, crc="9463825c"),
+        ROM(name="mms1x2.u30.bin", size=131072, crc="b42b426f"),
+        ROM(name="u1.bin", size=524288, crc="6238790a"),
+        ROM(name="u2.bin", size=524288, crc="031799f7"),
     ],
 )
 
@@ -212,7 +211,7 @@ DAT_03 = dict(
     ],
     roms=[
         ROM(name="Battletoads (Japan).gb",
-            size="131072",
+            size=131072,
             crc="331CF7DE",
             md5="3D57E0391C8191C105A4F015A0C103E9",
             sha1="666ED5D34F508C8805A67F4400FC01A1F2817E03")
@@ -259,11 +258,225 @@ def test_load_games_from_dat(xml, exp_games):
     pytest.param(DAT_03['xml'], DAT_03['roms'], id=DAT_03['id']),
 ])
 def test_load_roms_from_dat(xml, exp_roms):
-    found_roms = set()
     with patch('xml.etree.ElementTree.open', mock_open(read_data=xml)) as mock_file:
         dat = DatafileXml(PATH)
-        for game in dat.games:
-            for rom in game.roms:
-                assert rom in exp_roms
+    found_roms, merged_roms = set(), set()
+    for game in dat.games:
+        for rom in game.roms:
+            assert rom in exp_roms
+            # a clone lists the ROMs it merges from its parent again, with a 'merge' name. That
+            # name is kept by the game (see Game.merges), so the copy is equal to the parent ROM.
+            if rom.name in game.merges:
+                merged_roms.add(rom)
+            else:
                 assert rom not in found_roms
                 found_roms.add(rom)
+    found_roms |= merged_roms
+    assert found_roms == set(exp_roms)
+
+
+@pytest.mark.parametrize("dat", [
+    pytest.param(DAT_01, id=DAT_01['id']),
+    pytest.param(DAT_02, id=DAT_02['id']),
+    pytest.param(DAT_03, id=DAT_03['id']),
+])
+def test_stream_games_from_dat(dat, tmp_path):
+    path = tmp_path / 'test.dat'
+    path.write_text(dat['xml'])
+    parsed = DatafileXml(str(path))
+    streamed = DatafileXml(str(path), stream=True)
+    assert streamed.name == dat['header']['name']
+    assert streamed.version == dat['header']['version']
+    assert list(streamed.games) == list(parsed.games)
+    # stream can be iterated more than once
+    assert list(streamed.games) == list(parsed.games)
+
+
+def test_stream_dat_without_header_raises_exception(tmp_path):
+    path = tmp_path / 'test.dat'
+    path.write_text('<datafile><game name="a"><description>a</description></game></datafile>')
+    with pytest.raises(ElementTree.ParseError):
+        DatafileXml(str(path), stream=True)
+
+
+def _dat_from_xml(xml):
+    with patch('xml.etree.ElementTree.open', mock_open(read_data=xml)):
+        return DatafileXml(PATH)
+
+
+def test_index_matches_shared_crc():
+    dat = _dat_from_xml(DAT_02['xml'])
+    matches = dat.matching(crc='3D7CB329')
+    assert {(g.name, r.name) for g, r in matches} == {
+        ('gtmrb', 'mmd0x1.u124'),
+        ('gtmr', 'mmd0x2.u124.bin'),
+    }
+    assert '3d7cb329' in dat.crcs
+
+
+def test_index_matches_size_and_crc():
+    dat = _dat_from_xml(DAT_02['xml'])
+    assert len(dat.matching(crc='c0ab3efc', size=2097152)) == 2
+    assert dat.matching(crc='c0ab3efc', size=1) == []
+
+
+def test_index_matches_strongest_hash():
+    dat = _dat_from_xml(DAT_03['xml'])
+    (game, rom), = dat.matching(crc='00000000', md5='3d57e0391c8191c105a4f015a0c103e9')
+    assert game.name == 'Battletoads (Japan)'
+    assert rom.name == 'Battletoads (Japan).gb'
+    assert dat.matching(sha1='666ed5d34f508c8805a67f4400fc01a1f2817e03') == [(game, rom)]
+    assert dat.md5s == {'3d57e0391c8191c105a4f015a0c103e9'}
+
+
+def test_index_matching_without_hash_raises_exception():
+    dat = _dat_from_xml(DAT_03['xml'])
+    with pytest.raises(ValueError):
+        dat.matching(size=131072)
+
+
+def test_load_typed_fields_from_dat():
+    dat = _dat_from_xml("""\
+<datafile>
+    <header>
+        <name>BIOS</name>
+        <description>BIOS</description>
+        <version>1</version>
+        <author>Test</author>
+    </header>
+    <game name="neogeo" isbios="yes">
+        <description>Neo-Geo</description>
+        <rom name="sp-s2.sp1" size="131072" crc="9036d879"/>
+    </game>
+</datafile>
+""")
+    game, = dat.games
+    rom, = game.roms
+    assert game.isbios is True
+    assert rom.size == 131072
+
+
+def test_identical_roms_share_one_instance():
+    dat = _dat_from_xml(DAT_02['xml'])
+    games = {g.name: g for g in dat.games}
+    # the clone lists the parent ROM with a 'merge' name, which belongs to the clone
+    clone_rom, = [r for r in games['gtmrb'].roms if r.name == 'mm-200-402-s0.bin']
+    parent_rom, = [r for r in games['gtmr'].roms if r.name == 'mm-200-402-s0.bin']
+    assert clone_rom is parent_rom
+    assert games['gtmrb'].merges['mm-200-402-s0.bin'] == 'mm-200-402-s0.bin'
+    assert 'mm-200-402-s0.bin' not in games['gtmr'].merges
+    # merge names are read-only, and all games without any share one empty mapping
+    with pytest.raises(TypeError):
+        games['gtmrb'].merges['x'] = 'x'  # type: ignore
+    assert games['gtmr'].merges is next(iter(_dat_from_xml(DAT_01['xml']).games)).merges
+    # repeated field values are interned
+    assert games['gtmrb'].manufacturer is games['gtmr'].manufacturer
+
+
+def test_rom_pool_is_shared_between_dats(tmp_path):
+    pool = RomPool()
+    for name, dat in [('a.dat', DAT_02), ('b.dat', DAT_02)]:
+        (tmp_path / name).write_text(dat['xml'])
+        list(DatafileXml(str(tmp_path / name), pool=pool).games)
+    assert len(pool) == len(DAT_02['roms'])
+
+
+DAT_SETS = """\
+<?xml version="1.0"?>
+<datafile>
+    <header><name>sets</name><description>sets</description><version>1</version>
+    <author>test</author></header>
+    <game name="neogeo" isbios="yes">
+        <description>Neo-Geo</description>
+        <rom name="bios.rom" size="4" crc="00000001"/>
+    </game>
+    <game name="parent" romof="neogeo">
+        <description>Parent</description>
+        <rom name="bios.rom" merge="bios.rom" size="4" crc="00000001"/>
+        <rom name="p1.rom" size="4" crc="00000002"/>
+        <rom name="shared.rom" size="4" crc="00000003"/>
+    </game>
+    <game name="clone" cloneof="parent" romof="parent">
+        <description>Clone</description>
+        <rom name="bios.rom" merge="bios.rom" size="4" crc="00000001"/>
+        <rom name="shared.rom" merge="shared.rom" size="4" crc="00000003"/>
+        <rom name="c1.rom" size="4" crc="00000004"/>
+    </game>
+    <game name="orphan" cloneof="missing" romof="missing">
+        <description>Orphan</description>
+        <rom name="o1.rom" merge="o1.rom" size="4" crc="00000005"/>
+    </game>
+</datafile>
+"""
+
+
+def _rom_names(archives):
+    return {name: sorted(r.name for r in roms) for name, roms in archives}
+
+
+def test_resolver_builds_parent_clone_graph():
+    sets = _dat_from_xml(DAT_SETS).sets
+    clone = sets.games['clone']
+    assert sets.parent(clone) is sets.games['parent']
+    assert sets.parent(sets.games['orphan']) is None
+    assert sets.bios(clone) is sets.games['neogeo']
+    assert sets.bios(sets.games['neogeo']) is None
+    assert sets.clones['parent'] == [clone]
+
+
+@pytest.mark.parametrize("set_type,exp_archives", [
+    (dat.NON_MERGED, {
+        'neogeo': ['bios.rom'],
+        'parent': ['bios.rom', 'p1.rom', 'shared.rom'],
+        'clone': ['bios.rom', 'c1.rom', 'shared.rom'],
+        'orphan': ['o1.rom'],
+    }),
+    (dat.SPLIT, {
+        'neogeo': ['bios.rom'],
+        'parent': ['p1.rom', 'shared.rom'],
+        'clone': ['c1.rom'],
+        'orphan': ['o1.rom'],
+    }),
+    (dat.MERGED, {
+        'neogeo': ['bios.rom'],
+        'parent': ['c1.rom', 'p1.rom', 'shared.rom'],
+        'orphan': ['o1.rom'],
+    }),
+])
+def test_resolver_archives(set_type, exp_archives):
+    sets = _dat_from_xml(DAT_SETS).sets
+    assert _rom_names(sets.archives(set_type)) == exp_archives
+
+
+def test_resolver_unknown_set_type_raises_exception():
+    sets = _dat_from_xml(DAT_SETS).sets
+    with pytest.raises(ValueError):
+        sets.required(sets.games['parent'], 'zipped')
+
+
+def test_union_index_matches_all_sets(tmp_path):
+    path_02, path_03 = tmp_path / '02.dat', tmp_path / '03.dat'
+    path_02.write_text(DAT_02['xml'])
+    path_03.write_text(DAT_03['xml'])
+    pool = RomPool()
+    dat_02 = DatafileXml(str(path_02), pool=pool)
+    dat_03 = DatafileXml(str(path_03), pool=pool)
+    index = dat.UnionIndex([dat_02, dat_03], pool=pool)
+    assert index.sets(crc='331cf7de') == [dat_03]
+    assert index.sets(crc='3d7cb329') == [dat_02]
+    assert index.sets(crc='00000000') == []
+    (datafile, game, rom), = index.matching(crc='331cf7de')
+    assert (datafile, (game, rom)) == (dat_03, dat_03.matching(crc='331cf7de')[0])
+    assert index.matching(crc='331cf7de', size=0) == []
+
+
+def test_union_index_shares_roms_between_sets():
+    dat_a, dat_b = _dat_from_xml(DAT_03['xml']), _dat_from_xml(DAT_03['xml'])
+    index = dat.UnionIndex([dat_a, dat_b])
+    (_, _, rom_a), (_, _, rom_b) = index.matching(crc='331cf7de')
+    assert rom_a is rom_b
+    assert index.sets(crc='331cf7de') == [dat_a, dat_b]
+
+
+def test_dat_sizes():
+    assert _dat_from_xml(DAT_03['xml']).sizes == {131072}
@@ -0,0 +1,116 @@
+"""
+Test cases for finding duplicate files.
+"""
+
+import os
+import zipfile
+
+from click.testing import CliRunner
+
+from srm import cli, dupes, file
+from srm.file import Path
+from srm.scan import walk
+
+
+def _zip(path, members):
+    with zipfile.ZipFile(str(path), 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+def test_find_groups_loose_files_and_archive_members(tmp_path):
+    rom = os.urandom(50000)
+    (tmp_path / 'a.bin').write_bytes(rom)
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'b.bin').write_bytes(rom)
+    # same size and head, different tail
+    (tmp_path / 'c.bin').write_bytes(rom[:-1] + bytes([rom[-1] ^ 1]))
+    _zip(tmp_path / 'd.zip', {'d.bin': rom, 'small.txt': b'small'})
+    (tmp_path / 'small.txt').write_bytes(b'small')
+    (tmp_path / 'unique.txt').write_bytes(b'unique')
+
+    found = list(dupes.find(walk(str(tmp_path))))
+    assert [(d.size, [str(p) for p in d.paths]) for d in found] == [
+        (50000, [str(tmp_path / 'a.bin'), str(tmp_path / 'sub' / 'b.bin'),
+                 str(tmp_path / 'd.zip' / 'd.bin')]),
+        (5, [str(tmp_path / 'small.txt'), str(tmp_path / 'd.zip' / 'small.txt')]),
+    ]
+    assert found[0].sha1 == Path(str(tmp_path / 'a.bin')).sha1()
+    assert found[1].sha1 == Path(str(tmp_path / 'small.txt')).sha1()
+
+
+def test_find_only_reads_colliding_files(tmp_path, monkeypatch):
+    big = os.urandom(100000)
+    (tmp_path / 'a.bin').write_bytes(big)
+    (tmp_path / 'b.bin').write_bytes(big)
+    (tmp_path / 'c.bin').write_bytes(os.urandom(100000))  # same size, different head
+    (tmp_path / 'd.bin').write_bytes(os.urandom(99999))  # unique size
+    os.link(str(tmp_path / 'a.bin'), str(tmp_path / 'a-link.bin'))
+    reads = []
+    digests = file.HashMixin.digests
+
+    def recording_digests(self, crc=True, md5=True, sha1=True, limit=None):
+        reads.append((self.name, limit))
+        return digests(self, crc, md5, sha1, limit)
+
+    monkeypatch.setattr(file.HashMixin, 'digests', recording_digests)
+    found, = dupes.find(walk(str(tmp_path)))
+    assert [p.name for p in found.paths] == ['a-link.bin', 'a.bin', 'b.bin']
+    assert found.copies == 2
+    heads = sorted(n for n, limit in reads if limit is not None)
+    fulls = sorted(n for n, limit in reads if limit is None)
+    assert len(heads) == 3 and 'c.bin' in heads and 'd.bin' not in heads
+    assert len(fulls) == 2 and 'c.bin' not in fulls
+
+
+def test_find_skips_hard_links_of_one_file(tmp_path):
+    rom = os.urandom(50000)
+    (tmp_path / 'a.bin').write_bytes(rom)
+    os.link(str(tmp_path / 'a.bin'), str(tmp_path / 'b.bin'))
+    assert list(dupes.find(walk(str(tmp_path)))) == []
+    _zip(tmp_path / 'c.zip', {'c.bin': rom})
+    found, = dupes.find(walk(str(tmp_path)))
+    assert len(found.paths) == 3 and found.copies == 2
+
+
+def test_link_replaces_loose_copies(tmp_path):
+    rom = os.urandom(50000)
+    for name in ('a.bin', 'b.bin', 'c.bin'):
+        (tmp_path / name).write_bytes(rom)
+    _zip(tmp_path / 'd.zip', {'d.bin': rom})
+    found, = dupes.find(walk(str(tmp_path)))
+    replaced = dupes.link(found)
+    assert [p.name for p in replaced] == ['b.bin', 'c.bin']
+    inodes = {(tmp_path / n).stat().st_ino for n in ('a.bin', 'b.bin', 'c.bin')}
+    assert len(inodes) == 1
+    assert (tmp_path / 'c.bin').read_bytes() == rom
+    assert dupes.link(found) == []
+    assert sorted(os.listdir(str(tmp_path))) == ['a.bin', 'b.bin', 'c.bin', 'd.zip']
+
+
+def test_reflink_keeps_files_independent(tmp_path):
+    rom = os.urandom(50000)
+    (tmp_path / 'a.bin').write_bytes(rom)
+    (tmp_path / 'b.bin').write_bytes(rom)
+    found, = dupes.find(walk(str(tmp_path)))
+    try:
+        dupes.link(found, dupes.REFLINK)
+    except OSError:
+        pass  # not supported by the file system, the file must be left as it was
+    assert (tmp_path / 'b.bin').read_bytes() == rom
+    assert (tmp_path / 'a.bin').stat().st_ino != (tmp_path / 'b.bin').stat().st_ino
+    assert sorted(os.listdir(str(tmp_path))) == ['a.bin', 'b.bin']
+
+
+def test_dupes_command(tmp_path):
+    rom = os.urandom(2048)
+    (tmp_path / 'a.bin').write_bytes(rom)
+    (tmp_path / 'b.bin').write_bytes(rom)
+    result = CliRunner().invoke(cli.dupes, ['--link', 'hardlink', str(tmp_path)])
+    assert result.exit_code == 0, result.output
+    assert str(tmp_path / 'b.bin') in result.output
+    assert 'Linked 1 file(s).' in result.output
+    assert '1 duplicate file(s), 2.0 KiB in extra copies.' in result.output
+    assert (tmp_path / 'a.bin').stat().st_ino == (tmp_path / 'b.bin').stat().st_ino
+    result = CliRunner().invoke(cli.dupes, [str(tmp_path)])
+    assert result.output == '0 duplicate file(s), 0 B in extra copies.\n'
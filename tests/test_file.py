@@ -2,7 +2,12 @@
 Test cases for file operations.
 """
 
+import hashlib
+import os
 import tempfile
+import zipfile
+import zlib
+from unittest.mock import patch
 
 from srm.file import Path
 
@@ -16,3 +21,89 @@ def test_path_calculates_hashes():
         assert p.md5() == '9e107d9d372bb6826bd81d3542a419d6'
         assert p.sha1() == '2fd4e1c67a2d28fced849ee1bb76e7391b93eb12'
         p.unlink()
+
+
+def test_path_calculates_digests_in_one_pass(tmp_path):
+    p = Path(str(tmp_path / 'fox'))
+    p.write_bytes(b'The quick brown fox jumps over the lazy dog' * 10000)
+    digests = p.digests()
+    assert digests == {'crc': p.crc(), 'md5': p.md5(), 'sha1': p.sha1()}
+    assert p.digests(md5=False, sha1=False) == {'crc': digests['crc']}
+
+
+def test_path_lists_zip_members_from_index(tmp_path):
+    p = Path(str(tmp_path / 'fox.zip'))
+    with zipfile.ZipFile(str(p), 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('dir/fox.bin', b'The quick brown fox jumps over the lazy dog')
+    assert p.is_archive()
+    member, = p.members()
+    assert member.archive == p
+    assert member.name == 'fox.bin'
+    assert member.size == 43
+    assert member.stored_crc == '414fa339'
+
+
+def test_path_glob_descends_into_zip(tmp_path):
+    (tmp_path / 'a.bin').write_bytes(b'a')
+    with zipfile.ZipFile(str(tmp_path / 'b.zip'), 'w') as archive:
+        archive.writestr('b.bin', b'b')
+    found = {str(p) for p in Path(str(tmp_path)).rglob('*')}
+    assert found == {str(tmp_path / n) for n in ['a.bin', 'b.zip', 'b.zip/b.bin']}
+    assert [p.name for p in Path(str(tmp_path / 'b.zip')).iterdir()] == ['b.bin']
+
+
+def test_zip_member_hashes_are_streamed(tmp_path):
+    data = os.urandom(1024) * 1024
+    p = Path(str(tmp_path / 'big.zip'))
+    with zipfile.ZipFile(str(p), 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('big.bin', data)
+    member, = p.members()
+    with patch.object(zipfile.ZipExtFile, 'read', autospec=True,
+                      side_effect=zipfile.ZipExtFile.read) as read:
+        digests = member.digests()
+    assert digests == {
+        'crc': '{:08x}'.format(zlib.crc32(data)),
+        'md5': hashlib.md5(data).hexdigest(),
+        'sha1': hashlib.sha1(data).hexdigest(),
+    }
+    assert member.crc() == member.stored_crc
+    # every read is limited to one chunk, so the member is never loaded in full
+    assert all(0 < c[0][1] <= Path._READ_SIZE for c in read.call_args_list)
+
+
+def test_digests_of_file_head(tmp_path):
+    data = os.urandom(100000)
+    p = Path(str(tmp_path / 'data'))
+    p.write_bytes(data)
+    assert p.digests(limit=40000)['sha1'] == hashlib.sha1(data[:40000]).hexdigest()
+    assert p.digests(limit=10)['crc'] == '{:08x}'.format(zlib.crc32(data[:10]))
+    assert p.digests(limit=0)['sha1'] == hashlib.sha1().hexdigest()
+    assert p.digests(limit=len(data) * 2) == p.digests()
+    with zipfile.ZipFile(str(tmp_path / 'data.zip'), 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('data', data)
+    member, = Path(str(tmp_path / 'data.zip')).members()
+    assert member.digests(limit=40000) == p.digests(limit=40000)
+
+
+def test_large_files_are_hashed_through_mmap(tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 12345)
+    p = Path(str(tmp_path / 'disc.iso'))
+    p.write_bytes(data)
+    with patch('srm.file._read_chunks') as read_chunks:
+        digests = p.digests()
+        head = p.digests(limit=2 * 1024 * 1024 + 1)
+    read_chunks.assert_not_called()
+    assert digests == {'crc': '{:08x}'.format(zlib.crc32(data)),
+                       'md5': hashlib.md5(data).hexdigest(),
+                       'sha1': hashlib.sha1(data).hexdigest()}
+    assert head['sha1'] == hashlib.sha1(data[:2 * 1024 * 1024 + 1]).hexdigest()
+    # small files and small heads are read into a buffer
+    assert p.digests(limit=100)['sha1'] == hashlib.sha1(data[:100]).hexdigest()
+
+
+def test_mmap_is_released_when_hashing_stops_early(tmp_path):
+    p = Path(str(tmp_path / 'disc.iso'))
+    p.write_bytes(os.urandom(2 * 1024 * 1024))
+    chunks = p._chunks(None)  # pylint: disable=protected-access
+    assert len(next(chunks)) == 256 * 1024
+    chunks.close()  # must not fail with exported pointers to the map
@@ -0,0 +1,59 @@
+"""
+Test cases for running operations on many directories.
+"""
+
+import threading
+import time
+
+import pytest
+
+from srm import multidir
+
+
+def test_map_dirs_yields_all_results():
+    dirs = [f'dir{i}' for i in range(50)]
+    results = dict(multidir.map_dirs(str.upper, dirs, workers=4))
+    assert results == {d: d.upper() for d in dirs}
+
+
+def test_map_dirs_runs_in_parallel():
+    dirs = [f'dir{i}' for i in range(10)]
+    start = time.monotonic()
+    list(multidir.map_dirs(lambda d: time.sleep(0.2), dirs, workers=10))
+    assert time.monotonic() - start < 1.0
+
+
+def test_map_dirs_streams_results():
+    release = threading.Event()
+
+    def work(directory):
+        if directory == 'slow':
+            release.wait(5)
+        return directory
+
+    results = multidir.map_dirs(work, ['slow', 'fast'], workers=2)
+    assert next(results) == ('fast', 'fast')
+    release.set()
+    assert next(results) == ('slow', 'slow')
+
+
+def test_map_dirs_reads_directories_lazily():
+    started = []
+
+    def dirs():
+        for i in range(100):
+            started.append(i)
+            yield str(i)
+
+    results = multidir.map_dirs(str, dirs(), workers=1)
+    next(results)
+    assert len(started) < 100
+    results.close()
+
+
+def test_map_dirs_raises_errors():
+    def work(directory):
+        raise ValueError(directory)
+
+    with pytest.raises(ValueError):
+        list(multidir.map_dirs(work, ['a']))
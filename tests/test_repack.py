@@ -0,0 +1,178 @@
+"""
+Test cases for rebuilding ROM set archives.
+"""
+
+import os
+import zipfile
+import zlib
+
+import pytest
+from click.testing import CliRunner
+
+from srm import cli, dat, repack, scan
+from srm.dat import DatafileXml
+
+ROMS = {name: os.urandom(size) for name, size in
+        [('p1.rom', 40000), ('shared.rom', 30000), ('c1.rom', 20000), ('gone.rom', 10)]}
+
+
+def _rom(name, merge=''):
+    data = ROMS[name]
+    merge = f' merge="{merge}"' if merge else ''
+    return f'<rom name="{name}"{merge} size="{len(data)}" crc="{zlib.crc32(data):08x}"/>'
+
+
+DAT_XML = f"""\
+<?xml version="1.0"?>
+<datafile>
+    <header><name>sets</name><description>sets</description><version>1</version>
+    <author>test</author></header>
+    <game name="parent">
+        <description>Parent</description>
+        {_rom('p1.rom')}
+        {_rom('shared.rom')}
+    </game>
+    <game name="clone" cloneof="parent" romof="parent">
+        <description>Clone</description>
+        {_rom('shared.rom', merge='shared.rom')}
+        {_rom('c1.rom')}
+    </game>
+    <game name="lost">
+        <description>Lost</description>
+        {_rom('gone.rom')}
+    </game>
+</datafile>
+"""
+
+
+@pytest.fixture
+def set_dir(tmp_path):
+    (tmp_path / 'set.dat').write_text(DAT_XML)
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'p1 (loose).bin').write_bytes(ROMS['p1.rom'])
+    with zipfile.ZipFile(str(src / 'old.zip'), 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as f:
+        f.writestr('shared renamed.bin', ROMS['shared.rom'])
+    with zipfile.ZipFile(str(src / 'stored.zip'), 'w', zipfile.ZIP_STORED) as f:
+        f.writestr('c1.bin', ROMS['c1.rom'])
+    return tmp_path
+
+
+def _plan(set_dir, set_type):
+    datafile = DatafileXml(str(set_dir / 'set.dat'))
+    results = scan.scan(str(set_dir / 'src'), md5=False, sha1=False)
+    return repack.plan(datafile, scan.match(results, datafile), set_type)
+
+
+def _contents(path):
+    with zipfile.ZipFile(str(path)) as f:
+        assert f.testzip() is None
+        return {i.filename: f.read(i) for i in f.infolist()}
+
+
+def test_repack_split_sets(set_dir):
+    out = set_dir / 'out'
+    results = {r.name: r for r in repack.repack(_plan(set_dir, dat.SPLIT), str(out), workers=2)}
+    assert {n: (r.written, r.copied, r.compressed) for n, r in results.items()} == {
+        'parent': (True, 1, 1),  # the deflated member is copied, the loose file compressed
+        'clone': (True, 0, 1),  # stored members are compressed
+        'lost': (False, 0, 0),
+    }
+    assert [r.name for r in results['lost'].missing] == ['gone.rom']
+    assert sorted(os.listdir(str(out))) == ['clone.zip', 'parent.zip']
+    assert _contents(out / 'parent.zip') == {n: ROMS[n] for n in ('p1.rom', 'shared.rom')}
+    assert _contents(out / 'clone.zip') == {'c1.rom': ROMS['c1.rom']}
+
+
+def test_repack_copies_compressed_data(set_dir):
+    out = set_dir / 'out'
+    list(repack.repack(_plan(set_dir, dat.SPLIT), str(out)))
+    with zipfile.ZipFile(str(set_dir / 'src' / 'old.zip')) as f:
+        source = f.infolist()[0]
+    with zipfile.ZipFile(str(out / 'parent.zip')) as f:
+        copied = f.getinfo('shared.rom')
+    # recompressing with the default level would not give the exact same size
+    assert (copied.compress_size, copied.CRC) == (source.compress_size, source.CRC)
+
+
+def test_repack_merged_and_non_merged_sets(set_dir):
+    merged = set_dir / 'merged'
+    list(repack.repack(_plan(set_dir, dat.MERGED), str(merged)))
+    assert os.listdir(str(merged)) == ['parent.zip']
+    assert set(_contents(merged / 'parent.zip')) == {'p1.rom', 'shared.rom', 'c1.rom'}
+    non_merged = set_dir / 'non-merged'
+    list(repack.repack(_plan(set_dir, dat.NON_MERGED), str(non_merged)))
+    assert set(_contents(non_merged / 'clone.zip')) == {'shared.rom', 'c1.rom'}
+
+
+def test_repack_skips_current_archives(set_dir):
+    out = set_dir / 'out'
+    list(repack.repack(_plan(set_dir, dat.SPLIT), str(out)))
+    mtime = (out / 'parent.zip').stat().st_mtime_ns
+    results = list(repack.repack(_plan(set_dir, dat.SPLIT), str(out)))
+    assert not any(r.written for r in results)
+    assert (out / 'parent.zip').stat().st_mtime_ns == mtime
+
+
+def test_repack_error_keeps_old_archive(set_dir):
+    out = set_dir / 'out'
+    out.mkdir()
+    (out / 'parent.zip').write_bytes(b'old')
+    archives = list(_plan(set_dir, dat.SPLIT))
+    os.remove(str(set_dir / 'src' / 'p1 (loose).bin'))
+    result = {r.name: r for r in repack.repack(archives, str(out))}['parent']
+    assert result.error and not result.written
+    assert (out / 'parent.zip').read_bytes() == b'old'
+    assert sorted(os.listdir(str(out))) == ['clone.zip', 'parent.zip']
+
+
+def test_repack_keeps_archive_with_unplanned_members(set_dir):
+    out = set_dir / 'out'
+    out.mkdir()
+    alt_dump = os.urandom(100)
+    with zipfile.ZipFile(str(out / 'parent.zip'), 'w') as f:
+        f.writestr('p1.rom', ROMS['p1.rom'])
+        f.writestr('p1 (alt dump).bin', alt_dump)
+    results = {r.name: r for r in repack.repack(_plan(set_dir, dat.SPLIT), str(out))}
+    assert not results['parent'].written
+    assert 'p1 (alt dump).bin' in results['parent'].error
+    assert _contents(out / 'parent.zip') == {
+        'p1.rom': ROMS['p1.rom'], 'p1 (alt dump).bin': alt_dump}
+    assert results['clone'].written
+
+
+def _corrupt(path, old, new):
+    data = path.read_bytes()
+    assert data.count(old) >= 1
+    path.write_bytes(data.replace(old, new, 1))
+
+
+def test_repack_checks_local_header_name(set_dir):
+    # the first occurrence of the name is in the local header, the index keeps the right name
+    _corrupt(set_dir / 'src' / 'old.zip', b'shared renamed.bin', b'shared RENAMED.bin')
+    results = {r.name: r for r in repack.repack(_plan(set_dir, dat.SPLIT), str(set_dir / 'out'))}
+    assert 'another name' in results['parent'].error
+    assert results['clone'].written
+
+
+def test_repack_reports_corrupt_member(set_dir):
+    src = set_dir / 'src' / 'stored.zip'
+    with zipfile.ZipFile(str(src), 'w', zipfile.ZIP_LZMA) as f:
+        f.writestr('c1.bin', ROMS['c1.rom'])
+    archives = list(_plan(set_dir, dat.SPLIT))
+    data = bytearray(src.read_bytes())
+    data[100:200] = bytes(100)
+    src.write_bytes(bytes(data))
+    results = {r.name: r for r in repack.repack(archives, str(set_dir / 'out'))}
+    assert results['clone'].error and not results['clone'].written
+    assert results['parent'].written
+
+
+def test_repack_command(set_dir):
+    (set_dir / '.srm').mkdir()
+    (set_dir / '.srm' / 'config').write_text('')
+    result = CliRunner().invoke(cli.repack, ['--dat', str(set_dir / 'set.dat'), '--set-type',
+                                             'merged', '-o', str(set_dir / 'out'), str(set_dir)])
+    assert result.exit_code == 0, result.output
+    assert '1 archive(s) rebuilt, 1 ROM(s) missing.' in result.output
+    assert set(_contents(set_dir / 'out' / 'parent.zip')) == {'p1.rom', 'shared.rom', 'c1.rom'}
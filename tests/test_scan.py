@@ -0,0 +1,194 @@
+"""
+Test cases for scanning directories of ROM files.
+"""
+
+import os
+import zipfile
+from unittest.mock import patch
+
+import pytest
+
+from srm.cache import HashCache
+from srm.dat import DatafileXml
+from srm.file import Path, ZipPath
+from srm.scan import Snapshot, match, rescan, scan, walk
+
+FOX = b'The quick brown fox jumps over the lazy dog'
+FOX_DIGESTS = {
+    'crc': '414fa339',
+    'md5': '9e107d9d372bb6826bd81d3542a419d6',
+    'sha1': '2fd4e1c67a2d28fced849ee1bb76e7391b93eb12',
+}
+
+
+@pytest.fixture
+def rom_dir(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / '.srm').mkdir()
+    for name in ['a.bin', 'b.bin', 'sub/c.bin', '.srm/config']:
+        (tmp_path / name).write_bytes(FOX)
+    return tmp_path
+
+
+def test_walk_skips_local_config_dir(rom_dir):
+    found = {os.path.relpath(str(p), str(rom_dir)) for p, _ in walk(str(rom_dir))}
+    assert found == {'a.bin', 'b.bin', os.path.join('sub', 'c.bin')}
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_scan_hashes_all_files(rom_dir, executor):
+    conf = {'scan.executor': executor, 'scan.workers': 2, 'scan.queue_depth': 1}
+    results = list(scan(str(rom_dir), conf))
+    assert len(results) == 3
+    for result in results:
+        assert isinstance(result.path, Path)
+        assert result.size == len(FOX)
+        assert result.digests == FOX_DIGESTS
+
+
+def test_scan_uses_hash_cache(rom_dir, tmp_path):
+    with HashCache(str(tmp_path / 'cache')) as hash_cache:
+        list(scan(str(rom_dir), hash_cache=hash_cache, md5=False, sha1=False))
+        (rom_dir / 'a.bin').write_bytes(b'new')
+        cached = hash_cache.get(str(rom_dir / 'b.bin'))
+        assert cached == {'crc': FOX_DIGESTS['crc']}
+        results = {r.path.name: r.digests for r in scan(str(rom_dir), hash_cache=hash_cache)}
+    assert results['a.bin']['crc'] != FOX_DIGESTS['crc']
+    assert results['b.bin'] == FOX_DIGESTS
+
+
+FOX_DAT = """\
+<?xml version="1.0"?>
+<datafile>
+    <header>
+        <name>Fox</name>
+        <description>Fox</description>
+        <version>1</version>
+        <author>Fox</author>
+    </header>
+    <game name="fox">
+        <description>Fox</description>
+        <rom name="fox.bin" size="43" crc="414FA339"/>
+    </game>
+</datafile>
+"""
+
+
+def test_scan_quick_checks_zip_members(rom_dir):
+    with zipfile.ZipFile(str(rom_dir / 'fox.zip'), 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('fox.bin', FOX)
+        archive.writestr('dog.bin', b'dog')
+    with patch.object(zipfile.ZipFile, 'open') as zip_open:
+        results = {str(r.path): r for r in scan(str(rom_dir), md5=False, sha1=False)}
+    zip_open.assert_not_called()
+    member = results[os.path.join(str(rom_dir), 'fox.zip', 'fox.bin')]
+    assert isinstance(member.path, ZipPath)
+    assert member.size == len(FOX)
+    assert member.digests == {'crc': FOX_DIGESTS['crc']}
+
+
+def test_scan_hashes_zip_members_when_deep(rom_dir):
+    with zipfile.ZipFile(str(rom_dir / 'fox.zip'), 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('fox.bin', FOX)
+    with patch.object(ZipPath, 'digests', autospec=True, return_value={'crc': 'hashed'}):
+        results = {r.path.name: r for r in scan(str(rom_dir), md5=False, sha1=False, deep=True)}
+    assert 'fox.zip' not in results
+    assert results['fox.bin'].digests == {'crc': 'hashed'}
+
+
+def test_scan_hashes_zip_members(rom_dir):
+    with zipfile.ZipFile(str(rom_dir / 'fox.zip'), 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('fox.bin', FOX)
+    results = {r.path.name: r for r in scan(str(rom_dir))}
+    assert results['fox.bin'].digests == FOX_DIGESTS
+
+
+def test_scan_reports_bad_zip_member_alone(rom_dir):
+    with zipfile.ZipFile(str(rom_dir / 'set.zip'), 'w', zipfile.ZIP_STORED) as archive:
+        archive.writestr('good.bin', FOX)
+        archive.writestr('bad.bin', FOX.upper())
+    data = (rom_dir / 'set.zip').read_bytes()
+    (rom_dir / 'set.zip').write_bytes(data.replace(FOX.upper(), FOX.upper()[:-1] + b'!'))
+    results = {r.path.name: r for r in scan(str(rom_dir), deep=True)}
+    assert 'set.zip' not in results
+    assert results['good.bin'].digests == FOX_DIGESTS and not results['good.bin'].error
+    assert 'Bad CRC-32' in results['bad.bin'].error and not results['bad.bin'].digests
+
+
+def test_scan_opens_each_zip_once(rom_dir):
+    with zipfile.ZipFile(str(rom_dir / 'set.zip'), 'w', zipfile.ZIP_DEFLATED) as archive:
+        for i in range(5):
+            archive.writestr(f'{i}.bin', FOX * i)
+    with patch('srm.file.zipfile.ZipFile', wraps=zipfile.ZipFile) as zip_file:
+        results = [r for r in scan(str(rom_dir), deep=True) if isinstance(r.path, ZipPath)]
+    assert len(results) == 5
+    assert zip_file.call_count == 1
+
+
+def test_match_quick_check_results_by_size_and_crc(rom_dir):
+    with zipfile.ZipFile(str(rom_dir / 'fox.zip'), 'w') as archive:
+        archive.writestr('fox.bin', FOX)
+        archive.writestr('dog.bin', b'dog')
+    (rom_dir / 'fox.dat').write_text(FOX_DAT)
+    datafile = DatafileXml(str(rom_dir / 'fox.dat'))
+    results = [r for r in scan(str(rom_dir), md5=False, sha1=False)
+               if isinstance(r.path, ZipPath)]
+    matched = {r.path.name: [(g.name, rom.name) for g, rom in m]
+               for r, m in match(results, datafile)}
+    assert matched == {'fox.bin': [('fox', 'fox.bin')], 'dog.bin': []}
+
+
+def test_rescan_only_hashes_changed_files(rom_dir):
+    first = {r.path: r for r in rescan(str(rom_dir))}
+    assert len(first) == 3
+    (rom_dir / 'a.bin').write_bytes(b'changed')
+    (rom_dir / 'b.bin').unlink()
+    (rom_dir / 'd.bin').write_bytes(FOX)
+    with patch.object(Path, 'digests', autospec=True, return_value=FOX_DIGESTS) as digests:
+        second = {r.path: r for r in rescan(str(rom_dir))}
+    assert {c[0][0].name for c in digests.call_args_list} == {'a.bin', 'd.bin'}
+    assert {p.name for p in second} == {'a.bin', 'c.bin', 'd.bin'}
+    unchanged = Path(str(rom_dir / 'sub' / 'c.bin'))
+    assert second[unchanged] == first[unchanged]
+
+
+def test_rescan_restores_zip_members(rom_dir):
+    with zipfile.ZipFile(str(rom_dir / 'fox.zip'), 'w') as archive:
+        archive.writestr('fox.bin', FOX)
+    first = list(rescan(str(rom_dir), md5=False, sha1=False))
+    with patch.object(Path, 'members', autospec=True) as members:
+        second = list(rescan(str(rom_dir), md5=False, sha1=False))
+    members.assert_not_called()
+    member = os.path.join(str(rom_dir), 'fox.zip', 'fox.bin')
+    assert [r for r in first if str(r.path) == member] == \
+        [r for r in second if str(r.path) == member]
+
+
+def test_snapshot_diff_reports_changes(rom_dir):
+    snapshot = Snapshot(str(rom_dir))
+    list(rescan(str(rom_dir), snapshot=snapshot, md5=False, sha1=False))
+    (rom_dir / 'a.bin').write_bytes(b'changed')
+    (rom_dir / 'b.bin').unlink()
+    (rom_dir / 'd.bin').write_bytes(FOX)
+    changes = snapshot.diff(walk(str(rom_dir)), wanted={'crc'})
+    assert changes.added == ['d.bin']
+    assert changes.modified == ['a.bin']
+    assert changes.deleted == ['b.bin']
+    assert changes.unchanged == [os.path.join('sub', 'c.bin')]
+    # stored results do not have all the requested hashes
+    assert snapshot.diff(walk(str(rom_dir))).unchanged == []
+
+
+def test_scan_skips_files_with_unknown_size(rom_dir):
+    (rom_dir / 'junk.txt').write_bytes(b'junk')
+    with zipfile.ZipFile(str(rom_dir / 'fox.zip'), 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('fox.bin', FOX)
+        archive.writestr('dog.bin', b'dog')
+    with patch.object(Path, 'digests', autospec=True, return_value=FOX_DIGESTS) as path_digests, \
+            patch.object(ZipPath, 'digests', autospec=True, return_value=FOX_DIGESTS):
+        results = {r.path.name: r for r in scan(str(rom_dir), deep=True, sizes={len(FOX)})}
+    assert path_digests.call_count == 3
+    assert results['junk.txt'].digests == {}
+    assert results['dog.bin'].digests == {}
+    assert results['fox.bin'].digests == FOX_DIGESTS
+    assert results['c.bin'].digests == FOX_DIGESTS
@@ -0,0 +1,52 @@
+"""
+Test cases for the CLI startup time.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import srm
+
+# Modules that are slow to import and are not needed to show the status of a directory.
+HEAVY_MODULES = ['asyncio', 'boltons', 'hashlib', 'pbr', 'sqlite3', 'toml', 'urllib.request',
+                 'xml.etree.ElementTree', 'zipfile']
+
+MAIN = """\
+import sys
+sys.argv = ['srm'] + sys.argv[1:]
+try:
+    import srm.__main__
+except SystemExit:
+    pass
+print(' '.join(sys.modules))
+"""
+
+
+def _imported_modules(*args):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(srm.__file__)))
+    output = subprocess.run([sys.executable, '-c', MAIN] + list(args), cwd=root, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return set(output.splitlines()[-1].split())
+
+
+@pytest.mark.parametrize("args", [
+    ['--help'],
+    ['status', '--help'],
+    ['status', '{set_dir}'],
+])
+def test_startup_does_not_import_heavy_modules(args, tmp_path):
+    (tmp_path / '.srm').mkdir()
+    (tmp_path / '.srm' / 'config').write_text('')
+    modules = _imported_modules(*(a.format(set_dir=tmp_path) for a in args))
+    assert 'srm.cli' in modules
+    assert [m for m in HEAVY_MODULES if m in modules] == []
+
+
+def test_version_is_resolved_lazily():
+    assert 'pbr' not in _imported_modules('--help')
+    assert 'pbr' in _imported_modules('--version')
+    assert srm.__version__ == srm.__getattr__('__version__')
+    assert '__version__' in dir(srm)
@@ -1,3 +1,65 @@
 """
 Test cases for "status" command.
 """
+
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from srm import cli, summary
+
+SUMMARY = summary.Summary(
+    last_scan=0.0,
+    dat_name='Nintendo - Game Boy',
+    dat_version='20171226-085946',
+    dat_roms=10,
+    dat_size=10 * 1024 * 1024,
+    files=9,
+    disk_size=4 * 1024 * 1024,
+    valid=7,
+    invalid=1,
+    duplicate=1,
+    missing=3,
+)
+
+
+@pytest.fixture
+def set_dir(tmp_path):
+    os.makedirs(str(tmp_path / '.srm'))
+    (tmp_path / '.srm' / 'config').write_text('')
+    return tmp_path
+
+
+def test_status_not_initialized(tmp_path):
+    result = CliRunner().invoke(cli.status, [str(tmp_path)])
+    assert result.exit_code != 0
+    assert 'not initialized' in result.output
+
+
+def test_status_not_scanned(set_dir):
+    result = CliRunner().invoke(cli.status, [str(set_dir)])
+    assert result.exit_code == 0
+    assert 'Not scanned yet' in result.output
+
+
+def test_status_shows_saved_summary(set_dir):
+    summary.save(SUMMARY, str(set_dir))
+    assert summary.load(str(set_dir)) == SUMMARY
+    result = CliRunner().invoke(cli.status, [str(set_dir)])
+    assert result.exit_code == 0
+    assert 'Nintendo - Game Boy (20171226-085946)' in result.output
+    assert '10 (10.0 MiB)' in result.output
+    assert 'Missing:   3' in result.output
+
+
+def test_status_recursive(set_dir):
+    for name in ['gb', 'gba']:
+        os.makedirs(str(set_dir / name / '.srm'))
+        (set_dir / name / '.srm' / 'config').write_text('')
+    os.makedirs(str(set_dir / 'unmanaged'))
+    summary.save(SUMMARY, str(set_dir / 'gba'))
+    result = CliRunner().invoke(cli.status, ['--recursive', str(set_dir)])
+    assert result.exit_code == 0
+    assert sorted(l for l in result.output.splitlines() if l.endswith(':')) == sorted([
+        f'{set_dir}:', f'{set_dir / "gb"}:', f'{set_dir / "gba"}:'])
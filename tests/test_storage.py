@@ -0,0 +1,60 @@
+"""
+Test cases for safe file writes.
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+from srm import storage
+
+
+def test_atomic_write_replaces_file(tmp_path):
+    path = tmp_path / 'sub' / 'file'
+    with storage.atomic_write(str(path)) as f:
+        f.write('one')
+        assert not path.exists()
+    assert path.read_text() == 'one'
+    with storage.atomic_write(str(path), 'wb') as f:
+        f.write(b'two')
+    assert path.read_text() == 'two'
+    assert os.listdir(str(tmp_path / 'sub')) == ['file']
+
+
+def test_atomic_write_keeps_old_file_on_error(tmp_path):
+    path = tmp_path / 'file'
+    path.write_text('old')
+    with pytest.raises(ValueError):
+        with storage.atomic_write(str(path)) as f:
+            f.write('new')
+            raise ValueError
+    assert path.read_text() == 'old'
+    assert os.listdir(str(tmp_path)) == ['file']
+
+
+def test_atomic_path_uses_unique_temp_files(tmp_path):
+    path = str(tmp_path / 'file')
+    with storage.atomic_path(path) as tmp1, storage.atomic_path(path) as tmp2:
+        assert tmp1 != tmp2
+        open(tmp1, 'w').close()
+        open(tmp2, 'w').close()
+
+
+def test_lock_is_exclusive(tmp_path):
+    events = []
+
+    def hold(name):
+        with storage.dir_lock(str(tmp_path)):
+            events.append(f'{name} start')
+            time.sleep(0.05)
+            events.append(f'{name} end')
+
+    threads = [threading.Thread(target=hold, args=(str(i),)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [e.split()[1] for e in events] == ['start', 'end'] * 3
+    assert (tmp_path / '.srm' / 'lock').exists()
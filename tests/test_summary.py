@@ -0,0 +1,26 @@
+"""
+Test cases for scan statistics.
+"""
+
+from srm.file import Path
+from srm.scan import ScanResult, match
+from srm.summary import tally
+from srm.verify import classify
+
+from .test_dat import DAT_02, _dat_from_xml
+
+
+def test_tally_counts_verdicts(tmp_path):
+    dat = _dat_from_xml(DAT_02['xml'])
+    results = [
+        ScanResult(Path('u1.bin'), 524288, {'crc': '6238790a'}),
+        ScanResult(Path('u1 copy.bin'), 524288, {'crc': '6238790a'}),
+        ScanResult(Path('junk.txt'), 12, {'crc': '00000000'}),
+    ]
+    stats = tally(dat, classify(match(results, dat), dat))
+    assert stats.dat_name == DAT_02['header']['name']
+    assert stats.dat_roms == 22
+    assert stats.files == 3
+    assert stats.disk_size == 524288 * 2 + 12
+    assert (stats.valid, stats.duplicate, stats.invalid) == (1, 1, 1)
+    assert stats.missing == 21
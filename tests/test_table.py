@@ -0,0 +1,69 @@
+"""
+Test cases for the columnar ROM table.
+"""
+
+from unittest.mock import patch
+
+import pytest
+
+from srm import table
+from srm.table import RomTable
+
+from .test_dat import DAT_02, DAT_03, _dat_from_xml
+
+
+@pytest.fixture(params=['numpy', 'bisect'])
+def join_backend(request):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+        yield
+    else:
+        with patch.object(table, 'numpy', None):
+            yield
+
+
+def test_table_joins_by_crc_and_size(join_backend):
+    dat = _dat_from_xml(DAT_02['xml'])
+    rom_table = RomTable(dat)
+    assert len(rom_table) == 22
+    crcs = [0x3d7cb329, 0x6238790a, 0x12345678, 0xc0ab3efc]
+    sizes = [131072, 524288, 1, 1]
+    matched = sorted((i, rom_table.match(row)[1].name)
+                     for i, row in rom_table.join(crcs, sizes))
+    assert matched == [(0, 'mmd0x1.u124'), (0, 'mmd0x2.u124.bin'), (1, 'u1.bin')]
+    assert sorted(i for i, _ in rom_table.join(crcs)) == [0, 0, 1, 3, 3]
+
+
+def test_table_materializes_match(join_backend):
+    dat = _dat_from_xml(DAT_03['xml'])
+    rom_table = RomTable(dat)
+    (_, row), = rom_table.join([0x331cf7de])
+    assert rom_table.match(row) == dat.matching(crc='331cf7de')[0]
+    assert rom_table.digests(row) == {
+        'crc': '331cf7de',
+        'md5': '3d57e0391c8191c105a4f015a0c103e9',
+        'sha1': '666ed5d34f508c8805a67f4400fc01a1f2817e03',
+    }
+
+
+def test_table_skips_roms_without_crc(join_backend):
+    dat = _dat_from_xml("""<?xml version="1.0"?>
+<datafile>
+    <header>
+        <name>Test</name>
+        <description>Test</description>
+        <version>1</version>
+        <author>Test</author>
+    </header>
+    <game name="nodump">
+        <description>nodump</description>
+        <rom name="empty.bin" size="0" md5="d41d8cd98f00b204e9800998ecf8427e"/>
+        <rom name="zero.bin" size="4" crc="00000000"/>
+    </game>
+</datafile>
+""")
+    rom_table = RomTable(dat)
+    assert len(rom_table) == 1
+    assert list(rom_table.join([0], [0])) == []
+    (_, row), = rom_table.join([0], [4])
+    assert rom_table.match(row)[1].name == 'zero.bin'
@@ -0,0 +1,170 @@
+"""
+Test cases for updating tracked DATs.
+"""
+
+import http.client
+import io
+import os
+import threading
+import time
+from http import server
+
+import pytest
+from click.testing import CliRunner
+
+from srm import cache, cli, update
+from srm.update import FetchState, MirrorSource, Source, Updater
+
+from .test_dat import DAT_02, DAT_03
+
+URL = 'https://datomatic.example/download/gb.dat'
+
+
+@pytest.fixture
+def set_dir(tmp_path):
+    directory = tmp_path / 'roms'
+    os.makedirs(str(directory / '.srm'))
+    (directory / '.srm' / 'config').write_text('')
+    return directory
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    directory = tmp_path / 'mirror'
+    directory.mkdir()
+    (directory / 'gb.dat').write_text(DAT_03['xml'])
+    return directory
+
+
+def test_update_fetches_and_compiles_dat(set_dir, mirror):
+    updater = Updater({'https': MirrorSource(str(mirror))})
+    result, = updater.update([(str(set_dir), [URL])])
+    assert result.changed and not result.error
+    assert result.path == update.dat_path(str(set_dir), URL)
+    assert open(result.path).read() == DAT_03['xml']
+    compiled = cache.DatCache(cache.cache_dir(str(set_dir))).load(result.path)
+    assert compiled.name == 'Nintendo - Game Boy'
+    compiled.close()
+
+
+def test_update_skips_unchanged_dat(set_dir, mirror):
+    updater = Updater({'https': MirrorSource(str(mirror))})
+    list(updater.update([(str(set_dir), [URL])]))
+    result, = updater.update([(str(set_dir), [URL])])
+    assert not result.changed and not result.error
+    # touched, but same content
+    os.utime(str(mirror / 'gb.dat'), ns=(0, 0))
+    result, = updater.update([(str(set_dir), [URL])])
+    assert not result.changed and not result.error
+    (mirror / 'gb.dat').write_text(DAT_02['xml'])
+    result, = updater.update([(str(set_dir), [URL])])
+    assert result.changed
+    assert open(result.path).read() == DAT_02['xml']
+
+
+def test_update_reports_errors(set_dir, mirror):
+    (mirror / 'bad.dat').write_text('<datafile>')
+    updater = Updater({'https': MirrorSource(str(mirror))})
+    urls = ['https://x/missing.dat', 'https://x/bad.dat', 'ftp://x/gb.dat', 'https://x/', URL]
+    errors = {r.url: bool(r.error) for r in updater.update([(str(set_dir), urls)])}
+    assert [errors[url] for url in urls] == [True, True, True, True, False]
+    assert not os.path.exists(update.dat_path(str(set_dir), 'https://x/missing.dat') + '.tmp')
+
+
+def test_update_fetches_concurrently(tmp_path):
+    class SlowSource(Source):
+        def open(self, url, state):
+            time.sleep(0.2)
+            return None
+
+    tracked = [(str(tmp_path / str(i)), [f'slow://x/{j}.dat' for j in range(4)])
+               for i in range(5)]
+    start = time.monotonic()
+    results = list(Updater({'slow': SlowSource()}, connections=20).update(tracked))
+    assert len(results) == 20
+    assert time.monotonic() - start < 1.0
+
+
+class _Handler(server.BaseHTTPRequestHandler):
+    requests = []  # type: list
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        _Handler.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        data = DAT_03['xml'].encode()
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Last-Modified', 'Tue, 26 Dec 2017 08:59:46 GMT')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture
+def http_url():
+    httpd = server.HTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    _Handler.requests = []
+    yield f'http://127.0.0.1:{httpd.server_port}/gb.dat'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_update_sends_conditional_requests(set_dir, http_url):
+    result, = Updater().update([(str(set_dir), [http_url])])
+    assert result.changed
+    result, = Updater().update([(str(set_dir), [http_url])])
+    assert not result.changed and not result.error
+    first, second = _Handler.requests
+    assert 'If-None-Match' not in first
+    assert second['If-None-Match'] == '"v1"'
+    assert second['If-Modified-Since'] == 'Tue, 26 Dec 2017 08:59:46 GMT'
+
+
+def test_update_command(set_dir, mirror):
+    url = (mirror / 'gb.dat').as_uri()
+    (set_dir / '.srm' / 'config').write_text(f'[dat]\nsources = ["{url}"]\n')
+    result = CliRunner().invoke(cli.update, [str(set_dir)])
+    assert result.exit_code == 0
+    assert result.output == f"{url}: updated\n"
+    result = CliRunner().invoke(cli.update, [str(set_dir)])
+    assert result.output == f"{url}: up to date\n"
+
+
+def test_fetch_state_is_saved(set_dir, mirror):
+    list(Updater({'https': MirrorSource(str(mirror))}).update([(str(set_dir), [URL])]))
+    state = update._load_state(str(set_dir))  # pylint: disable=protected-access
+    assert set(state) == {URL}
+    assert state[URL] != FetchState()
+
+
+def test_update_keeps_unchanged_copy(set_dir, mirror):
+    updater = Updater({'https': MirrorSource(str(mirror))})
+    result, = updater.update([(str(set_dir), [URL])])
+    os.utime(result.path, ns=(0, 0))
+    os.utime(str(mirror / 'gb.dat'), ns=(0, 0))  # the source cannot tell the DAT is the same
+    result, = updater.update([(str(set_dir), [URL])])
+    assert not result.changed and not result.error
+    assert os.stat(result.path).st_mtime_ns == 0
+    assert sorted(os.listdir(os.path.dirname(result.path))) == ['gb.dat', 'state']
+
+
+def test_update_reports_truncated_download(set_dir):
+    class TruncatedStream(io.BytesIO):
+        def read(self, size=-1):
+            raise http.client.IncompleteRead(b'<datafile>', 100)
+
+    class TruncatedSource(Source):
+        def open(self, url, state):
+            return TruncatedStream(), FetchState()
+
+    result, = Updater({'https': TruncatedSource()}).update([(str(set_dir), [URL])])
+    assert 'IncompleteRead' in result.error and not result.changed
+    assert not os.path.exists(update.dat_path(str(set_dir), URL))
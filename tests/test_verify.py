@@ -0,0 +1,136 @@
+"""
+Test cases for verifying ROM files against a DAT.
+"""
+
+import os
+import sqlite3
+
+from click.testing import CliRunner
+
+from srm import cache, cli, scan, summary, verify
+from srm.file import Path
+from srm.scan import ScanResult, match
+
+from .test_dat import DAT_02, _dat_from_xml
+from .test_scan import FOX, FOX_DAT
+
+
+def test_classify_files_and_missing_roms():
+    dat = _dat_from_xml(DAT_02['xml'])
+    results = [
+        ScanResult(Path('u1.bin'), 524288, {'crc': '6238790a'}),
+        ScanResult(Path('u1 copy.bin'), 524288, {'crc': '6238790a'}),
+        ScanResult(Path('u2.bin'), 10, {'crc': '00000000'}),
+        ScanResult(Path('junk.txt'), 12, {'crc': '00000000'}),
+        ScanResult(Path('locked.txt'), 0, {}, error='Permission denied'),
+    ]
+    verdicts = list(verify.classify(match(results, dat), dat))
+    assert [(v.status, v.result) for v in verdicts[:5]] == [
+        (verify.GOOD, results[0]),
+        (verify.DUPLICATE, results[1]),
+        (verify.BAD, results[2]),
+        (verify.UNKNOWN, results[3]),
+        (verify.UNKNOWN, results[4]),
+    ]
+    missing = verdicts[5:]
+    assert len(missing) == 21
+    assert {v.status for v in missing} == {verify.MISSING}
+    assert ('u1.bin', 'u1.bin') not in {(g.name, r.name) for v in missing for g, r in v.matches}
+
+
+def test_classify_streams_results():
+    dat = _dat_from_xml(DAT_02['xml'])
+
+    def results():
+        yield ScanResult(Path('u1.bin'), 524288, {'crc': '6238790a'})
+        raise AssertionError('read past the first result')
+
+    verdict = next(verify.classify(match(results(), dat), dat))
+    assert verdict.status == verify.GOOD
+
+
+def test_tally_verdicts():
+    dat = _dat_from_xml(DAT_02['xml'])
+    results = [
+        ScanResult(Path('u1.bin'), 524288, {'crc': '6238790a'}),
+        ScanResult(Path('u2.bin'), 10, {'crc': '00000000'}),
+    ]
+    stats = summary.tally(dat, verify.classify(match(results, dat), dat))
+    assert (stats.files, stats.valid, stats.invalid, stats.missing) == (2, 1, 1, 21)
+
+
+def _set_dir(tmp_path):
+    (tmp_path / '.srm').mkdir()
+    (tmp_path / '.srm' / 'config').write_text('')
+    (tmp_path / 'fox.dat').write_text(FOX_DAT)
+    (tmp_path / 'fox.bin').write_bytes(FOX)
+    (tmp_path / 'copy.bin').write_bytes(FOX)
+    (tmp_path / 'junk.bin').write_bytes(b'junk')
+    return tmp_path
+
+
+def test_check_command(tmp_path):
+    set_dir = _set_dir(tmp_path)
+    result = CliRunner().invoke(cli.check, ['--dat', str(set_dir / 'fox.dat'), str(set_dir)])
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert 'unknown   ' + str(set_dir / 'fox.dat') in lines
+    assert 'unknown   ' + str(set_dir / 'junk.bin') in lines
+    assert sum(line.startswith('duplicate ') for line in lines) == 1
+    assert not any(line.startswith('good') for line in lines)
+    stats = summary.load(str(set_dir))
+    assert (stats.files, stats.valid, stats.duplicate, stats.invalid) == (4, 1, 1, 2)
+    assert 'Valid:     1' in result.output
+
+
+def test_check_command_evicts_deleted_files(tmp_path):
+    set_dir = _set_dir(tmp_path)
+    args = ['--dat', str(set_dir / 'fox.dat'), str(set_dir)]
+    CliRunner().invoke(cli.check, args)
+    (set_dir / 'copy.bin').unlink()
+    CliRunner().invoke(cli.check, args)
+    db_path = os.path.join(cache.cache_dir(str(set_dir)), 'hashes.sqlite')
+    with sqlite3.connect(db_path) as conn:
+        paths = [row[0] for row in conn.execute('SELECT path FROM hash')]
+    assert paths == [str(set_dir / 'fox.bin')]
+
+
+def test_check_command_uses_tracked_dat(tmp_path):
+    set_dir = _set_dir(tmp_path)
+    (set_dir / '.srm' / 'config').write_text('[dat]\nsources = ["https://x/fox.dat"]\n')
+    result = CliRunner().invoke(cli.check, [str(set_dir)])
+    assert result.exit_code != 0
+    assert "Try 'update' first" in result.output
+    os.makedirs(str(set_dir / '.srm' / 'dats'))
+    os.replace(str(set_dir / 'fox.dat'), str(set_dir / '.srm' / 'dats' / 'fox.dat'))
+    result = CliRunner().invoke(cli.check, ['--all', str(set_dir)])
+    assert result.exit_code == 0, result.output
+    assert sum(line.startswith('good') for line in result.output.splitlines()) == 1
+
+
+def test_check_command_without_dat(tmp_path):
+    set_dir = _set_dir(tmp_path)
+    result = CliRunner().invoke(cli.check, [str(set_dir)])
+    assert result.exit_code != 0
+    assert 'use --dat' in result.output
+
+
+def test_check_only_scans_changed_files(tmp_path, monkeypatch):
+    set_dir = _set_dir(tmp_path)
+    args = ['--dat', str(set_dir / 'fox.dat'), str(set_dir)]
+    first = CliRunner().invoke(cli.check, args)
+    scanned = []
+    scan_files = scan.scan_files
+
+    def recording_scan_files(files, *args, **kwargs):
+        files = list(files)
+        scanned.extend(p.name for p, _ in files)
+        return scan_files(files, *args, **kwargs)
+
+    monkeypatch.setattr(scan, 'scan_files', recording_scan_files)
+    second = CliRunner().invoke(cli.check, args)
+    assert scanned == []
+    assert sorted(second.output.splitlines()) == sorted(first.output.splitlines())
+    (set_dir / 'new.bin').write_bytes(b'new')
+    CliRunner().invoke(cli.check, args)
+    assert scanned == ['new.bin']